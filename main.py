@@ -1,17 +1,43 @@
+from modules import startup
 from modules import html_deliver
+from modules import compression
+from modules import archive
+from modules import hotcache
+from modules import paths
 from modules import transfers
 from modules import ratelimit
 from modules import timestamp
 from modules.logs import Log
 from modules import cleaner
+from modules import reconcile
+from modules import reclaim
+from modules import scheduler
+from modules import cluster
+from modules import loopmonitor
+from modules import metrics
 from modules import errors
+from modules import admin
+from modules import ingest
+from modules import preflight
+from modules import profiler
+from modules import memdiag
+from modules import recorder
+from modules import replication
+from modules import database
 
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
-from fastapi import FastAPI, Request, Form, File, UploadFile
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, Response, StreamingResponse, PlainTextResponse
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from functools import partial
+from threading import Thread
 import uvicorn
 import dotenv
+import hashlib
+import time
 import os
 
 
@@ -19,12 +45,87 @@ MainLimiter = ratelimit.ClientRateLimiter("(root)", 500, 3, 180)
 ApiLimiter = ratelimit.ClientRateLimiter("api/", 100, 5, 360)
 
 
+def warm_up_databases() -> None:
+    """ Read shares table in background, so workers answer requests while it loads. """
+    started = time.perf_counter()
+    transfers.transfers_db.load()
+    startup.report.add("shares db", started, f"{len(transfers.transfers_db.get_all_keys())} rows")
+    startup.report.log()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.report.mark("imports")
+
+    stat_cache_ttl = os.getenv("STAT_CACHE_TTL_S")
+    if stat_cache_ttl:
+        paths.enable_stat_cache(float(stat_cache_ttl))
+
+    cluster.configure()
+    transfers.init()
+    scheduler.scheduler.configure()
+    metrics.register("startup", startup.report.as_dict)
+    metrics.register("hot_files", transfers.hot_files.stats)
+    metrics.register("shared_files_cache", transfers.shared_files_cache.stats)
+    metrics.register("live_codes", lambda: {"count": transfers.live_codes.count, "filter_bytes": transfers.live_codes.size_bytes()})
+    metrics.register("reconcile", reconcile.reconciler.stats)
+    metrics.register("space", transfers.space_ledger.stats)
+    metrics.register("transfers", scheduler.scheduler.stats)
+    metrics.register("event_loop", loopmonitor.monitor.stats)
+    metrics.register("reclaim", reclaim.reclaimer.stats)
+    metrics.register("downloads", transfers.download_counter.stats)
+    metrics.register("cluster", cluster.stats)
+    metrics.register("blob_store", lambda: transfers.blob_store.stats())
+    metrics.register("preflight", preflight.grants.stats)
+    metrics.register("profiler", profiler.profiler.stats)
+    metrics.register("memory", memdiag.stats)
+    metrics.register("traffic_recorder", recorder.recorder.stats)
+    metrics.register("owned_codes", transfers.owner_index.stats)
+    metrics.register("replication", lambda: {"change_log": transfers.transfers_db.changes.stats(), "follower": replication.follower.stats()})
+    memdiag.track("ratelimit (root)", MainLimiter)
+    memdiag.track("ratelimit api/", ApiLimiter)
+    memdiag.track("hot_files", transfers.hot_files)
+    memdiag.track("shared_files_cache", transfers.shared_files_cache)
+    memdiag.track("live_codes", transfers.live_codes)
+    memdiag.track("space", transfers.space_ledger)
+    memdiag.track("transfers_db", transfers.transfers_db)
+    memdiag.track("downloads", transfers.download_counter)
+    memdiag.track("preflight", preflight.grants)
+    memdiag.track("owned_codes", transfers.owner_index)
+    memdiag.track("timestamp.read_timestamp", timestamp.read_timestamp)
+    memdiag.track("timestamp.convert_to_readable", timestamp.convert_to_readable)
+    memdiag.track("timestamp.convert_to_timestamp", timestamp.convert_to_timestamp)
+    loopmonitor.monitor.start()
+    profiler.profiler.configure()
+    profiler.install_signal_handler()
+    memdiag.tracer.configure()
+    recorder.recorder.configure()
+    # Before the cleaner: a standby must never remove shares of the primary's table.
+    replication.follower.configure(transfers.transfers_db)
+    startup.report.mark("storage init")
+
+    reclaim.reclaimer.start()
+    cleaner.Cleaner()
+    startup.report.mark("background services")
+
+    Thread(target=warm_up_databases, name="db-warm-up", daemon=True).start()
+    yield
+    loopmonitor.monitor.stop()
+    transfers.download_counter.flush()
+    recorder.recorder.stop()
+
+
 api = FastAPI(
     docs_url=None,
     redoc_url=None,
     openapi_url=None,
+    lifespan=lifespan,
 )
 api.mount('/web/static', StaticFiles(directory="./web/static", html=True), name="static")
+api.add_middleware(cluster.ClusterRoutingMiddleware, has_code=transfers.is_code_acceptable)
+api.add_middleware(scheduler.TransferSchedulerMiddleware, limiter=ApiLimiter)
+api.add_middleware(loopmonitor.LoadSheddingMiddleware)
+api.add_middleware(replication.ReadOnlyReplicaMiddleware)
 api.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -32,6 +133,8 @@ api.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+api.add_middleware(profiler.RouteMarkerMiddleware)
+api.add_middleware(recorder.TrafficRecorderMiddleware)
 
 
 def build_error_response(message: str) -> JSONResponse:
@@ -41,6 +144,82 @@ def build_error_response(message: str) -> JSONResponse:
     }, 400)
 
 
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    return any(tag.strip().removeprefix("W/") in (etag, "*") for tag in if_none_match.split(","))
+
+
+def build_cached_response(cached: hotcache.CachedFile, accepts_gzip: bool) -> Response:
+    if not cached.encoding:
+        return Response(cached.body, headers=cached.headers)
+
+    if accepts_gzip:
+        return Response(cached.body, headers={**cached.headers, "content-encoding": cached.encoding, "vary": "accept-encoding"})
+
+    # Iterated in threadpool by StreamingResponse, decompressed body is never held whole.
+    chunks = compression.iter_decompressed([cached.body])
+    return StreamingResponse(chunks, headers={**cached.headers, "content-length": str(cached.size)})
+
+
+async def build_file_response(blob_name: str, name: str, size: int, stored_size: int, encoding: str, accepts_gzip: bool) -> Response:
+    """
+    Send stored blob. Compressed blobs are passed through or decompressed on the fly.
+    Blobs on local disk are sent as files, others are streamed from the blob store.
+    Blob is looked up and opened in the threadpool (file stats, S3 request until response headers).
+    """
+    passthrough = bool(encoding) and accepts_gzip
+    encoding_headers = {"content-encoding": encoding, "vary": "accept-encoding"} if passthrough else {}
+
+    path = await run_in_threadpool(transfers.blob_store.local_path, blob_name)
+    if path is not None and (not encoding or passthrough):
+        return FileResponse(path, filename=name, headers=encoding_headers or None)
+
+    try:
+        chunks = await run_in_threadpool(transfers.blob_store.iter_chunks, blob_name)
+    except FileNotFoundError:
+        Log.error(f"Blob of share is missing: {blob_name}")
+        return build_error_response(errors.INVALID_CODE)
+
+    headers = {**hotcache.build_download_headers(name), **encoding_headers}
+    if encoding and not passthrough:
+        chunks = compression.iter_decompressed(chunks)
+    headers["content-length"] = str(stored_size if passthrough else size)
+    return StreamingResponse(chunks, headers=headers)
+
+
+def build_transfer_response(file: transfers.SharedFile, **extra) -> JSONResponse:
+    return JSONResponse({
+        "status": True,
+        "code": file.code,
+        "expire": timestamp.convert_to_readable(file.date_expire),
+        "files": len(file.get_members()),
+        "max_downloads": file.max_downloads,
+        **extra
+    }, 200)
+
+
+def build_bundle_response(file: transfers.SharedFile) -> StreamingResponse:
+    """ Stream all bundle's files as ZIP archive built on the fly. """
+    members = []
+    for index, member in enumerate(file.get_members()):
+        members.append(archive.ZipMember(
+            member["name"],
+            member["size"],
+            partial(transfers.iter_member_content, file, index)
+        ))
+
+    headers = hotcache.build_download_headers(file.name)
+    return StreamingResponse(archive.iter_zip(members), headers=headers)
+
+
+def burn_after_sending(response: Response, file: transfers.SharedFile, downloads: int) -> Response:
+    """ Remove share once the response with it's last allowed download is sent. """
+    if file.max_downloads and downloads >= file.max_downloads:
+        response.background = BackgroundTask(transfers.remove_exhausted, file)
+    return response
+
+
 @api.get("/")
 @api.get("/{code}")
 @MainLimiter.gate
@@ -51,16 +230,50 @@ async def home(request: Request, code: str = None) -> HTMLResponse:
 
 @api.post("/api/transfer")
 @ApiLimiter.gate
-async def transfer(request: Request, file: UploadFile = File(...), expire: int = Form(...)) -> JSONResponse:
-    result = transfers.SharedFile.create_shared_file(file, expire, request.client.host)
+async def transfer(request: Request) -> JSONResponse:
+    result = await ingest.receive_transfer(request)
+    recorder.annotate(request, grant=request.headers.get(preflight.TOKEN_HEADER))
     if isinstance(result, errors.T_Error):
         Log.error(f"failed to transfer file: {result}")
         return build_error_response(result)
 
+    recorder.annotate(
+        request, code=result.code, files=len(result.get_members()),
+        expire=int(result.get_lifetime()), max_downloads=result.max_downloads
+    )
+    return build_transfer_response(result)
+
+
+@api.post("/api/transfer/preflight")
+@ApiLimiter.gate
+async def transfer_preflight(request: Request) -> JSONResponse:
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+
+    result = await run_in_threadpool(preflight.preflight, request.client.host, body)
+    if recorder.recorder.active and isinstance(body, dict):
+        files = preflight.parse_files(body)
+        if not isinstance(files, errors.T_Error):
+            recorder.annotate(
+                request, files=len(files), size=sum(file["size"] for file in files),
+                expire=body.get("expire"), max_downloads=body.get("max_downloads", 0)
+            )
+    if isinstance(result, errors.T_Error):
+        return build_error_response(result)
+
+    if isinstance(result, transfers.SharedFile):
+        recorder.annotate(request, code=result.code, deduplicated=True)
+        return build_transfer_response(result, deduplicated=True)
+
+    recorder.annotate(request, grant=result.token)
+
     return JSONResponse({
         "status": True,
-        "code": result.code,
-        "expire": timestamp.convert_to_readable(result.date_expire)
+        "deduplicated": False,
+        "token": result.token,
+        "expires_in": int(preflight.grants.get_ttl_s())
     }, 200)
 
 
@@ -68,17 +281,64 @@ async def transfer(request: Request, file: UploadFile = File(...), expire: int =
 @api.get("/api/receive/{code}")
 @ApiLimiter.gate
 async def receive(code: int, request: Request) -> FileResponse:
+    accepts_gzip = compression.accepts_gzip(request.headers.get("accept-encoding"))
+    cached = transfers.hot_files.get(code)
+    if cached is not None and await run_in_threadpool(transfers.register_download, code) is not None:
+        return build_cached_response(cached, accepts_gzip)
+
     file = transfers.get_shared_file(code)
     if isinstance(file, errors.T_Error):
         return build_error_response(file)
 
+    downloads = await run_in_threadpool(transfers.register_download, code, file.max_downloads)
+    if downloads is None:
+        return build_error_response(errors.INVALID_CODE)
+
     Log.info(f"Sharing file: {code}")
-    return FileResponse(
-        transfers.get_file_path(file),
-        filename=file.name
+    if file.is_bundle():
+        return burn_after_sending(build_bundle_response(file), file, downloads)
+
+    # Shares with downloads limit are never cached, cache hits are not checked against it.
+    # Admitted by original size: clients without gzip get the body decompressed.
+    if not file.max_downloads and transfers.hot_files.should_admit(code, file.size):
+        # Local read or S3 round trip, kept off the event loop.
+        body = await run_in_threadpool(transfers.blob_store.read, transfers.get_member_blob_name(file))
+        cached = transfers.hot_files.put(code, file.name, body, file.date_expire, file.encoding, file.size)
+        if cached is not None:
+            return build_cached_response(cached, accepts_gzip)
+
+    response = await build_file_response(
+        transfers.get_member_blob_name(file), file.name, file.size, file.get_stored_size(), file.encoding, accepts_gzip
     )
-    
-    
+    return burn_after_sending(response, file, downloads)
+
+
+@api.get("/api/receive/{code}/{index}")
+@ApiLimiter.gate
+async def receive_member(code: int, index: int, request: Request) -> FileResponse:
+    """ Download single file of a (bundle) transfer. """
+    file = transfers.get_shared_file(code)
+    if isinstance(file, errors.T_Error):
+        return build_error_response(file)
+
+    members = file.get_members()
+    if index not in range(len(members)):
+        return build_error_response(errors.INVALID_FILE_INDEX)
+
+    downloads = await run_in_threadpool(transfers.register_download, code, file.max_downloads)
+    if downloads is None:
+        return build_error_response(errors.INVALID_CODE)
+
+    member = members[index]
+    accepts_gzip = compression.accepts_gzip(request.headers.get("accept-encoding"))
+    Log.info(f"Sharing file: {code}/{index}")
+    response = await build_file_response(
+        transfers.get_member_blob_name(file, index), member["name"], member["size"],
+        member["stored_size"] or member["size"], member["encoding"], accepts_gzip
+    )
+    return burn_after_sending(response, file, downloads)
+
+
 @api.delete("/api/delete/{code}")
 @ApiLimiter.gate
 async def delete(code: int, request: Request) -> JSONResponse:
@@ -97,29 +357,172 @@ async def delete(code: int, request: Request) -> JSONResponse:
     
 @api.get("/api/owned-codes")
 @ApiLimiter.gate
-async def fetch_owned_codes(request: Request) -> JSONResponse:
+async def fetch_owned_codes(request: Request, since: str = None, cursor: int = None, limit: int = 0) -> JSONResponse:
     """
     response: {
         code1: {
             'file': str,
-            'expire': str
+            'expire': str,
+            'downloads': int,
+            'max_downloads': int
         },
         code2: {...}
     }
+    version: str, sent back as `since` to get changes only (delta: true, removed: [code, ...])
+    next_cursor: int | None, with `limit` codes are paged in ascending order
     """
-    codes = {}
-    ip_addr = transfers.hash_ip(request.client.host)
-    
-    for model in transfers.transfers_db.get_all_models():
-        if model.owner_ip == ip_addr:
-            codes[model.code] = {
-                "file": model.name,
-                "expire": timestamp.convert_to_readable(model.date_expire)
-            }
-            
+    owned = transfers.get_owned_codes(request.client.host, since)
+    codes, version, removed = owned.entries, owned.version, owned.removed
+
+    # Other nodes answer for their own shares only (forwarded requests are not fanned out again).
+    # Deltas and pages are node-local, the merged listing is always complete.
+    if cluster.is_enabled() and cluster.FORWARDED_HEADER not in request.headers:
+        if removed is not None:
+            owned = transfers.get_owned_codes(request.client.host)
+            codes, removed = owned.entries, None
+        versions = [owned.version]
+        for peer_response in await cluster.fetch_from_peers("/api/owned-codes", request.client.host):
+            codes.update((int(code), entry) for code, entry in (peer_response.get("response") or {}).items())
+            versions.append(str(peer_response.get("version")))
+        version = hashlib.sha256(",".join(versions).encode()).hexdigest()[:16]
+        cursor = None
+        limit = 0
+
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    page = sorted(codes.items())
+    if cursor is not None:
+        page = [(code, entry) for code, entry in page if code > cursor]
+    next_cursor = None
+    if limit > 0 and len(page) > limit:
+        page = page[:limit]
+        next_cursor = page[-1][0]
+
+    body = {
+        "status": True,
+        "response": dict(page),
+        "version": version,
+        "delta": removed is not None,
+        "next_cursor": next_cursor
+    }
+    if removed is not None and cursor is None:
+        body["removed"] = removed
+    return JSONResponse(body, 200, headers=headers)
+
+
+@api.get("/api/admin/metrics")
+@admin.gate
+async def admin_metrics(request: Request) -> JSONResponse:
+    return JSONResponse({
+        "status": True,
+        "response": metrics.collect()
+    }, 200)
+
+
+@api.get("/api/admin/profile")
+@admin.gate
+async def admin_profile(request: Request, seconds: float = 10, format: str = "collapsed", interval_ms: float = None) -> Response:
+    """ Sample all threads for `seconds`, answer with collapsed stacks or speedscope JSON. """
+    if format not in ("collapsed", "speedscope"):
+        return build_error_response(errors.INVALID_PROFILE_FORMAT)
+
+    interval_s = interval_ms / 1000 if interval_ms else None
+    profile = await run_in_threadpool(profiler.profiler.run, seconds, interval_s)
+    if profile is None:
+        return build_error_response(errors.PROFILER_BUSY)
+
+    if format == "speedscope":
+        return JSONResponse(profile.to_speedscope(), 200, headers=hotcache.build_download_headers("profile.speedscope.json"))
+    return PlainTextResponse(profile.to_collapsed(), 200)
+
+
+
+@api.get("/api/admin/memory")
+@admin.gate
+async def admin_memory(request: Request) -> JSONResponse:
+    return JSONResponse({
+        "status": True,
+        "response": await run_in_threadpool(memdiag.report)
+    }, 200)
+
+
+@api.post("/api/admin/memory/snapshot")
+@admin.gate
+async def admin_memory_snapshot(request: Request, limit: int = 20, group_by: str = "lineno") -> JSONResponse:
+    """ Take tracemalloc snapshot (starting tracing if needed), kept as baseline for diff. """
+    if group_by not in memdiag.GROUP_BY_OPTIONS:
+        return build_error_response(errors.INVALID_MEMORY_GROUPING)
+
+    return JSONResponse({
+        "status": True,
+        "response": await run_in_threadpool(memdiag.tracer.snapshot, limit, group_by)
+    }, 200)
+
+
+@api.get("/api/admin/memory/diff")
+@admin.gate
+async def admin_memory_diff(request: Request, limit: int = 20, group_by: str = "lineno") -> JSONResponse:
+    if group_by not in memdiag.GROUP_BY_OPTIONS:
+        return build_error_response(errors.INVALID_MEMORY_GROUPING)
+
+    diff = await run_in_threadpool(memdiag.tracer.diff, limit, group_by)
+    if diff is None:
+        return build_error_response(errors.NO_MEMORY_SNAPSHOT)
+    return JSONResponse({
+        "status": True,
+        "response": diff
+    }, 200)
+
+
+@api.delete("/api/admin/memory/snapshot")
+@admin.gate
+async def admin_memory_stop(request: Request) -> JSONResponse:
+    await run_in_threadpool(memdiag.tracer.stop)
+    return JSONResponse({"status": True}, 200)
+
+
+@api.get("/api/admin/replication/snapshot")
+@admin.gate
+async def admin_replication_snapshot(request: Request, db: str = "shares") -> Response:
+    """ Whole table with change log position it corresponds to. Content is already serialized by the database. """
+    database_object = database.Database.get_database(db)
+    if database_object is None:
+        return build_error_response(errors.UNKNOWN_DATABASE)
+
+    snapshot = await run_in_threadpool(database_object.dump_snapshot)
+    return Response('{"status": true, "response": ' + snapshot + "}", 200, media_type="application/json")
+
+
+@api.get("/api/admin/replication/changes")
+@admin.gate
+async def admin_replication_changes(request: Request, epoch: str, after: int, db: str = "shares", limit: int = 1000, wait: float = 0) -> JSONResponse:
+    """ Changes after sequence `after`, waiting up to `wait` seconds for new ones (long-poll). """
+    database_object = database.Database.get_database(db)
+    if database_object is None:
+        return build_error_response(errors.UNKNOWN_DATABASE)
+    if not database_object.changes.capacity:
+        return build_error_response(errors.REPLICATION_DISABLED)
+
+    wait = min(max(wait, 0), replication.MAX_WAIT_S)
+    changes = await run_in_threadpool(database_object.changes.read, epoch, after, min(max(limit, 1), replication.CHANGES_LIMIT), wait)
+    return JSONResponse({
+        "status": True,
+        "response": changes if changes is not None else {"snapshot_required": True, "epoch": database_object.changes.epoch}
+    }, 200)
+
+
+@api.post("/api/admin/replication/promote")
+@admin.gate
+async def admin_replication_promote(request: Request) -> JSONResponse:
+    if not replication.follower.promote():
+        return build_error_response(errors.NOT_A_REPLICA)
+
     return JSONResponse({
         "status": True,
-        "response": codes
+        "response": replication.follower.stats()
     }, 200)
 
     
@@ -130,8 +533,6 @@ if __name__ == "__main__":
     
     host = os.getenv("HOST") or "localhost"
     port = int(os.getenv("PORT")) or 80
-    
-    cleaner.Cleaner()
-    
+
     uvicorn.run(api, host=host, port=port)
 
@@ -0,0 +1,43 @@
+"""
+Module: admin.py
+
+Description:
+    Access control for operator-only endpoints.
+
+    Admin endpoints are enabled only when the ADMIN_TOKEN environment variable is set.
+    Requests must carry the token in the X-Admin-Token header. Without a configured
+    token, or with a wrong one, endpoints answer 404 so they are not discoverable.
+"""
+from modules.logs import Log
+
+from fastapi.responses import JSONResponse
+from functools import wraps
+import hmac
+import os
+
+
+ADMIN_TOKEN_HEADER = "x-admin-token"
+NOT_FOUND_RESPONSE = JSONResponse({"detail": "Not Found"}, 404)
+
+
+def is_admin_request(request) -> bool:
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:
+        return False
+
+    provided = request.headers.get(ADMIN_TOKEN_HEADER, "")
+    return hmac.compare_digest(provided.encode(), token.encode())
+
+
+def gate(function):
+    """ Allow call only with valid admin token. Requires `request` keyword argument. """
+
+    @wraps(function)
+    async def wrapper(*args, **kwargs):
+        request = kwargs["request"]
+        if not is_admin_request(request):
+            Log.warn(f"Rejected admin call: {request.url.path} from {request.client.host}")
+            return NOT_FOUND_RESPONSE
+
+        return await function(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,91 @@
+"""
+Module: archive.py
+
+Description:
+    On-the-fly ZIP streaming for multi-file transfers.
+
+    The archive is written by zipfile into an unseekable sink, so member sizes and
+    CRCs go to data descriptors and nothing has to be known up front. Bytes written
+    to the sink are handed out right after every chunk, memory use is bounded by
+    the chunk size regardless of archive size, and no temporary archive is created.
+    Members are STORED: shared files are either already compressed by their format
+    or were compressed at rest and are decompressed here.
+
+    Functions:
+        - iter_zip(members: list[ZipMember]) -> Iterator[bytes]
+        - unique_names(names: list[str]) -> list[str]
+"""
+from typing import Callable, Iterable, Iterator
+from dataclasses import dataclass
+import zipfile
+import time
+import io
+import os
+
+
+@dataclass
+class ZipMember:
+    name: str
+    size: int
+    read_chunks: Callable[[], Iterable[bytes]]
+
+
+class _ChunkSink(io.RawIOBase):
+    """ Write-only, unseekable stream collecting written bytes until drained. """
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self._chunks = self._chunks, []
+        if chunks:
+            yield b"".join(chunks)
+
+
+def unique_names(names: list[str]) -> list[str]:
+    """ Make member names unique: a.txt, a (1).txt, ... """
+    used = set()
+    result = []
+    for name in names:
+        name = os.path.basename(name.replace("\\", "/")) or "file"
+        candidate = name
+        stem, extension = os.path.splitext(name)
+        counter = 1
+        while candidate in used:
+            candidate = f"{stem} ({counter}){extension}"
+            counter += 1
+        used.add(candidate)
+        result.append(candidate)
+    return result
+
+
+def iter_zip(members: list[ZipMember]) -> Iterator[bytes]:
+    """ Yield ZIP archive containing members, built while streaming. """
+    sink = _ChunkSink()
+    date_time = time.localtime()[:6]
+
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for member in members:
+            info = zipfile.ZipInfo(member.name, date_time)
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = member.size
+
+            with archive.open(info, "w", force_zip64=member.size >= zipfile.ZIP64_LIMIT) as member_file:
+                for chunk in member.read_chunks():
+                    member_file.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+
+    yield from sink.drain()
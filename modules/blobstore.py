@@ -0,0 +1,606 @@
+"""
+Module: blobstore.py
+
+Description:
+    Storage backends for transfer blobs. Blobs are addressed by name (`<code>` or
+    `<code>.<index>`), transfers never builds paths on it's own.
+
+    LocalBlobStore:
+        Blobs live in fan-out subdirectories of root: `<root>/<shard>/<name>`, where
+        shard is the first 2 hex digits of md5(code), i.e. 256 directories. Writers
+        preallocate the expected size with posix_fallocate (when known up front) and
+        trim the file to the written length on close. Blobs of the old flat layout
+        (`<root>/<name>`) are still found and are moved into shards by migrate().
+        Deleted blobs go to the reclaim queue (see reclaim.py).
+
+    S3BlobStore:
+        S3-compatible object storage (path-style URLs, AWS Signature V4). Uploads are
+        streamed as multipart uploads of S3_PART_MB parts (single PUT for small blobs),
+        downloads are streamed in chunks. Deletes are sent from a background thread.
+        tools/s3server.py is a local stand-in for testing.
+
+    BlobStore interface:
+        - writer(name: str, size_hint: int | None) -> BlobWriter  (context manager, file-like)
+        - iter_chunks(name: str) -> Iterator[bytes]  (raises FileNotFoundError before the first chunk)
+        - read(name: str) -> bytes
+        - local_path(name: str) -> str | None   (for sendfile, None if not on local disk)
+        - exists(name: str) -> bool
+        - delete(names: list[str])
+        - rename(name: str, new_name: str)
+        - copy(name: str, new_name: str)
+        - discard_orphan(blob: BlobInfo, quarantine_dir: str | None) -> bool
+        - iter_blobs() -> Iterator[BlobInfo]
+        - migrate() -> int
+        - free_space_b() -> int | None
+
+    Functions:
+        - create_blob_store() -> BlobStore
+          Backend selected by BLOB_STORE (local | s3).
+        - sign_request(...) -> dict[str, str]
+          AWS Signature V4 headers.
+"""
+from modules import reclaim
+from modules.logs import Log
+
+from typing import BinaryIO, Iterator
+from dataclasses import dataclass
+from urllib.parse import quote, urlsplit
+import xml.etree.ElementTree as ElementTree
+import http.client
+import threading
+import datetime
+import hashlib
+import shutil
+import queue
+import hmac
+import time
+import os
+
+
+CHUNK_SIZE = 1024 * 1024
+SHARD_DIGITS = 2
+S3_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+
+
+@dataclass
+class BlobInfo:
+    name: str
+    size: int
+    mtime: float
+    path: str | None = None  # Local stores only
+
+
+class BlobStore:
+    is_local = False
+
+    def writer(self, name: str, size_hint: int | None = None) -> "BlobWriter":
+        raise NotImplementedError
+
+    def iter_chunks(self, name: str) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def read(self, name: str) -> bytes:
+        return b"".join(self.iter_chunks(name))
+
+    def local_path(self, name: str) -> str | None:
+        return None
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, names: list[str]) -> None:
+        raise NotImplementedError
+
+    def rename(self, name: str, new_name: str) -> None:
+        """ Give blob another name. Generic version copies it. """
+        self.copy(name, new_name)
+        self.delete([name])
+
+    def copy(self, name: str, new_name: str) -> None:
+        """ Store blob's content under another name as well. Generic version streams it. """
+        with self.writer(new_name) as blob:
+            for chunk in self.iter_chunks(name):
+                blob.write(chunk)
+
+    def discard_orphan(self, blob: BlobInfo, quarantine_dir: str | None) -> bool:
+        """ Remove blob nobody refers to. Stores which can, move it to quarantine_dir instead. """
+        self.delete([blob.name])
+        return True
+
+    def iter_blobs(self) -> Iterator[BlobInfo]:
+        raise NotImplementedError
+
+    def migrate(self) -> int:
+        """ Move blobs of older layouts. Returns number of moved blobs. """
+        return 0
+
+    def free_space_b(self) -> int | None:
+        """ Free space of the underlying disk, None if not applicable. """
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+
+class BlobWriter:
+    """ Write-only file-like object. Blob becomes visible only if the `with` block succeeds. """
+
+    def write(self, data: bytes) -> int:
+        raise NotImplementedError
+
+    def commit(self) -> None:
+        raise NotImplementedError
+
+    def abort(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self) -> "BlobWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def split_blob_name(name: str) -> str:
+    """ Code part of blob name. """
+    return name.partition(".")[0]
+
+
+class LocalBlobWriter(BlobWriter):
+    def __init__(self, path: str, size_hint: int | None) -> None:
+        self.path = path
+        self.file: BinaryIO = open(path, "wb")
+        self.written = 0
+        self.preallocated = False
+
+        if size_hint and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self.file.fileno(), 0, size_hint)
+                self.preallocated = True
+            except OSError:
+                pass  # Not supported by filesystem, the blob just grows while written.
+
+    def write(self, data: bytes) -> int:
+        self.written += len(data)
+        return self.file.write(data)
+
+    def commit(self) -> None:
+        if self.preallocated:
+            self.file.truncate(self.written)
+        self.file.close()
+
+    def abort(self) -> None:
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class LocalBlobStore(BlobStore):
+    is_local = True
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.migrated = 0
+
+    def shard_of(self, name: str) -> str:
+        return hashlib.md5(split_blob_name(name).encode()).hexdigest()[:SHARD_DIGITS]
+
+    def sharded_path(self, name: str) -> str:
+        return os.path.join(self.root, self.shard_of(name), name)
+
+    def legacy_path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def local_path(self, name: str) -> str | None:
+        """ Path of existing blob (sharded or legacy flat layout), None if missing. """
+        path = self.sharded_path(name)
+        if os.path.isfile(path):
+            return path
+
+        path = self.legacy_path(name)
+        if os.path.isfile(path):
+            return path
+        return None
+
+    def writer(self, name: str, size_hint: int | None = None) -> LocalBlobWriter:
+        path = self.sharded_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return LocalBlobWriter(path, size_hint)
+
+    def iter_chunks(self, name: str) -> Iterator[bytes]:
+        path = self.local_path(name)
+        if path is None:
+            raise FileNotFoundError(name)
+        return self.__read_chunks(open(path, "rb"))
+
+    @staticmethod
+    def __read_chunks(blob: BinaryIO) -> Iterator[bytes]:
+        with blob:
+            while chunk := blob.read(CHUNK_SIZE):
+                yield chunk
+
+    def exists(self, name: str) -> bool:
+        return self.local_path(name) is not None
+
+    def rename(self, name: str, new_name: str) -> None:
+        """ Blobs of one code share a shard, so this is a rename within one directory. """
+        path = self.local_path(name)
+        if path is None:
+            raise FileNotFoundError(name)
+        os.replace(path, self.sharded_path(new_name))
+
+    def copy(self, name: str, new_name: str) -> None:
+        """
+        Hard link, so the content is stored once and each name can be deleted on it's own.
+        Space usage is computed from shares, which count linked content once per name.
+        """
+        path = self.local_path(name)
+        if path is None:
+            raise FileNotFoundError(name)
+
+        new_path = self.sharded_path(new_name)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        try:
+            os.link(path, new_path)
+        except OSError:
+            shutil.copyfile(path, new_path)
+
+    def delete(self, names: list[str]) -> None:
+        """ Hand blobs to the reclaimer (unlinked in background). """
+        paths = []
+        for name in names:
+            path = self.local_path(name)
+            if path is None:
+                Log.error(f"Blob was already missing: {name}")
+                continue
+            paths.append(path)
+        reclaim.reclaimer.enqueue(paths)
+
+    def discard_orphan(self, blob: BlobInfo, quarantine_dir: str | None) -> bool:
+        if quarantine_dir is None:
+            os.remove(blob.path)
+            return True
+
+        os.makedirs(quarantine_dir, exist_ok=True)
+        quarantined = os.path.join(quarantine_dir, f"{blob.name}.{int(time.time())}")
+        os.replace(blob.path, quarantined)
+        os.utime(quarantined)  # Quarantine time is counted from now
+        return True
+
+    def iter_blobs(self) -> Iterator[BlobInfo]:
+        """ All blobs, streamed with os.scandir (legacy flat ones included). """
+        if not os.path.isdir(self.root):
+            return
+
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.__iter_directory(entry.path)
+                    continue
+                info = self.__blob_info(entry)
+                if info is not None:
+                    yield info
+
+    def __iter_directory(self, path: str) -> Iterator[BlobInfo]:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                info = self.__blob_info(entry)
+                if info is not None:
+                    yield info
+
+    @staticmethod
+    def __blob_info(entry: os.DirEntry) -> BlobInfo | None:
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            return None
+        return BlobInfo(entry.name, stat.st_size, stat.st_mtime, entry.path)
+
+    def migrate(self) -> int:
+        """ Move blobs of the flat layout into shards. """
+        if not os.path.isdir(self.root):
+            return 0
+
+        moved = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                destination = self.sharded_path(entry.name)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                try:
+                    os.replace(entry.path, destination)
+                except FileNotFoundError:
+                    continue
+                moved += 1
+
+        if moved:
+            self.migrated += moved
+            Log.info(f"Moved {moved} blob(s) into sharded layout.")
+        return moved
+
+    def free_space_b(self) -> int | None:
+        stat = os.statvfs(self.root if os.path.isdir(self.root) else ".")
+        return stat.f_bavail * stat.f_frsize
+
+    def stats(self) -> dict:
+        return {"backend": "local", "root": self.root, "migrated": self.migrated}
+
+
+def hmac_sha256(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def sign_request(
+    method: str,
+    host: str,
+    path: str,
+    query: dict[str, str],
+    payload_hash: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    amz_date: str
+) -> dict[str, str]:
+    """ Headers (host, x-amz-*, authorization) of AWS Signature V4 signed S3 request. """
+    canonical_query = "&".join(
+        f"{quote(key, safe='-_.~')}={quote(value, safe='-_.~')}" for key, value in sorted(query.items())
+    )
+    headers = {"host": host, "x-amz-content-sha256": payload_hash, "x-amz-date": amz_date}
+    signed_headers = ";".join(sorted(headers))
+    canonical_headers = "".join(f"{name}:{headers[name]}\n" for name in sorted(headers))
+    canonical_request = "\n".join([
+        method, quote(path, safe="/-_.~"), canonical_query, canonical_headers, signed_headers, payload_hash
+    ])
+
+    date = amz_date[:8]
+    scope = f"{date}/{region}/s3/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+    ])
+
+    signing_key = hmac_sha256(("AWS4" + secret_key).encode(), date)
+    for part in (region, "s3", "aws4_request"):
+        signing_key = hmac_sha256(signing_key, part)
+    signature = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    headers["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return headers
+
+
+class S3Error(OSError):
+    pass
+
+
+class S3BlobWriter(BlobWriter):
+    """ Buffers up to one part, then streams parts as multipart upload. """
+
+    def __init__(self, store: "S3BlobStore", name: str) -> None:
+        self.store = store
+        self.name = name
+        self.buffer = bytearray()
+        self.upload_id: str | None = None
+        self.parts: list[tuple[int, str]] = []
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.store.part_size:
+            self.__upload_part(bytes(self.buffer[:self.store.part_size]))
+            del self.buffer[:self.store.part_size]
+        return len(data)
+
+    def __upload_part(self, body: bytes) -> None:
+        if self.upload_id is None:
+            root = ElementTree.fromstring(self.store.request("POST", self.name, {"uploads": ""}))
+            self.upload_id = root.findtext(f"{S3_NAMESPACE}UploadId") or root.findtext("UploadId")
+
+        number = len(self.parts) + 1
+        _, headers = self.store.request_with_headers(
+            "PUT", self.name, {"partNumber": str(number), "uploadId": self.upload_id}, body
+        )
+        self.parts.append((number, headers.get("etag", "")))
+
+    def commit(self) -> None:
+        if self.upload_id is None:
+            self.store.request("PUT", self.name, body=bytes(self.buffer))
+            return
+
+        if self.buffer:
+            self.__upload_part(bytes(self.buffer))
+            self.buffer.clear()
+
+        parts = "".join(f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in self.parts)
+        body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode()
+        self.store.request("POST", self.name, {"uploadId": self.upload_id}, body)
+
+    def abort(self) -> None:
+        self.buffer.clear()
+        if self.upload_id is not None:
+            try:
+                self.store.request("DELETE", self.name, {"uploadId": self.upload_id})
+            except OSError as error:
+                Log.error(f"S3: failed to abort upload of {self.name}: {error}")
+
+
+class S3BlobStore(BlobStore):
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = "us-east-1",
+        prefix: str = "",
+        part_size: int = 8 * 1024 * 1024,
+        timeout_s: float = 30
+    ) -> None:
+        url = urlsplit(endpoint)
+        self.scheme = url.scheme or "http"
+        self.host = url.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+        self.part_size = part_size
+        self.timeout_s = timeout_s
+
+        self._deletes: queue.Queue[str] = queue.Queue()
+        self._deleter: threading.Thread | None = None
+        self._deleter_lock = threading.Lock()
+        self.deleted = 0
+
+    def object_path(self, name: str = "") -> str:
+        return f"/{self.bucket}/{self.prefix}{name}" if name else f"/{self.bucket}"
+
+    def connect(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout_s)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout_s)
+
+    def open_request(self, method: str, path: str, query: dict[str, str] = None, body: bytes = b"") -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        query = query or {}
+        amz_date = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        payload_hash = hashlib.sha256(body).hexdigest() if body else EMPTY_SHA256
+        headers = sign_request(method, self.host, path, query, payload_hash, self.access_key, self.secret_key, self.region, amz_date)
+        headers["content-length"] = str(len(body))
+
+        target = quote(path, safe="/-_.~")
+        if query:
+            target += "?" + "&".join(f"{quote(key, safe='-_.~')}={quote(value, safe='-_.~')}" if value else quote(key, safe='-_.~') for key, value in query.items())
+
+        connection = self.connect()
+        connection.request(method, target, body=body or None, headers=headers)
+        return connection, connection.getresponse()
+
+    def request_with_headers(self, method: str, name: str, query: dict[str, str] = None, body: bytes = b"") -> tuple[bytes, dict[str, str]]:
+        connection, response = self.open_request(method, self.object_path(name), query, body)
+        try:
+            content = response.read()
+            if response.status == 404:
+                raise FileNotFoundError(name)
+            if response.status >= 300:
+                raise S3Error(f"S3 {method} {name}: {response.status} {content[:200]!r}")
+            return content, {key.lower(): value for key, value in response.getheaders()}
+        finally:
+            connection.close()
+
+    def request(self, method: str, name: str, query: dict[str, str] = None, body: bytes = b"") -> bytes:
+        return self.request_with_headers(method, name, query, body)[0]
+
+    def writer(self, name: str, size_hint: int | None = None) -> S3BlobWriter:
+        return S3BlobWriter(self, name)
+
+    def iter_chunks(self, name: str) -> Iterator[bytes]:
+        connection, response = self.open_request("GET", self.object_path(name))
+        if response.status >= 300:
+            connection.close()
+            if response.status == 404:
+                raise FileNotFoundError(name)
+            raise S3Error(f"S3 GET {name}: {response.status}")
+        return self.__read_chunks(connection, response)
+
+    @staticmethod
+    def __read_chunks(connection: http.client.HTTPConnection, response: http.client.HTTPResponse) -> Iterator[bytes]:
+        try:
+            while chunk := response.read(CHUNK_SIZE):
+                yield chunk
+        finally:
+            connection.close()
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.request("HEAD", name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, names: list[str]) -> None:
+        """ Queue deletes, they are sent from background thread. """
+        for name in names:
+            self._deletes.put(name)
+
+        with self._deleter_lock:
+            if self._deleter is None:
+                self._deleter = threading.Thread(target=self.__delete_worker, name="s3-deleter", daemon=True)
+                self._deleter.start()
+
+    def __delete_worker(self) -> None:
+        while True:
+            name = self._deletes.get()
+            try:
+                self.request("DELETE", name)
+                self.deleted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as error:
+                Log.error(f"S3: failed to delete {name}: {error}")
+
+    def iter_blobs(self) -> Iterator[BlobInfo]:
+        """ ListObjectsV2 of the prefix, page by page. """
+        token = None
+        while True:
+            query = {"list-type": "2", "prefix": self.prefix}
+            if token:
+                query["continuation-token"] = token
+            connection, response = self.open_request("GET", self.object_path(), query)
+            try:
+                content = response.read()
+                if response.status >= 300:
+                    raise S3Error(f"S3 list: {response.status} {content[:200]!r}")
+            finally:
+                connection.close()
+
+            root = ElementTree.fromstring(content)
+            namespace = S3_NAMESPACE if root.tag.startswith(S3_NAMESPACE) else ""
+            for item in root.iter(f"{namespace}Contents"):
+                key = item.findtext(f"{namespace}Key")
+                modified = item.findtext(f"{namespace}LastModified") or ""
+                try:
+                    mtime = datetime.datetime.fromisoformat(modified.replace("Z", "+00:00")).timestamp()
+                except ValueError:
+                    mtime = 0.0
+                yield BlobInfo(key[len(self.prefix):], int(item.findtext(f"{namespace}Size") or 0), mtime)
+
+            token = root.findtext(f"{namespace}NextContinuationToken")
+            if root.findtext(f"{namespace}IsTruncated") != "true" or not token:
+                return
+
+    def stats(self) -> dict:
+        return {
+            "backend": "s3",
+            "endpoint": f"{self.scheme}://{self.host}",
+            "bucket": self.bucket,
+            "pending_deletes": self._deletes.qsize(),
+            "deleted": self.deleted,
+        }
+
+
+def create_blob_store(local_root: str) -> BlobStore:
+    """ Backend selected by BLOB_STORE env (local | s3). """
+    backend = os.getenv("BLOB_STORE", "local")
+    if backend == "local":
+        return LocalBlobStore(local_root)
+
+    if backend == "s3":
+        return S3BlobStore(
+            os.getenv("S3_ENDPOINT", "http://127.0.0.1:9000"),
+            os.getenv("S3_BUCKET", "quicksh"),
+            os.getenv("S3_ACCESS_KEY", ""),
+            os.getenv("S3_SECRET_KEY", ""),
+            os.getenv("S3_REGION", "us-east-1"),
+            os.getenv("S3_PREFIX", ""),
+            int(os.getenv("S3_PART_MB", 8)) * 1024 * 1024,
+        )
+
+    raise ValueError(f"Unknown BLOB_STORE: {backend!r} (expected local or s3)")
@@ -1,7 +1,11 @@
 from modules import transfers
+from modules import reconcile
+from modules import replication
 from modules import timestamp
+from modules import database
 from modules.logs import Log
 
+from itertools import compress
 from threading import Thread
 import time
 import os
@@ -9,19 +13,34 @@ import os
 
 class Cleaner:
     def __init__(self) -> None:
-        checker = Thread(target=self.checker, daemon=True)
+        checker = Thread(target=self.checker, name="cleaner", daemon=True)
         checker.start()
         Log.info("Intialized data cleaner.")
 
     def analyze_data(self) -> None:
         """ Check all shared files and remove expired. """
-        models = transfers.transfers_db.get_all_models()
-        for model in models:
-            if model.date_expire < timestamp.generate_timestamp():
-                model.remove()
+        now = timestamp.generate_timestamp()
+        keys, expires = transfers.transfers_db.scan("date_expire")
+        for key in compress(keys, map(now.__gt__, expires)):
+            try:
+                transfers.transfers_db.get(key).remove()
+            except database.KeyNotFound:
+                continue  # Removed meanwhile
+
+        transfers.shared_files_cache.prune()
+        transfers.owner_index.prune()
 
     def checker(self) -> None:
         while True:
+            # Standby's table is the primary's, expired shares are removed there (blobs may be shared).
+            if replication.follower.following:
+                time.sleep(60)
+                continue
+
             self.analyze_data()
+            try:
+                reconcile.reconciler.run()
+            except Exception as error:
+                Log.error(f"Reconciliation failed: {error}")
             time.sleep(3600)
                     
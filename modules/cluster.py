@@ -0,0 +1,238 @@
+"""
+Module: cluster.py
+
+Description:
+    Optional multi-node mode. Every node keeps it's own data/ (blobs and shares.json)
+    and owns the codes which consistent hashing maps to it.
+
+    CLUSTER_NODES is a static member list: "node1=http://10.0.0.1:8000,node2=http://10.0.0.2:8000".
+    CLUSTER_NODE_ID names the local node. Without both, cluster mode is off.
+
+    New codes are generated only among codes owned by the local node, so uploads can
+    land on any node. Receive and delete requests for codes of another node are either
+    redirected (CLUSTER_ROUTING=redirect, 307) or streamed through (CLUSTER_ROUTING=proxy,
+    default). Codes found in the local table are always served locally, so codes created
+    before enabling the cluster keep working. Proxied requests carry the client's address
+    in X-Forwarded-For, nodes must trust their peers (uvicorn --forwarded-allow-ips).
+
+    Functions:
+        - configure()
+        - is_enabled() -> bool
+        - owner_of(code: int) -> str
+        - is_local_code(code: int) -> bool
+        - fetch_from_peers(path: str, client_ip: str) -> list[dict]
+    ClusterRoutingMiddleware(app, has_code: Callable[[int], bool])
+"""
+from modules.logs import Log
+from modules import errors
+
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, RedirectResponse
+from typing import Callable
+import urllib.request
+import urllib.error
+import bisect
+import hashlib
+import asyncio
+import json
+import re
+import os
+
+
+VIRTUAL_NODES = 64
+PROXY_CHUNK_SIZE = 256 * 1024
+FORWARDED_HEADER = "x-quicksh-forwarded"
+PASSED_REQUEST_HEADERS = ("accept", "accept-encoding", "range", "user-agent")
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "te", "trailer", "upgrade", "proxy-authenticate", "proxy-authorization"}
+ROUTED_PATH = re.compile(r"^/api/(?:receive|delete)/(\d+)(?:/\d+)?$")
+
+
+def hash_point(value: str) -> int:
+    return int.from_bytes(hashlib.sha256(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """ Consistent hashing of codes onto nodes, VIRTUAL_NODES points per node. """
+
+    def __init__(self, nodes: list[str]) -> None:
+        points = sorted((hash_point(f"{node}#{replica}"), node) for node in nodes for replica in range(VIRTUAL_NODES))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner_of(self, key: str) -> str:
+        index = bisect.bisect(self._points, hash_point(key)) % len(self._points)
+        return self._nodes[index]
+
+
+class ClusterState:
+    def __init__(self) -> None:
+        self.node_id: str | None = None
+        self.nodes: dict[str, str] = {}  # node_id: base url
+        self.ring: HashRing | None = None
+        self.routing = "proxy"
+        self.timeout_s = 5.0
+
+        self.redirected = 0
+        self.proxied = 0
+        self.proxy_errors = 0
+
+
+state = ClusterState()
+
+
+def parse_nodes(value: str) -> dict[str, str]:
+    nodes = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        node_id, _, url = item.partition("=")
+        if not url:
+            raise ValueError(f"Invalid CLUSTER_NODES entry: {item!r} (expected id=url)")
+        nodes[node_id.strip()] = url.strip().rstrip("/")
+    return nodes
+
+
+def configure() -> None:
+    """ Read cluster settings. Called from app's lifespan. """
+    nodes = parse_nodes(os.getenv("CLUSTER_NODES", ""))
+    node_id = os.getenv("CLUSTER_NODE_ID")
+    if not nodes or not node_id:
+        state.node_id, state.nodes, state.ring = None, {}, None
+        return
+
+    if node_id not in nodes:
+        raise ValueError(f"CLUSTER_NODE_ID {node_id!r} is not listed in CLUSTER_NODES")
+
+    state.node_id = node_id
+    state.nodes = nodes
+    state.ring = HashRing(list(nodes))
+    state.routing = os.getenv("CLUSTER_ROUTING", "proxy")
+    state.timeout_s = float(os.getenv("CLUSTER_TIMEOUT_S", 5))
+    Log.info(f"Cluster mode: node {node_id} of {len(nodes)} ({state.routing})")
+
+
+def is_enabled() -> bool:
+    return state.ring is not None
+
+
+def owner_of(code: int) -> str:
+    return state.ring.owner_of(str(code))
+
+
+def is_local_code(code: int) -> bool:
+    """ Check if code belongs to local node (always True outside cluster mode). """
+    return not is_enabled() or owner_of(code) == state.node_id
+
+
+def is_forwarded(scope: dict) -> bool:
+    return any(name == FORWARDED_HEADER.encode() for name, _ in scope.get("headers", []))
+
+
+def build_peer_request(url: str, method: str, client_ip: str, headers: dict[str, str] = None) -> urllib.request.Request:
+    headers = dict(headers or {})
+    headers["X-Forwarded-For"] = client_ip
+    headers[FORWARDED_HEADER] = state.node_id
+    return urllib.request.Request(url, method=method, headers=headers)
+
+
+def open_peer(request: urllib.request.Request):
+    """ Open request to peer. HTTP error statuses are returned as responses too. """
+    try:
+        return urllib.request.urlopen(request, timeout=state.timeout_s)
+    except urllib.error.HTTPError as response:
+        return response
+
+
+async def fetch_from_peers(path: str, client_ip: str) -> list[dict]:
+    """ GET path on every other node concurrently. Unreachable nodes are skipped. """
+    def fetch(url: str) -> dict | None:
+        try:
+            with open_peer(build_peer_request(url, "GET", client_ip)) as response:
+                return json.loads(response.read())
+        except (OSError, ValueError) as error:
+            state.proxy_errors += 1
+            Log.error(f"Cluster: failed to fetch {url}: {error}")
+            return None
+
+    urls = [base_url + path for node_id, base_url in state.nodes.items() if node_id != state.node_id]
+    results = await asyncio.gather(*(run_in_threadpool(fetch, url) for url in urls))
+    return [result for result in results if result is not None]
+
+
+async def proxy(scope, receive, send, base_url: str) -> None:
+    """ Stream response of owner node back to the client. """
+    url = base_url + scope["path"]
+    if scope.get("query_string"):
+        url += "?" + scope["query_string"].decode("latin-1")
+
+    headers = {}
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1")
+        if name in PASSED_REQUEST_HEADERS:
+            headers[name] = value.decode("latin-1")
+
+    client_ip = scope["client"][0] if scope.get("client") else ""
+    try:
+        upstream = await run_in_threadpool(open_peer, build_peer_request(url, scope["method"], client_ip, headers))
+    except OSError as error:
+        state.proxy_errors += 1
+        Log.error(f"Cluster: node at {base_url} unavailable: {error}")
+        response = JSONResponse({"status": False, "error": errors.NODE_UNAVAILABLE}, 502)
+        await response(scope, receive, send)
+        return
+
+    state.proxied += 1
+    try:
+        response_headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in upstream.headers.items()
+            if name.lower() not in HOP_BY_HOP_HEADERS
+        ]
+        await send({"type": "http.response.start", "status": upstream.status, "headers": response_headers})
+        while chunk := await run_in_threadpool(upstream.read, PROXY_CHUNK_SIZE):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        upstream.close()
+
+
+class ClusterRoutingMiddleware:
+    """ Route receive/delete of codes owned by other nodes. """
+
+    def __init__(self, app, has_code: Callable[[int], bool]) -> None:
+        self.app = app
+        self.has_code = has_code
+
+    async def __call__(self, scope, receive, send) -> None:
+        match = ROUTED_PATH.match(scope.get("path", "")) if scope["type"] == "http" else None
+        if match is None or not is_enabled() or is_forwarded(scope):
+            await self.app(scope, receive, send)
+            return
+
+        code = int(match.group(1))
+        owner = owner_of(code)
+        if owner == state.node_id or self.has_code(code):
+            await self.app(scope, receive, send)
+            return
+
+        if state.routing == "redirect":
+            state.redirected += 1
+            location = state.nodes[owner] + scope["path"]
+            if scope.get("query_string"):
+                location += "?" + scope["query_string"].decode("latin-1")
+            await RedirectResponse(location, 307)(scope, receive, send)
+            return
+
+        await proxy(scope, receive, send, state.nodes[owner])
+
+
+def stats() -> dict:
+    return {
+        "enabled": is_enabled(),
+        "node_id": state.node_id,
+        "nodes": len(state.nodes),
+        "routing": state.routing,
+        "redirected": state.redirected,
+        "proxied": state.proxied,
+        "proxy_errors": state.proxy_errors,
+    }
@@ -0,0 +1,105 @@
+"""
+Module: codes.py
+
+Description:
+    Transfer code formats and membership filter.
+
+    Checked format:
+        4 random digits followed by a Damm check digit. Every single-digit typo and
+        every adjacent transposition produces an invalid code, and 9 of 10 random
+        guesses are rejected by arithmetic only, before any lookup.
+
+    CodeSet:
+        Exact bitmap of live codes over the whole code space (~11 KiB for 90000 codes).
+        contains() answers "definitely not present" in O(1) without false positives.
+
+    Functions:
+        - damm_digit(number: int) -> int
+        - make_checked_code(base: int) -> int
+        - is_checked_code(code: int) -> bool
+"""
+DAMM_TABLE = (
+    (0, 3, 1, 7, 5, 9, 8, 6, 4, 2),
+    (7, 0, 9, 2, 1, 5, 4, 8, 6, 3),
+    (4, 2, 0, 6, 8, 7, 1, 3, 5, 9),
+    (1, 7, 5, 0, 9, 8, 3, 4, 2, 6),
+    (6, 1, 2, 3, 0, 4, 5, 9, 7, 8),
+    (3, 6, 7, 4, 2, 0, 9, 5, 8, 1),
+    (5, 8, 6, 9, 7, 2, 0, 1, 3, 4),
+    (8, 9, 4, 5, 3, 6, 2, 0, 1, 7),
+    (9, 4, 3, 8, 6, 1, 7, 2, 0, 5),
+    (2, 5, 8, 1, 4, 3, 6, 7, 9, 0),
+)
+CHECKED_BASE_RANGE = range(1000, 10000)
+
+
+def damm_digit(number: int) -> int:
+    """ Damm interim digit of number. Appending it to number makes damm_digit() == 0. """
+    interim = 0
+    for digit in str(number):
+        interim = DAMM_TABLE[interim][ord(digit) - 48]
+    return interim
+
+
+def make_checked_code(base: int) -> int:
+    """ 4-digit base -> 5-digit code with check digit. """
+    return base * 10 + damm_digit(base)
+
+
+def is_checked_code(code: int) -> bool:
+    return damm_digit(code) == 0
+
+
+class CodeSet:
+    """ Bitmap of codes within code_range. """
+
+    def __init__(self, code_range: range) -> None:
+        self.code_range = code_range
+        self._bits = bytearray((len(code_range) + 7) // 8)
+        self.count = 0
+
+    def _position(self, code: int) -> tuple[int, int] | None:
+        if code not in self.code_range:
+            return None
+        offset = code - self.code_range.start
+        return offset >> 3, 1 << (offset & 7)
+
+    def contains(self, code: int) -> bool:
+        position = self._position(code)
+        if position is None:
+            return False
+        index, mask = position
+        return bool(self._bits[index] & mask)
+
+    def add(self, code: int) -> None:
+        position = self._position(code)
+        if position is None:
+            return
+        index, mask = position
+        if not self._bits[index] & mask:
+            self._bits[index] |= mask
+            self.count += 1
+
+    def discard(self, code: int) -> None:
+        position = self._position(code)
+        if position is None:
+            return
+        index, mask = position
+        if self._bits[index] & mask:
+            self._bits[index] &= ~mask
+            self.count -= 1
+
+    def rebuild(self, codes) -> None:
+        """ Replace content with codes. New bitmap is swapped in at once. """
+        bits = bytearray(len(self._bits))
+        count = 0
+        for code in codes:
+            offset = int(code) - self.code_range.start
+            if 0 <= offset < len(self.code_range) and not bits[offset >> 3] & (1 << (offset & 7)):
+                bits[offset >> 3] |= 1 << (offset & 7)
+                count += 1
+        self._bits = bits
+        self.count = count
+
+    def size_bytes(self) -> int:
+        return len(self._bits)
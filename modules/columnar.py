@@ -0,0 +1,331 @@
+"""
+Module: columnar.py
+
+Description:
+    Column-oriented resident copy of a Database's content (Database.use_columnar).
+
+    A plain table keeps every row as a dict, so each row pays for a hash table and
+    it's own int and str objects. ColumnarTable keeps one storage per column instead:
+        int        array('q')
+        float      array('d')
+        hex str    fixed-width packed bytes (model's hex_columns, e.g. sha256 digests)
+        str        list of interned strings (repeated values share one object)
+        other      list of objects, empty values of list/dict columns shared as None
+    Values a storage can't encode (wrong type, out of range, malformed hex) are kept as
+    they are in it's `exceptions`, so content round-trips unchanged. Rows are dense:
+    deleting a row moves the last row into it's slot, so storages can be scanned as
+    whole sequences (Database.scan, Database.find_keys) without building rows.
+
+    ColumnarTable is a MutableMapping of key -> row dict. Rows are built on read and
+    encoded on write, modifying a returned row doesn't change the table.
+
+    ColumnarTable:
+        - scan(column_names: Iterable[str]) -> tuple[list[str], ...]
+          Keys and values of columns, aligned by position.
+        - find_keys(column_name: str, value) -> list[str]
+        - to_json() -> str
+        - stats() -> dict
+"""
+from collections.abc import MutableMapping
+from array import array
+import sys
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+INT64_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+
+class ColumnStorage:
+    """ Values of one column by slot. Subclasses define encoding of accepted values. """
+    blank = None
+
+    def __init__(self) -> None:
+        self.exceptions: dict[int, object] = {}
+
+    def accepts(self, value) -> bool:
+        return True
+
+    def encode(self, value):
+        return value
+
+    def decode(self, raw):
+        return raw
+
+    def append(self, value) -> None:
+        if self.accepts(value):
+            self._append(self.encode(value))
+        else:
+            self.exceptions[len(self)] = value
+            self._append(self.blank)
+
+    def set(self, slot: int, value) -> None:
+        if self.accepts(value):
+            self._set(slot, self.encode(value))
+            self.exceptions.pop(slot, None)
+        else:
+            self.exceptions[slot] = value
+            self._set(slot, self.blank)
+
+    def get(self, slot: int):
+        if self.exceptions and slot in self.exceptions:
+            return self.exceptions[slot]
+        return self.decode(self._get(slot))
+
+    def move(self, source: int, target: int) -> None:
+        """ Copy value of slot `source` into slot `target`. """
+        self._set(target, self._get(source))
+        if source in self.exceptions:
+            self.exceptions[target] = self.exceptions[source]
+        else:
+            self.exceptions.pop(target, None)
+
+    def pop(self) -> None:
+        """ Drop the last slot. """
+        self.exceptions.pop(len(self) - 1, None)
+        self._pop()
+
+    def values(self):
+        return [self.get(slot) for slot in range(len(self))]
+
+    def find(self, value) -> list[int]:
+        return [slot for slot in range(len(self)) if self.get(slot) == value]
+
+
+class ArrayStorage(ColumnStorage):
+    def __init__(self, typecode: str) -> None:
+        super().__init__()
+        self.typecode = typecode
+        self.data = array(typecode)
+        self.blank = 0 if typecode == "q" else 0.0
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def accepts(self, value) -> bool:
+        if self.typecode == "q":
+            return type(value) is int and INT64_RANGE[0] <= value <= INT64_RANGE[1]
+        return type(value) is float
+
+    def _append(self, raw) -> None:
+        self.data.append(raw)
+
+    def _set(self, slot: int, raw) -> None:
+        self.data[slot] = raw
+
+    def _get(self, slot: int):
+        return self.data[slot]
+
+    def _pop(self) -> None:
+        self.data.pop()
+
+    def values(self):
+        """ Copy of the array (a single memcpy) unless some values are exceptions. """
+        if self.exceptions:
+            return super().values()
+        return self.data[:]
+
+
+class HexStorage(ColumnStorage):
+    """ Lowercase hex strings of `width` bytes, or "". Each slot is a presence byte and the digest. """
+    def __init__(self, width: int) -> None:
+        super().__init__()
+        self.width = width
+        self.stride = width + 1
+        self.data = bytearray()
+        self.blank = bytes(self.stride)
+
+    def __len__(self) -> int:
+        return len(self.data) // self.stride
+
+    def accepts(self, value) -> bool:
+        if value == "":
+            return True
+        if type(value) is not str or len(value) != self.width * 2 or value != value.lower():
+            return False
+        try:
+            bytes.fromhex(value)
+        except ValueError:
+            return False
+        return True
+
+    def encode(self, value) -> bytes:
+        if value == "":
+            return self.blank
+        return b"\x01" + bytes.fromhex(value)
+
+    def decode(self, raw) -> str:
+        return raw[1:].hex() if raw[0] else ""
+
+    def _append(self, raw) -> None:
+        self.data += raw
+
+    def _set(self, slot: int, raw) -> None:
+        self.data[slot * self.stride:(slot + 1) * self.stride] = raw
+
+    def _get(self, slot: int) -> bytes:
+        return bytes(self.data[slot * self.stride:(slot + 1) * self.stride])
+
+    def _pop(self) -> None:
+        del self.data[-self.stride:]
+
+    def find(self, value) -> list[int]:
+        """ Search packed bytes with bytearray.find, only stride-aligned matches count. """
+        if not self.accepts(value):
+            return [slot for slot, exception in self.exceptions.items() if exception == value]
+
+        needle = self.encode(value)
+        slots = []
+        position = self.data.find(needle)
+        while position != -1:
+            if position % self.stride:
+                position = self.data.find(needle, position + 1)
+                continue
+            slot = position // self.stride
+            if slot not in self.exceptions:
+                slots.append(slot)
+            position = self.data.find(needle, position + self.stride)
+        return slots
+
+
+class ObjectStorage(ColumnStorage):
+    """ intern: share equal strings. empty_type: store empty values of this type (list, dict) as None. """
+    def __init__(self, intern: bool = False, empty_type: type | None = None) -> None:
+        super().__init__()
+        self.intern = intern
+        self.empty_type = empty_type
+        self.data: list = []
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def accepts(self, value) -> bool:
+        return value is not None
+
+    def encode(self, value):
+        if self.intern and type(value) is str:
+            return sys.intern(value)
+        if self.empty_type is not None and type(value) is self.empty_type and not value:
+            return None
+        return value
+
+    def decode(self, raw):
+        if raw is None and self.empty_type is not None:
+            return self.empty_type()
+        return raw
+
+    def _append(self, raw) -> None:
+        self.data.append(raw)
+
+    def _set(self, slot: int, raw) -> None:
+        self.data[slot] = raw
+
+    def _get(self, slot: int):
+        return self.data[slot]
+
+    def _pop(self) -> None:
+        self.data.pop()
+
+
+def build_storage(type_: type, hex_width: int | None = None) -> ColumnStorage:
+    if hex_width:
+        return HexStorage(hex_width)
+    if type_ is int:
+        return ArrayStorage("q")
+    if type_ is float:
+        return ArrayStorage("d")
+    if type_ is str:
+        return ObjectStorage(intern=True)
+    if type_ in (list, dict):
+        return ObjectStorage(empty_type=type_)
+    return ObjectStorage()
+
+
+class ColumnarTable(MutableMapping):
+    """
+    columns: Database's columns ({name: Column}), missing values get column's default.
+    hex_columns: {column name: width in bytes} of columns holding hex digests.
+    """
+    def __init__(self, columns: dict, hex_columns: dict[str, int] | None = None) -> None:
+        self._columns = columns
+        self._storages = {name: build_storage(column.type_, (hex_columns or {}).get(name)) for name, column in columns.items()}
+        self._keys: list[str] = []
+        self._slots: dict[str, int] = {}
+        self._extras: dict[int, dict] = {}  # slot: values of keys which are not columns
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self._slots
+
+    def __getitem__(self, key: str) -> dict:
+        slot = self._slots[key]
+        row = {name: storage.get(slot) for name, storage in self._storages.items()}
+        if self._extras and slot in self._extras:
+            row.update(self._extras[slot])
+        return row
+
+    def __setitem__(self, key: str, row: dict) -> None:
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = len(self._keys)
+            for name, storage in self._storages.items():
+                storage.append(row[name] if name in row else self._columns[name].prepare_value(None))
+            self._keys.append(key)
+            self._slots[key] = slot
+        else:
+            for name, storage in self._storages.items():
+                storage.set(slot, row[name] if name in row else self._columns[name].prepare_value(None))
+
+        extras = {name: value for name, value in row.items() if name not in self._storages}
+        if extras:
+            self._extras[slot] = extras
+        else:
+            self._extras.pop(slot, None)
+
+    def __delitem__(self, key: str) -> None:
+        slot = self._slots.pop(key)
+        last = len(self._keys) - 1
+        if slot != last:
+            for storage in self._storages.values():
+                storage.move(last, slot)
+            moved_key = self._keys[last]
+            self._keys[slot] = moved_key
+            self._slots[moved_key] = slot
+            if last in self._extras:
+                self._extras[slot] = self._extras.pop(last)
+            else:
+                self._extras.pop(slot, None)
+
+        for storage in self._storages.values():
+            storage.pop()
+        self._keys.pop()
+        self._extras.pop(last, None)
+
+    def scan(self, column_names) -> tuple[list[str], ...]:
+        """ Keys and values of columns (arrays for numeric columns), aligned by position. """
+        return (self._keys[:], *(self._storages[name].values() for name in column_names))
+
+    def find_keys(self, column_name: str, value) -> list[str]:
+        return [self._keys[slot] for slot in self._storages[column_name].find(value)]
+
+    def to_json(self) -> str:
+        """ Serialize like a dict of rows, one row per line, without building them all at once. """
+        if not self._keys:
+            return "{}"
+        lines = (f"  {json.dumps(key)}: {json.dumps(self[key], ensure_ascii=False)}" for key in self._keys)
+        return "{\n" + ",\n".join(lines) + "\n}"
+
+    def stats(self) -> dict:
+        return {
+            "rows": len(self._keys),
+            "exceptions": {name: len(storage.exceptions) for name, storage in self._storages.items() if storage.exceptions},
+            "extras": len(self._extras),
+        }
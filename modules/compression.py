@@ -0,0 +1,134 @@
+"""
+Module: compression.py
+
+Description:
+    Transparent gzip compression of stored transfers.
+
+    Whether a transfer is compressed is decided per file by compressing the first
+    chunk with a fast level; incompressible content (archives, media) is stored raw.
+    Compressed blobs are complete gzip streams, so they can be sent as-is with
+    `Content-Encoding: gzip` to clients accepting it, or decompressed on the fly.
+
+    Functions:
+        - is_worth_compressing(sample: bytes) -> bool
+        - accepts_gzip(accept_encoding: str | None) -> bool
+        - iter_decompressed(chunks: Iterable[bytes]) -> Iterator[bytes]
+        - iter_content(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]
+          Original content of blob (given as stored chunks), decompressed if needed.
+    BlobEncoder(destination: BinaryIO, compress: bool)
+        - write(data: bytes), finish() -> tuple[int, int, str]
+          Encode content pushed in pieces (streamed uploads). Returns (original size, stored size, encoding).
+"""
+from typing import BinaryIO, Iterable, Iterator
+import zlib
+
+
+GZIP_ENCODING = "gzip"
+GZIP_WBITS = 31
+CHUNK_SIZE = 1024 * 1024
+SAMPLE_LEVEL = 1
+STORE_LEVEL = 6
+MIN_SAMPLE_SIZE = 512
+MAX_COMPRESSED_RATIO = 0.9
+
+
+def is_worth_compressing(sample: bytes) -> bool:
+    """ Check if first chunk of file shrinks enough to pay for compression. """
+    if len(sample) < MIN_SAMPLE_SIZE:
+        return False
+    return len(zlib.compress(sample, SAMPLE_LEVEL)) < len(sample) * MAX_COMPRESSED_RATIO
+
+
+class BlobEncoder:
+    """
+    Encoder of blob content arriving in arbitrary pieces. The first CHUNK_SIZE bytes
+    are held back as sample which decides the encoding.
+    """
+
+    def __init__(self, destination: BinaryIO, compress: bool) -> None:
+        self.destination = destination
+        self.sample: bytearray | None = bytearray() if compress else None
+        self.compressor = None
+        self.original_size = 0
+        self.stored_size = 0
+
+    def write(self, data: bytes) -> None:
+        if self.sample is None:
+            self.__emit(data)
+            return
+
+        self.sample += data
+        if len(self.sample) >= CHUNK_SIZE:
+            self.decide()
+
+    def decide(self) -> None:
+        """ Choose encoding by the sample collected so far (no-op once decided). """
+        if self.sample is None:
+            return
+
+        sample = bytes(self.sample)
+        self.sample = None
+        if is_worth_compressing(sample):
+            self.compressor = zlib.compressobj(STORE_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+        self.__emit(sample)
+
+    def __emit(self, data: bytes) -> None:
+        self.original_size += len(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if data:
+            self.stored_size += len(data)
+            self.destination.write(data)
+
+    def finish(self) -> tuple[int, int, str]:
+        """ Returns (original size, stored size, encoding). """
+        self.decide()
+        if self.compressor is None:
+            return self.original_size, self.stored_size, ""
+
+        tail = self.compressor.flush()
+        self.destination.write(tail)
+        self.stored_size += len(tail)
+        return self.original_size, self.stored_size, GZIP_ENCODING
+
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    """ Parse Accept-Encoding header. """
+    if not accept_encoding:
+        return False
+
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() not in (GZIP_ENCODING, "*"):
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+
+    return False
+
+
+def iter_decompressed(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """ Yield decompressed content of gzip blob in chunks of at most CHUNK_SIZE. """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk, CHUNK_SIZE)
+            if data:
+                yield data
+            chunk = decompressor.unconsumed_tail
+
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def iter_content(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """ Yield original content of blob stored with `encoding`. """
+    if encoding == GZIP_ENCODING:
+        return iter_decompressed(chunks)
+    return iter(chunks)
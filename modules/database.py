@@ -12,9 +12,20 @@ DESCRIPTION
       Register prevents reinitialization and allows quick DB access.
       You can get initialized Database object by calling Database.get_database(name).
 
+      Content is kept in memory after first read. The file is parsed again only if
+      it's signature (mtime, size, inode) changed, e.g. when written by another process.
+      Database(model, lazy=True) postpones reading the file until first use or load().
+      Database.reloads counts re-reads caused by external changes, so derived
+      in-memory structures know when to rebuild.
+
+      use_columnar(True) keeps the resident copy as a ColumnarTable (modules/columnar.py):
+      typed arrays and packed hex digests instead of a dict per row. The file format
+      doesn't change. scan() and find_keys() read columns without building models,
+      in both modes.
+
       Interface methods:
           - insert(data: T_Model) -> str
-            Inserts new row to database, returns provided key.
+            Inserts new row to database, returns provided key. Raises KeyAlreadyExists if key is taken.
           - update(key: str, changes: dict[str, Any], iter_append: bool = False, iter_pop: bool = True)
             Updates specified in changes parameter values. Append/pop from iterable if flag is set.
           - get(key: str) -> T_Model
@@ -23,23 +34,64 @@ DESCRIPTION
             Increment value of number-like field.
           - decrement(key: str, column_name: str) -> bool
             Decrement value of number-like field.
+          - add_to_column(column_name: str, deltas: dict[str, int]) -> int
+            Add deltas to number-like field of many rows with a single file write.
           - get_all_models() -> List[T_Model]
             Returns list of all models saved in database.
           - get_all_keys() -> List[str]
             Returns list of all keys saved in database.
+          - load() -> Database
+            Create and read DB file now (called implicitly by every other method).
+          - refresh() -> int
+            Re-read file if changed by someone else. Returns reloads counter.
+          - use_columnar(enabled: bool)
+            Switch resident copy between dict of rows and ColumnarTable.
+          - scan(*column_names: str) -> tuple[list[str], ...]
+            Keys and values of columns aligned by position (arrays for numeric columns in columnar mode).
+          - find_keys(column_name: str, value) -> list[str]
+            Keys of rows whose column equals value.
+          - dump_snapshot() -> str
+            JSON with whole content, change log's epoch and sequence it corresponds to.
+          - apply_snapshot(content: dict) / apply_changes(changes: list[dict]) -> int
+            Replace content / apply changes read from another Database's ChangeLog.
+
+    BatchedCounter:
+      Exact in-memory counter of a number-like column (e.g. downloads) for hot paths.
+      acquire() checks the limit and counts under one lock, without touching the file.
+      Counts are written in batches by flush(), from a background thread every
+      flush_interval_s seconds or sooner once flush_after counts are pending.
+      Counts of a failed write stay pending. Counts are exact for a single process.
+      Values are read again when the file was reloaded, so counts of other processes
+      are seen once they are flushed - until then, limits may be exceeded by them.
+
+    ChangeLog:
+      Ordered stream of Database's writes for replicas (modules/replication.py).
+      Every written row ("put", with copy of the row) and deleted key ("delete") gets
+      next sequence number; the last `capacity` changes are kept (0 = none). Epoch is
+      replaced whenever content changed in a way the stream doesn't describe (file
+      read or reloaded, migration, applied snapshot) - followers then start again
+      from Database.dump_snapshot(). read() can wait for new changes (long-poll).
 
   Defined databases:
       users_db, rooms_db, sessions_db
 
 """
+from modules.columnar import ColumnarTable
 from modules.paths import Path
 from modules import timestamp
 from modules.logs import Log
 
 from typing import Any, List, Type, Generic, TypeVar, TYPE_CHECKING
 from dataclasses import dataclass, asdict
+from collections import deque
+from itertools import islice
+import threading
 import hashlib
+import secrets
+import copy
+import time
 import uuid
+import os
 
 if TYPE_CHECKING:
     from dataclasses import _DataclassT
@@ -62,6 +114,13 @@ class KeyNotFound(Exception):
     """
 
 
+class KeyAlreadyExists(Exception):
+    """
+    Exception raised when inserted entry's
+    key is already used in database.
+    """
+
+
 class RequiredValueNotProvided(Exception):
     """
     Exception raised when value for required
@@ -70,7 +129,7 @@ class RequiredValueNotProvided(Exception):
 
 
 class DBModel:
-    dbs_path: Path = Path("./data/")
+    dbs_path: Path = Path("./data/", lazy=True)
 
     @staticmethod
     def model(
@@ -78,7 +137,8 @@ class DBModel:
         key_provider: str,
         file_path: str = None,
         allow_invalid_values: bool = None,
-        dump_on_error: bool = None
+        dump_on_error: bool = None,
+        hex_columns: dict[str, int] = None
     ) -> "_DataclassT":
         def wrapper(cls):
             nonlocal file_path
@@ -99,7 +159,8 @@ class DBModel:
                 file_path,
                 allow_invalid_values,
                 dump_on_error,
-                cls
+                cls,
+                hex_columns or {}
             )
             cls.__dbmodel__ = db_model
             return dataclass(cls)
@@ -108,12 +169,13 @@ class DBModel:
     def __call__(self, *args, **kwargs):
         return self.model_cls(*args, **kwargs)
 
-    def __init__(self, name: str, key_provider: str, file_path: str, allow_invalid_values: bool, dump_on_error: bool, model_cls: Type) -> None:
+    def __init__(self, name: str, key_provider: str, file_path: str, allow_invalid_values: bool, dump_on_error: bool, model_cls: Type, hex_columns: dict[str, int] = None) -> None:
         self.name = name
         self.key_provider = key_provider
         self.file_path = file_path
         self.allow_invalid_values = allow_invalid_values
         self.dump_on_error = dump_on_error
+        self.hex_columns = hex_columns or {}  # Column name: width in bytes of it's hex digests (packed in columnar mode)
 
         self.model_cls = model_cls
         self.fields = self.model_cls.__annotations__
@@ -179,6 +241,77 @@ class Column:
         return isinstance(value, self.type_)
 
 
+class ChangeLog:
+    """
+    capacity: Number of retained changes, 0 disables retention (sequence still advances).
+    """
+    def __init__(self, capacity: int = 0) -> None:
+        self.capacity = capacity
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.resets = 0
+        self._entries: deque[dict] = deque()
+        self._condition = threading.Condition()
+
+    def enable(self, capacity: int) -> None:
+        with self._condition:
+            self.capacity = max(capacity, 0)
+            while len(self._entries) > self.capacity:
+                self._entries.popleft()
+
+    def publish(self, op: str, key: str, row: dict | None = None) -> None:
+        """ Append change. Caller holds database's lock, so sequence follows write order. """
+        with self._condition:
+            self.seq += 1
+            if self.capacity:
+                self._entries.append({
+                    "seq": self.seq,
+                    "op": op,
+                    "key": key,
+                    "row": copy.deepcopy(row),
+                    "time": time.time(),
+                })
+                if len(self._entries) > self.capacity:
+                    self._entries.popleft()
+            self._condition.notify_all()
+
+    def reset(self) -> None:
+        """ Start new epoch, retained changes no longer apply. """
+        with self._condition:
+            self.epoch = secrets.token_hex(4)
+            self._entries.clear()
+            self.resets += 1
+            self._condition.notify_all()
+
+    def read(self, epoch: str, after: int, limit: int = 1000, wait_s: float = 0) -> dict | None:
+        """
+        Changes following sequence `after` of `epoch`, waiting up to wait_s for some.
+        Returns None when they can't be served (other epoch, no longer retained),
+        the reader must start from a snapshot.
+        """
+        with self._condition:
+            if wait_s > 0 and epoch == self.epoch and after == self.seq:
+                self._condition.wait_for(lambda: epoch != self.epoch or self.seq > after, wait_s)
+
+            if epoch != self.epoch or after > self.seq:
+                return None
+            if after < self.seq and (not self._entries or self._entries[0]["seq"] > after + 1):
+                return None
+
+            start = after - self._entries[0]["seq"] + 1 if self._entries else 0
+            changes = list(islice(self._entries, start, start + limit))
+            return {"epoch": self.epoch, "seq": self.seq, "changes": changes}
+
+    def stats(self) -> dict:
+        return {
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "retained": len(self._entries),
+            "capacity": self.capacity,
+            "resets": self.resets,
+        }
+
+
 class Database(Generic[T_Model]):
     """
     Database must be initialized from DBModel.
@@ -196,7 +329,7 @@ class Database(Generic[T_Model]):
             return None
         return Database.register.get(name)
 
-    def __init__(self, model: T_Model):
+    def __init__(self, model: T_Model, lazy: bool = False):
         self.__model: T_Model = model.__dbmodel__
         self.name = self.__model.name
         self.filepath = self.__model.file_path
@@ -204,15 +337,24 @@ class Database(Generic[T_Model]):
         self.allow_invalid_values = self.__model.allow_invalid_values
         self.dump_on_error = self.__model.dump_on_error
         self.columns: dict[str, Column] = {}
+        self.columnar = False
+
+        self._lock = threading.RLock()
+        self._content: dict | None = None
+        self._signature: tuple[int, int, int] | None = None
+        self.reloads = 0
+        self.changes = ChangeLog()
 
         if self.name in Database.register:
             self = Database.register.get(self.name)
             return
 
-        self.__ensure_db_file()
         self.__build_from_model()
         Database.register[self.name] = self
 
+        if not lazy:
+            self.load()
+
     def __repr__(self) -> str:
         return f"<DB: name={self.name} keyProvider={self.key_provider} columns={set(self.columns.keys())} file={self.filepath}>"
 
@@ -235,29 +377,99 @@ class Database(Generic[T_Model]):
         """ Check and create blank DB file if not exists. """
         if not self.filepath.exists():
             self.filepath.touch()
-            self.filepath.save_json_content({})
+            self.__save_db_content({})
             return
 
         try:
-            self.__get_db_content()
+            self.__read_db_file()
 
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, ValueError):
             if not self.dump_on_error:
                 raise
 
             corrupted_content = self.filepath.read()
             dumpfile_content = f"\n\n--- DUMP: {timestamp.generate_timestamp()} ---\n" + corrupted_content
             (self.filepath + ".dump").touch().write(dumpfile_content)
-            self.filepath.save_json_content({})
+            self.__save_db_content({})
+            self.changes.reset()
+
+    def __file_signature(self) -> tuple[int, int, int] | None:
+        try:
+            stat = os.stat(self.filepath.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def __read_db_file(self) -> None:
+        """ Parse DB file into memory. """
+        signature = self.__file_signature()
+        self._content = self.__as_resident(self.filepath.get_json_content())
+        self._signature = signature
+        self.changes.reset()
 
     def __get_db_content(self) -> dict:
-        """ Get and return database's file content as dict. """
-        return self.filepath.get_json_content()
+        """
+        Get and return database's content as dict.
+        Returned dict is the resident copy, callers that modify it must save it.
+        """
+        if self._content is None:
+            self.load()
+
+        elif self.__file_signature() != self._signature:
+            Log.info(f"(DB:{self.name}) File changed externally, reloading.")
+            self.__read_db_file()
+            self.reloads += 1
+
+        return self._content
+
+    def __save_db_content(self, content: dict) -> None:
+        """ Write content to DB file and keep it as resident copy. """
+        content = self.__as_resident(content)
+        if isinstance(content, ColumnarTable):
+            self.filepath.write(content.to_json(), "w")
+        else:
+            self.filepath.save_json_content(content)
+        self._content = content
+        self._signature = self.__file_signature()
+
+    def __as_resident(self, content: dict) -> dict:
+        """ Content in the representation of current mode. """
+        if self.columnar and not isinstance(content, ColumnarTable):
+            table = ColumnarTable(self.columns, self.__model.hex_columns)
+            table.update(content)
+            return table
+        if not self.columnar and isinstance(content, ColumnarTable):
+            return dict(content.items())
+        return content
+
+    def use_columnar(self, enabled: bool) -> None:
+        """ Switch representation of resident copy, converting it if already read. """
+        with self._lock:
+            self.columnar = enabled
+            if self._content is not None:
+                self._content = self.__as_resident(self._content)
+
+    def load(self) -> "Database":
+        """ Create and read DB file if it was not read yet. """
+        with self._lock:
+            if self._content is None:
+                self.__ensure_db_file()
+        return self
+
+    def refresh(self) -> int:
+        """ Re-read file if it was changed by another process. Returns reloads counter. """
+        with self._lock:
+            self.__get_db_content()
+        return self.reloads
+
+    def is_loaded(self) -> bool:
+        return self._content is not None
 
-    def __save_model(self, model: T_Model, db_key: str = None) -> str:
+    def __save_model(self, model: T_Model, db_key: str = None, overwrite: bool = True) -> str:
         """
         Write entry to database. If key is not provided,
         new entry will be created with provided key.
+        Existing entry is replaced only if overwrite is set.
         Returns database key.
         """
         if db_key is None:
@@ -285,9 +497,13 @@ class Database(Generic[T_Model]):
 
             content[column_name] = value
 
-        db_content = self.__get_db_content()
-        db_content[db_key] = content
-        self.filepath.save_json_content(db_content)
+        with self._lock:
+            db_content = self.__get_db_content()
+            if not overwrite and str(db_key) in db_content:
+                raise KeyAlreadyExists(f"db: {self.name} key: {db_key}")
+            db_content[str(db_key)] = content
+            self.__save_db_content(db_content)
+            self.changes.publish("put", str(db_key), content)
         return db_key
     
     def _migrate(self) -> int:
@@ -295,27 +511,29 @@ class Database(Generic[T_Model]):
         Should be called if new column has been added to the model. 
         Adds that column into all existing entries. Column must have default value.
         """
-        raw_content = self.__get_db_content()
-        new_content = {}
-        changes = 0
-        
-        for db_key, row_db_content in raw_content.items(): 
-            for column_name, column_obj in self.columns.items():
-                if column_name not in row_db_content:
-                    row_db_content[column_name] = column_obj.prepare_value(None)
-                    changes += 1
-                
-            new_content[db_key] = row_db_content
-            
-        if changes:
-            Log.info(f"Migration: {self.name} - Saving updated content with: {changes} updated rows.")
-            self.filepath.save_json_content(new_content)
-            
+        with self._lock:
+            raw_content = self.__get_db_content()
+            new_content = {}
+            changes = 0
+
+            for db_key, row_db_content in raw_content.items():
+                for column_name, column_obj in self.columns.items():
+                    if column_name not in row_db_content:
+                        row_db_content[column_name] = column_obj.prepare_value(None)
+                        changes += 1
+
+                new_content[db_key] = row_db_content
+
+            if changes:
+                Log.info(f"Migration: {self.name} - Saving updated content with: {changes} updated rows.")
+                self.__save_db_content(new_content)
+                self.changes.reset()
+
         return changes
 
     def insert(self, data: T_Model) -> str:
         """ Insert new entry to database. Returns key. """
-        return self.__save_model(data)
+        return self.__save_model(data, overwrite=False)
 
     def update(self, key: str, changes: dict[str, Any] | Any, iter_append: bool = False, iter_pop: bool = False) -> None:
         """
@@ -333,6 +551,10 @@ class Database(Generic[T_Model]):
             Log.error(f"(DB:{self.name}) method called with both iter_append and iter_pop flags!")
             return
 
+        with self._lock:
+            self.__update(key, changes, iter_append, iter_pop)
+
+    def __update(self, key: str, changes: dict[str, Any], iter_append: bool, iter_pop: bool) -> None:
         model_object = self.get(key)
         for key_name, value in changes.items():
             if not hasattr(model_object, key_name):
@@ -367,20 +589,22 @@ class Database(Generic[T_Model]):
     def delete(self, key: str) -> None:
         """ Delete key-value pair from database. Raises KeyNotFound. """
         key = str(key)
-        db_content = self.__get_db_content()
-        if key not in db_content:
-            raise KeyNotFound(f"db: {self.name} key: {key}")
+        with self._lock:
+            db_content = self.__get_db_content()
+            if key not in db_content:
+                raise KeyNotFound(f"db: {self.name} key: {key}")
 
-        db_content.pop(key)
-        self.filepath.save_json_content(db_content)
+            db_content.pop(key)
+            self.__save_db_content(db_content)
+            self.changes.publish("delete", key)
 
     def get(self, key: str) -> T_Model:
         """
         Get object from database by it's key.
         Raises KeyNotFound error if key is invalid.
         """
-        db_content = self.__get_db_content()
-        object_content = db_content.get(str(key))
+        with self._lock:
+            object_content = self.__get_db_content().get(str(key))
         if object_content is None:
             raise KeyNotFound(f"db: {self.name} key: {key}")
 
@@ -396,18 +620,19 @@ class Database(Generic[T_Model]):
         column = self.columns.get(column_name)
         if not column:
             raise KeyNotFound(f"db: {self.name} column: {column_name}")
-          
-        model = self.get(key)
-        if not model:
-            raise KeyNotFound(f"db: {self.name} key: {key}")
-        
-        value = getattr(model, column_name)
-        if not isinstance(value, (int, float)):
-            return False
-        
-        value += 1
-        setattr(model, column_name, value)
-        self.__save_model(model, key)
+
+        with self._lock:
+            model = self.get(key)
+            if not model:
+                raise KeyNotFound(f"db: {self.name} key: {key}")
+
+            value = getattr(model, column_name)
+            if not isinstance(value, (int, float)):
+                return False
+
+            value += 1
+            setattr(model, column_name, value)
+            self.__save_model(model, key)
         return True
 
     def decrement(self, key: str, column_name: str) -> bool:
@@ -418,31 +643,251 @@ class Database(Generic[T_Model]):
         column = self.columns.get(column_name)
         if not column:
             raise KeyNotFound(f"db: {self.name} column: {column_name}")
-          
-        model = self.get(key)
-        if not model:
-            raise KeyNotFound(f"db: {self.name} key: {key}")
-        
-        value = getattr(model, column_name)
-        if not isinstance(value, (int, float)):
-            return False
-        
-        value -= 1
-        setattr(model, column_name, value)
-        self.__save_model(model, key)
+
+        with self._lock:
+            model = self.get(key)
+            if not model:
+                raise KeyNotFound(f"db: {self.name} key: {key}")
+
+            value = getattr(model, column_name)
+            if not isinstance(value, (int, float)):
+                return False
+
+            value -= 1
+            setattr(model, column_name, value)
+            self.__save_model(model, key)
         return True
 
+    def add_to_column(self, column_name: str, deltas: dict[str, int]) -> int:
+        """
+        Add deltas ({key: delta}) to number-like column of many rows, saving the file once.
+        Missing keys are skipped. Returns number of updated rows.
+        """
+        if column_name not in self.columns:
+            raise KeyNotFound(f"db: {self.name} column: {column_name}")
+
+        updated = []
+        with self._lock:
+            db_content = self.__get_db_content()
+            for key, delta in deltas.items():
+                row = db_content.get(str(key))
+                if row is None or not isinstance(row.get(column_name, 0), (int, float)):
+                    continue
+                row[column_name] = row.get(column_name, 0) + delta
+                db_content[str(key)] = row  # Columnar rows are copies
+                updated.append(str(key))
+
+            if updated:
+                self.__save_db_content(db_content)
+                for key in updated:
+                    self.changes.publish("put", key, db_content[key])
+        return len(updated)
+
+    def dump_snapshot(self) -> str:
+        """ Serialized content with epoch and sequence of the change log it corresponds to. """
+        with self._lock:
+            content = self.__get_db_content()
+            if isinstance(content, ColumnarTable):
+                return f'{{"epoch": {json.dumps(self.changes.epoch)}, "seq": {self.changes.seq}, "content": {content.to_json()}}}'
+            return json.dumps({"epoch": self.changes.epoch, "seq": self.changes.seq, "content": content})
+
+    def apply_snapshot(self, content: dict) -> None:
+        """ Replace whole content (replica catch-up). Derived structures rebuild on reloads change. """
+        with self._lock:
+            self.__get_db_content()
+            self.__save_db_content(content)
+            self.changes.reset()
+            self.reloads += 1
+
+    def apply_changes(self, changes: list[dict]) -> int:
+        """ Apply changes read from another database's ChangeLog with one file write. Returns applied count. """
+        if not changes:
+            return 0
+
+        with self._lock:
+            db_content = self.__get_db_content()
+            for change in changes:
+                if change["op"] == "put":
+                    db_content[change["key"]] = change["row"]
+                else:
+                    db_content.pop(change["key"], None)
+
+            self.__save_db_content(db_content)
+            for change in changes:
+                self.changes.publish(change["op"], change["key"], change.get("row"))
+            self.reloads += 1
+        return len(changes)
+
     def get_all_models(self) -> List[T_Model]:
         """ Get all models saved in database. """
         objects = []
-        db_content = self.__get_db_content()
-        for key, content in db_content.items():
-            model = self.__model(**content)
-            model._key = key
-            objects.append(model)
+        with self._lock:
+            for key, content in self.__get_db_content().items():
+                model = self.__model(**content)
+                model._key = key
+                objects.append(model)
 
         return objects
 
     def get_all_keys(self) -> List[str]:
         """ Get all keys saved in database. """
-        return list(self.__get_db_content().keys())
+        with self._lock:
+            return list(self.__get_db_content().keys())
+
+    def scan(self, *column_names: str) -> tuple[list[str], ...]:
+        """
+        Keys and values of columns, aligned by position, without building models.
+        Numeric columns are arrays in columnar mode, so sum() and map() run over them in C.
+        """
+        for column_name in column_names:
+            if column_name not in self.columns:
+                raise KeyNotFound(f"db: {self.name} column: {column_name}")
+
+        with self._lock:
+            content = self.__get_db_content()
+            if isinstance(content, ColumnarTable):
+                return content.scan(column_names)
+
+            rows = list(content.values())
+            defaults = {name: self.columns[name].prepare_value(None) for name in column_names}
+            return (list(content), *([row.get(name, defaults[name]) for row in rows] for name in column_names))
+
+    def find_keys(self, column_name: str, value: Any) -> List[str]:
+        """ Keys of rows whose column equals value. """
+        if column_name not in self.columns:
+            raise KeyNotFound(f"db: {self.name} column: {column_name}")
+
+        with self._lock:
+            content = self.__get_db_content()
+            if isinstance(content, ColumnarTable):
+                return content.find_keys(column_name, value)
+            return [key for key, row in content.items() if row.get(column_name) == value]
+
+
+class BatchedCounter:
+    """
+    db: Database holding the column.
+    column_name: Number-like column counted.
+    """
+    def __init__(self, db: Database, column_name: str, flush_interval_s: float = 5, flush_after: int = 256) -> None:
+        self.db = db
+        self.column_name = column_name
+        self.flush_interval_s = flush_interval_s
+        self.flush_after = flush_after
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._values: dict[str, int] = {}  # key: current value (stored + pending)
+        self._pending: dict[str, int] = {}  # key: not yet written delta
+        self._pending_count = 0
+        self._flushing = 0  # Writes in progress
+        self._reloads = db.reloads
+        self._flusher: threading.Thread | None = None
+
+        self.flushes = 0
+        self.rejected = 0
+
+    def __sync(self) -> None:
+        """
+        Drop cached values once the file was reloaded (written by another process).
+        Not while a flush is writing, values read then may or may not include it. Caller holds the lock.
+        """
+        reloads = self.db.refresh()
+        if reloads != self._reloads and not self._flushing:
+            self._values.clear()
+            self._reloads = reloads
+
+    def __load_value(self, key: str) -> int:
+        value = self._values.get(key)
+        if value is None:
+            value = (getattr(self.db.get(key), self.column_name) or 0) + self._pending.get(key, 0)
+            self._values[key] = value
+        return value
+
+    def acquire(self, key: str, limit: int = 0) -> int | None:
+        """
+        Count one use of key. Returns new value, or None if limit (0 = unlimited) is already reached.
+        Raises KeyNotFound for unknown key.
+        """
+        key = str(key)
+        with self._lock:
+            self.__sync()
+            value = self.__load_value(key)
+            if limit and value >= limit:
+                self.rejected += 1
+                return None
+
+            value += 1
+            self._values[key] = value
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._pending_count += 1
+            should_flush = self._pending_count >= self.flush_after
+
+        self.__ensure_flusher()
+        if should_flush:
+            self._wake.set()
+        return value
+
+    def get(self, key: str) -> int:
+        key = str(key)
+        with self._lock:
+            self.__sync()
+            return self.__load_value(key)
+
+    def forget(self, key: str) -> None:
+        """ Drop state of removed row. """
+        key = str(key)
+        with self._lock:
+            self._values.pop(key, None)
+            if key in self._pending:
+                self._pending_count -= self._pending.pop(key)
+
+    def flush(self) -> int:
+        """ Write pending counts. Returns number of updated rows. Failed write keeps them pending. """
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            self._pending_count = 0
+            self._flushing += 1
+
+        try:
+            updated = self.db.add_to_column(self.column_name, pending)
+        except Exception:
+            with self._lock:
+                for key, delta in pending.items():
+                    if key in self._values:  # Not forgotten meanwhile
+                        self._pending[key] = self._pending.get(key, 0) + delta
+                        self._pending_count += delta
+            raise
+        finally:
+            with self._lock:
+                self._flushing -= 1
+
+        self.flushes += 1
+        return updated
+
+    def __ensure_flusher(self) -> None:
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self.__flush_loop, name=f"counter-{self.db.name}-{self.column_name}", daemon=True)
+                self._flusher.start()
+
+    def __flush_loop(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval_s)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as error:
+                Log.error(f"(DB:{self.db.name}) Failed to flush {self.column_name} counter: {error}")
+
+    def stats(self) -> dict:
+        return {
+            "tracked_keys": len(self._values),
+            "pending": self._pending_count,
+            "flushes": self.flushes,
+            "rejected": self.rejected,
+        }
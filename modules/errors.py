@@ -9,3 +9,20 @@ INVALID_LIFETIME = T_Error("Invalid lifetime.")
 INVALID_CODE = T_Error("Code not found or is expired.")
 NOT_OWNER = T_Error("You are not the owner of the file.")
 MAX_SHARED_FILES = T_Error("Cannot share more files. Remove exisitng…")
+TOO_MANY_FILES = T_Error("Too many files in one transfer.")
+NO_FILES = T_Error("No file to transfer.")
+INVALID_FILE_INDEX = T_Error("File not found in this transfer.")
+SERVER_BUSY = T_Error("Server is busy. Try again later.")
+NO_CODES_AVAILABLE = T_Error("No free transfer codes. Try again later.")
+INVALID_MAX_DOWNLOADS = T_Error("Invalid downloads limit.")
+NODE_UNAVAILABLE = T_Error("Storage node unavailable. Try again later.")
+INVALID_FORM = T_Error("Invalid upload form.")
+INVALID_UPLOAD_TOKEN = T_Error("Upload token is invalid or expired.")
+PROFILER_BUSY = T_Error("Profiler is already running.")
+INVALID_PROFILE_FORMAT = T_Error("Unknown profile format.")
+NO_MEMORY_SNAPSHOT = T_Error("No memory snapshot to compare with.")
+INVALID_MEMORY_GROUPING = T_Error("Unknown grouping of memory statistics.")
+READ_ONLY_REPLICA = T_Error("This node is a standby replica. Try again later.")
+UNKNOWN_DATABASE = T_Error("Unknown database.")
+REPLICATION_DISABLED = T_Error("Change log is disabled (REPLICATION_LOG_SIZE=0).")
+NOT_A_REPLICA = T_Error("This node is not following a primary.")
@@ -0,0 +1,158 @@
+"""
+Module: hotcache.py
+
+Description:
+    Byte-budgeted in-memory cache of small, popular transfer bodies.
+
+    Entries hold the file body together with everything needed to answer
+    /api/receive without reading the database or the disk (name, expiry, headers).
+    A file is admitted only after it was requested `admit_after` times within the
+    recent-miss window, so one-off downloads do not evict popular files.
+    Least recently used entries are evicted when the byte budget is exceeded.
+
+    Cache is per process. Entries are dropped by invalidate() (called from
+    SharedFile.remove) and lazily when their date_expire passes.
+
+    HotFileCache:
+        - get(code: int) -> CachedFile | None
+        - should_admit(code: int, size: int) -> bool
+        - put(code: int, name: str, body: bytes, date_expire: int, encoding: str = "", size: int = 0) -> CachedFile | None
+        - invalidate(code: int)
+        - stats() -> dict
+"""
+from modules import timestamp
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from urllib.parse import quote
+import mimetypes
+import threading
+
+
+MISS_WINDOW_SIZE = 4096
+
+
+def build_download_headers(name: str) -> dict[str, str]:
+    """ Same Content-Disposition/Content-Type as starlette's FileResponse produces. """
+    quoted_name = quote(name)
+    if quoted_name != name:
+        disposition = f"attachment; filename*=utf-8''{quoted_name}"
+    else:
+        disposition = f'attachment; filename="{name}"'
+
+    return {
+        "content-disposition": disposition,
+        "content-type": mimetypes.guess_type(name)[0] or "text/plain",
+    }
+
+
+@dataclass
+class CachedFile:
+    code: int
+    name: str
+    body: bytes
+    date_expire: int
+    headers: dict[str, str]
+    encoding: str = ""
+    size: int = 0  # Original size of encoded body
+
+
+class HotFileCache:
+    """
+    max_bytes: Total budget for cached bodies (0 disables cache).
+    max_file_size: Bigger files are never cached.
+    admit_after: Number of requests after which file is cached.
+    """
+    def __init__(self, max_bytes: int, max_file_size: int, admit_after: int = 2) -> None:
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.admit_after = admit_after
+
+        self._entries: OrderedDict[int, CachedFile] = OrderedDict()
+        self._recent_misses: OrderedDict[int, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_bytes: int, max_file_size: int) -> None:
+        with self._lock:
+            self.max_bytes = max_bytes
+            self.max_file_size = max_file_size
+            self._evict_to_fit(0)
+
+    def get(self, code: int) -> CachedFile | None:
+        """ Cached file or None. Expired entries are dropped. """
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is None:
+                self.misses += 1
+                self._recent_misses[code] = self._recent_misses.pop(code, 0) + 1
+                if len(self._recent_misses) > MISS_WINDOW_SIZE:
+                    self._recent_misses.popitem(last=False)
+                return None
+
+            if entry.date_expire < timestamp.generate_timestamp():
+                self._drop(code)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(code)
+            self.hits += 1
+            return entry
+
+    def should_admit(self, code: int, size: int) -> bool:
+        """ Check if file is small and popular enough to be cached. """
+        if not self.max_bytes or size > self.max_file_size or size > self.max_bytes:
+            return False
+        return self._recent_misses.get(code, 0) >= self.admit_after
+
+    def put(self, code: int, name: str, body: bytes, date_expire: int, encoding: str = "", size: int = 0) -> CachedFile | None:
+        """ Cache body of file (as stored, possibly compressed). Returns created entry or None if it does not fit. """
+        if not self.max_bytes or len(body) > self.max_file_size or len(body) > self.max_bytes:
+            return None
+
+        entry = CachedFile(code, name, body, date_expire, build_download_headers(name), encoding, size or len(body))
+        with self._lock:
+            self._drop(code)
+            self._evict_to_fit(len(body))
+            self._entries[code] = entry
+            self._recent_misses.pop(code, None)
+            self.bytes_held += len(body)
+        return entry
+
+    def invalidate(self, code: int) -> None:
+        with self._lock:
+            self._drop(code)
+            self._recent_misses.pop(code, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._recent_misses.clear()
+            self.bytes_held = 0
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes_held": self.bytes_held,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / requests, 4) if requests else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def _drop(self, code: int) -> None:
+        entry = self._entries.pop(code, None)
+        if entry is not None:
+            self.bytes_held -= len(entry.body)
+
+    def _evict_to_fit(self, size: int) -> None:
+        while self._entries and self.bytes_held + size > self.max_bytes:
+            _, entry = self._entries.popitem(last=False)
+            self.bytes_held -= len(entry.body)
+            self.evictions += 1
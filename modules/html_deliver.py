@@ -3,8 +3,8 @@ from modules.paths import Path
 from typing import Any
 
 
-PAGES_PATH = Path("./web/")
-COMPONENTS_PATH = Path("./web/static/components/")
+PAGES_PATH = Path("./web/", lazy=True)
+COMPONENTS_PATH = Path("./web/static/components/", lazy=True)
 
 
 def _hydrate(content: str, data: dict) -> str:
@@ -0,0 +1,221 @@
+"""
+Module: ingest.py
+
+Description:
+    Streaming receiver of upload forms (/api/transfer).
+
+    Starlette's form parsing would spool each file into a SpooledTemporaryFile
+    before it could be copied into the blob, writing every upload to disk twice.
+    Here the multipart body is parsed while it arrives and file parts
+    are written straight into their blobs (compressed on the way when enabled).
+    Parsing and writing run in the threadpool in batches of BATCH_SIZE bytes, the
+    event loop only collects the body. Bytes waiting in batches are counted by
+    memdiag.upload_buffers.
+
+    Form fields: `file` (repeatable), `expire` and `max_downloads` (optional), in
+    any order. Owner's limit, transfer size and free space are checked against
+    Content-Length before the body is read, lifetime and downloads limit once it
+    is complete. Uploads with a token from preflight.py (X-Upload-Token) were
+    checked already and may not exceed the declared size. Because all checks run
+    before the body is read, clients sending `Expect: 100-continue` get rejections
+    without uvicorn ever asking them for the payload.
+
+    Functions:
+        - receive_transfer(request: Request) -> SharedFile | errors.T_Error
+"""
+from modules import transfers
+from modules import preflight
+from modules import memdiag
+from modules.logs import Log
+from modules import errors
+
+from starlette.concurrency import run_in_threadpool
+from fastapi import Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import FormParserError
+
+
+BATCH_SIZE = 1024 * 1024
+MULTIPART_OVERHEAD_B = 64 * 1024  # Boundaries, part headers and small fields on top of file bytes
+MAX_FIELD_SIZE = 1024
+
+
+class IngestError(Exception):
+    def __init__(self, error: errors.T_Error) -> None:
+        super().__init__(error)
+        self.error = error
+
+
+class FormReceiver:
+    """ MultipartParser callbacks writing `file` parts into members of a transfer draft. """
+
+    def __init__(self, draft: transfers.TransferDraft, boundary: bytes, max_size: int) -> None:
+        self.draft = draft
+        self.max_size = max_size
+        self.fields: dict[str, str] = {}
+        self.received_b = 0
+
+        self._headers: dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._member: transfers.MemberWriter | None = None
+        self._field_name: str | None = None
+        self._field_value = bytearray()
+
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        })
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+        self._field_name = None
+        self._field_value.clear()
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf8", "replace")
+        if b"filename" not in options:
+            self._field_name = name
+            return
+
+        if name != "file":
+            return  # Unknown file field, content is skipped
+        if self.draft.is_full():
+            raise IngestError(errors.TOO_MANY_FILES)
+
+        filename = options[b"filename"].decode("utf8", "replace")
+        self._member = self.draft.open_member(filename or "file")
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._member is not None:
+            self.received_b += end - start
+            if self.received_b > self.max_size:
+                raise IngestError(errors.SIZE_ERROR)
+            self._member.write(data[start:end])
+
+        elif self._field_name is not None:
+            self._field_value += data[start:end]
+            if len(self._field_value) > MAX_FIELD_SIZE:
+                raise IngestError(errors.INVALID_FORM)
+
+    def on_part_end(self) -> None:
+        if self._member is not None:
+            member, self._member = self._member, None
+            member.close()
+        elif self._field_name is not None:
+            self.fields[self._field_name] = self._field_value.decode("utf8", "replace")
+            self._field_name = None
+
+    def write(self, data: bytes) -> None:
+        self.parser.write(data)
+
+    def finish_body(self, data: bytes) -> None:
+        if data:
+            self.parser.write(data)
+        self.parser.finalize()
+        if self._member is not None:
+            raise IngestError(errors.INVALID_FORM)  # Body ended inside a file part
+
+    def abort(self) -> None:
+        if self._member is not None:
+            self._member.abort()
+            self._member = None
+        self.draft.abort()
+
+
+def parse_int_field(value: str | None, default: int) -> int:
+    """ Form value as int, -1 (rejected by validation) if malformed. """
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return -1
+
+
+def get_declared_size(request: Request) -> int | None:
+    value = request.headers.get("content-length", "")
+    return int(value) if value.isdigit() else None
+
+
+async def receive_transfer(request: Request) -> "transfers.SharedFile | errors.T_Error":
+    """ Parse upload form from the request body, storing files as they arrive. """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        return errors.INVALID_FORM
+
+    token = request.headers.get(preflight.TOKEN_HEADER)
+    grant = None
+    if token:
+        grant = preflight.grants.take(token, request.client.host)
+        if grant is None:
+            return errors.INVALID_UPLOAD_TOKEN
+
+    max_size = grant.size if grant is not None else transfers.MAX_TRANSFER_SIZE
+    declared_size = get_declared_size(request)
+    if declared_size is not None and declared_size > max_size + MULTIPART_OVERHEAD_B:
+        if grant is not None:
+            await run_in_threadpool(grant.draft.abort)
+        return errors.SIZE_ERROR
+
+    if grant is not None:
+        draft = grant.draft
+    else:
+        # Without Content-Length (chunked body) the largest allowed transfer is reserved.
+        reserved_size = min(declared_size, max_size) if declared_size is not None else max_size
+        pending = preflight.grants.pending_for(transfers.hash_ip(request.client.host))
+        draft = await run_in_threadpool(transfers.TransferDraft.begin, request.client.host, reserved_size, pending)
+        if isinstance(draft, errors.T_Error):
+            return draft
+
+    receiver = FormReceiver(draft, boundary, max_size)
+    batch = []
+    batch_size = 0
+    try:
+        async for chunk in request.stream():
+            batch.append(chunk)
+            batch_size += len(chunk)
+            memdiag.upload_buffers.add(len(chunk))
+            if batch_size >= BATCH_SIZE:
+                await run_in_threadpool(receiver.write, b"".join(batch))
+                batch.clear()
+                memdiag.upload_buffers.release(batch_size)
+                batch_size = 0
+        await run_in_threadpool(receiver.finish_body, b"".join(batch))
+    except IngestError as error:
+        await run_in_threadpool(receiver.abort)
+        return error.error
+    except FormParserError as error:
+        Log.warn(f"Malformed upload form: {error}")
+        await run_in_threadpool(receiver.abort)
+        return errors.INVALID_FORM
+    except BaseException:
+        receiver.abort()  # Client went away or request was cancelled, don't await anymore
+        raise
+    finally:
+        memdiag.upload_buffers.release(batch_size)
+
+    if grant is not None:
+        lifetime, max_downloads = grant.lifetime, grant.max_downloads
+    else:
+        lifetime = parse_int_field(receiver.fields.get("expire"), -1)
+        max_downloads = parse_int_field(receiver.fields.get("max_downloads"), 0)
+    return await run_in_threadpool(draft.finish, lifetime, max_downloads)
@@ -5,18 +5,27 @@ from colorama import Fore, Back, init
 import logging.handlers
 import traceback
 import logging
-import inspect
+import sys
 import os
 
 
 init(autoreset=True)
-LOGS_PATH = Path("./logs/")
+LOGS_PATH = Path("./logs/", lazy=True)
 TRACEBACK_LOG_PATH = LOGS_PATH + "traceback.log"
+_log_files_ready = False
 
-if not LOGS_PATH.exists():
-    LOGS_PATH.touch()
-if not TRACEBACK_LOG_PATH.exists():
-    TRACEBACK_LOG_PATH.touch()
+
+def _ensure_log_files() -> None:
+    """ Create logs directory and traceback file on first write instead of at import. """
+    global _log_files_ready
+    if _log_files_ready:
+        return
+
+    if not LOGS_PATH.exists():
+        LOGS_PATH.touch()
+    if not TRACEBACK_LOG_PATH.exists():
+        TRACEBACK_LOG_PATH.touch()
+    _log_files_ready = True
 
 
 def get_time() -> str:
@@ -33,16 +42,17 @@ def _get_current_logs_filepath() -> Path:
 
 def _save_log(content: str) -> None:
     """ Write content to current logs file. """
+    _ensure_log_files()
     fp = _get_current_logs_filepath()
     fp.write(content + "\n", "a+")
 
 
 def _get_caller_info():
     """ Get information about place in code where log method was called. """
-    caller_frame = inspect.stack()[2]
-    filename = os.path.basename(caller_frame.filename)
-    function = caller_frame.function
-    lineno = caller_frame.lineno
+    caller_frame = sys._getframe(2)
+    filename = os.path.basename(caller_frame.f_code.co_filename)
+    function = caller_frame.f_code.co_name
+    lineno = caller_frame.f_lineno
     if function == "<module>":
         function = "@"
     return f"{filename}:{function}#{lineno}"
@@ -52,6 +62,7 @@ def _save_traceback_log(traceback: list[str]) -> None:
     """ Save traceback to errors log file. """
     header = f"--- TRACEBACK: ({get_time()}) ---\n\n"
     content = header + "".join(traceback) + "\n\n\n"
+    _ensure_log_files()
     TRACEBACK_LOG_PATH.write(content, "a+")
 
 
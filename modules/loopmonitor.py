@@ -0,0 +1,172 @@
+"""
+Module: loopmonitor.py
+
+Description:
+    Event loop lag monitoring and load shedding.
+
+    LoopMonitor runs a probe task on the event loop which sleeps LOOP_PROBE_INTERVAL_MS
+    and measures how late it wakes up (lag). A watchdog thread checks the probe's
+    heartbeat; when the loop is stuck for longer than LOOP_SLOW_CALLBACK_MS, it samples
+    the loop thread's stack (sys._current_frames) and records which code blocks it.
+
+    LoadSheddingMiddleware answers low priority requests (pages, /api/owned-codes)
+    with 503 and Retry-After, before any work is done, while the loop lags more than
+    SHED_LAG_MS or more than SHED_UPLOADS uploads are in flight. Transfers, receives
+    and deletes are never shed.
+
+    LoopMonitor:
+        - start()
+        - stop()
+        - current_lag_s() -> float
+        - is_overloaded() -> bool
+        - stats() -> dict
+"""
+from modules import scheduler
+from modules.logs import Log
+from modules import errors
+
+from fastapi.responses import JSONResponse
+from collections import Counter, deque
+import threading
+import asyncio
+import time
+import sys
+import os
+
+
+LAG_WINDOW_SIZE = 600
+SLOW_CALLBACKS_KEPT = 50
+
+
+class LoopMonitor:
+    def __init__(self) -> None:
+        self.probe_interval_s = 0.1
+        self.slow_callback_s = 0.1
+        self.shed_lag_s = 0.25
+        self.shed_uploads = 16
+
+        self.lags: deque[float] = deque(maxlen=LAG_WINDOW_SIZE)
+        self.max_lag_s = 0.0
+        self.last_tick = time.monotonic()
+        self.slow_callbacks: deque[dict] = deque(maxlen=SLOW_CALLBACKS_KEPT)
+        self.slow_locations: Counter[str] = Counter()
+        self.shed = 0
+
+        self._loop_thread_id: int | None = None
+        self._probe: asyncio.Task | None = None
+        self._running = False
+
+    def configure(self) -> None:
+        self.probe_interval_s = float(os.getenv("LOOP_PROBE_INTERVAL_MS", 100)) / 1000
+        self.slow_callback_s = float(os.getenv("LOOP_SLOW_CALLBACK_MS", 100)) / 1000
+        self.shed_lag_s = float(os.getenv("SHED_LAG_MS", 250)) / 1000
+        self.shed_uploads = int(os.getenv("SHED_UPLOADS", 16))
+
+    def start(self) -> None:
+        """ Start probe on the running loop and watchdog thread. Called from app's lifespan. """
+        self.configure()
+        self._running = True
+        self._loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self._probe = asyncio.get_running_loop().create_task(self.probe())
+        threading.Thread(target=self.watchdog, name="loop-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._running = False
+        if self._probe is not None:
+            self._probe.cancel()
+
+    async def probe(self) -> None:
+        while True:
+            expected = time.monotonic() + self.probe_interval_s
+            await asyncio.sleep(self.probe_interval_s)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.lags.append(lag)
+            self.max_lag_s = max(self.max_lag_s, lag)
+            self.last_tick = now
+
+    def watchdog(self) -> None:
+        """ Sample stack of the loop thread while the loop is stuck. One record per stall. """
+        reported_tick = None
+        while self._running:
+            time.sleep(self.slow_callback_s / 2)
+            stalled = time.monotonic() - self.last_tick - self.probe_interval_s
+            if stalled < self.slow_callback_s or reported_tick == self.last_tick:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+
+            location = self.describe_frame(frame)
+            reported_tick = self.last_tick
+            self.slow_locations[location] += 1
+            self.slow_callbacks.append({"location": location, "stalled_ms": round(stalled * 1000), "at": time.time()})
+            Log.warn(f"Event loop blocked for {round(stalled * 1000)} ms in {location}")
+
+    @staticmethod
+    def describe_frame(frame) -> str:
+        """ Innermost frame of project's code (falls back to the innermost one). """
+        innermost = frame
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if "site-packages" not in filename and "/lib/python" not in filename:
+                break
+            frame = frame.f_back
+        frame = frame or innermost
+        return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+
+    def current_lag_s(self) -> float:
+        """ Lag of the last probe, or time the pending probe is already late. """
+        pending = time.monotonic() - self.last_tick - self.probe_interval_s
+        last = self.lags[-1] if self.lags else 0.0
+        return max(last, pending, 0.0)
+
+    def is_overloaded(self) -> bool:
+        if self.current_lag_s() > self.shed_lag_s:
+            return True
+        return bool(self.shed_uploads) and scheduler.scheduler.active_uploads > self.shed_uploads
+
+    def stats(self) -> dict:
+        lags = sorted(self.lags)
+        return {
+            "lag_ms": round(self.current_lag_s() * 1000, 1),
+            "lag_p50_ms": round(lags[len(lags) // 2] * 1000, 1) if lags else 0.0,
+            "lag_p99_ms": round(lags[int(len(lags) * 0.99)] * 1000, 1) if lags else 0.0,
+            "lag_max_ms": round(self.max_lag_s * 1000, 1),
+            "slow_callbacks": sum(self.slow_locations.values()),
+            "slow_locations": dict(self.slow_locations.most_common(10)),
+            "recent_slow_callbacks": list(self.slow_callbacks)[-10:],
+            "overloaded": self.is_overloaded(),
+            "shed": self.shed,
+        }
+
+
+monitor = LoopMonitor()
+
+
+def is_low_priority(scope: dict) -> bool:
+    """ Page loads and owned codes listing may be refused under load. """
+    if scope.get("method") != "GET":
+        return False
+
+    path = scope.get("path", "")
+    if path == "/api/owned-codes":
+        return True
+    return not path.startswith(("/api/", "/web/"))
+
+
+class LoadSheddingMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not is_low_priority(scope) or not monitor.is_overloaded():
+            await self.app(scope, receive, send)
+            return
+
+        monitor.shed += 1
+        retry_after = str(max(1, round(monitor.current_lag_s() * 4)))
+        response = JSONResponse({"status": False, "error": errors.SERVER_BUSY}, 503, headers={"Retry-After": retry_after})
+        await response(scope, receive, send)
@@ -0,0 +1,306 @@
+"""
+Module: memdiag.py
+
+Description:
+    Memory diagnostics for long-running instances.
+
+    Structures: subsystems' long-lived objects (rate limiters, caches, databases) are
+    tracked by name. For each of them the deep size is estimated and every container
+    attribute (dict, list, set, ...) is reported with it's entry count and estimated
+    size, so a growing one can be spotted without a restart. Big containers are
+    estimated from the first SAMPLE_SIZE entries. Functions wrapped in lru_cache are
+    reported with their cache_info().
+
+    Buffers: BufferGauge counts bytes held by transient buffers (e.g. upload bodies
+    waiting for the threadpool) and their peak.
+
+    Tracing: tracemalloc is off by default (it slows allocations down), MEMORY_TRACE=1
+    starts it with the app. snapshot() starts tracing if needed and keeps the snapshot
+    as baseline, diff() compares current allocations with the baseline, grouped by line,
+    file or traceback (MEMORY_TRACE_FRAMES frames are kept).
+
+    Functions:
+        - track(name: str, target: object)
+        - report() -> dict
+        - stats() -> dict
+          Cheap summary for the metrics endpoint (no deep sizes).
+    MemoryTracer:
+        - configure()
+          Start tracing if MEMORY_TRACE=1. Called from app's lifespan.
+        - snapshot(limit: int, group_by: str) -> dict
+        - diff(limit: int, group_by: str) -> dict | None
+          None without a baseline snapshot.
+        - stop()
+"""
+from modules.logs import Log
+
+from collections import deque
+from itertools import islice
+import dataclasses
+import tracemalloc
+import threading
+import time
+import sys
+import os
+
+
+SAMPLE_SIZE = 256
+MAX_DEPTH = 8
+GROUP_BY_OPTIONS = ("lineno", "filename", "traceback")
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+CONTAINER_TYPES = (dict, list, tuple, set, frozenset, deque)
+ATOMIC_TYPES = (str, bytes, bytearray, memoryview, int, float, complex, bool, type(None))
+
+_tracked: dict[str, object] = {}
+
+
+def track(name: str, target: object) -> None:
+    """ Add (or replace) structure reported by report(). Target may be an lru_cache'd function. """
+    _tracked[name] = target
+
+
+def is_own_object(obj) -> bool:
+    """ Instances of app's classes (and dataclasses) are measured with their attributes. """
+    return type(obj).__module__.startswith("modules") or dataclasses.is_dataclass(obj) and not isinstance(obj, type)
+
+
+def sample_items(container) -> tuple[list, int]:
+    """ First SAMPLE_SIZE entries (key and value pairs for dicts) and container's length. """
+    for _ in range(3):
+        try:
+            items = container.items() if isinstance(container, dict) else container
+            return list(islice(items, SAMPLE_SIZE)), len(container)
+        except RuntimeError:
+            continue  # Changed size during iteration, another thread is using it
+    return [], len(container)
+
+
+def estimate_size(obj, seen: set | None = None, depth: int = 0) -> int:
+    """ Deep size of obj in bytes. Containers bigger than SAMPLE_SIZE are extrapolated from a sample. """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj, 0)
+    if depth >= MAX_DEPTH or isinstance(obj, ATOMIC_TYPES):
+        return size
+
+    if isinstance(obj, CONTAINER_TYPES):
+        items, length = sample_items(obj)
+        if isinstance(obj, dict):
+            items_size = sum(estimate_size(key, seen, depth + 1) + estimate_size(value, seen, depth + 1) for key, value in items)
+        else:
+            items_size = sum(estimate_size(item, seen, depth + 1) for item in items)
+        if items and length > len(items):
+            items_size = items_size * length // len(items)
+        return size + items_size
+
+    if is_own_object(obj):
+        if hasattr(obj, "__dict__"):
+            size += estimate_size(vars(obj), seen, depth + 1)
+        for slot in getattr(type(obj), "__slots__", ()):
+            size += estimate_size(getattr(obj, slot, None), seen, depth + 1)
+    return size
+
+
+def describe_target(target, others: set[int] = frozenset()) -> dict:
+    """ Sizes of target and it's containers. Objects with ids in `others` (other tracked structures) are not counted. """
+    if hasattr(target, "cache_info"):
+        info = target.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "entries": info.currsize, "max_entries": info.maxsize}
+
+    if isinstance(target, CONTAINER_TYPES):
+        return {"entries": len(target), "estimated_bytes": estimate_size(target)}
+
+    containers = {}
+    seen = set(others)
+    total = sys.getsizeof(target, 0)
+    for attribute, value in list(vars(target).items()):
+        value_size = estimate_size(value, seen)
+        total += value_size
+        if isinstance(value, CONTAINER_TYPES):
+            containers[attribute] = {"entries": len(value), "estimated_bytes": value_size}
+    return {"estimated_bytes": total, "containers": containers}
+
+
+def count_entries(target) -> int:
+    if hasattr(target, "cache_info"):
+        return target.cache_info().currsize
+    if isinstance(target, CONTAINER_TYPES):
+        return len(target)
+    return sum(len(value) for value in list(vars(target).values()) if isinstance(value, CONTAINER_TYPES))
+
+
+def read_process_memory() -> dict:
+    """ Resident set size and it's peak in bytes (Linux /proc, ru_maxrss elsewhere). """
+    try:
+        with open("/proc/self/status", encoding="ascii") as file:
+            fields = dict(line.split(":", 1) for line in file if ":" in line)
+        return {
+            "rss_bytes": int(fields["VmRSS"].split()[0]) * 1024,
+            "peak_rss_bytes": int(fields["VmHWM"].split()[0]) * 1024,
+        }
+    except (OSError, KeyError, ValueError):
+        pass
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"peak_rss_bytes": peak if sys.platform == "darwin" else peak * 1024}
+    except ImportError:
+        return {}
+
+
+class BufferGauge:
+    """ Bytes held by transient buffers right now and the highest value seen. """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.held_b = 0
+        self.peak_b = 0
+
+    def add(self, size: int) -> None:
+        with self._lock:
+            self.held_b += size
+            self.peak_b = max(self.peak_b, self.held_b)
+
+    def release(self, size: int) -> None:
+        with self._lock:
+            self.held_b -= size
+
+    def stats(self) -> dict:
+        return {"held_bytes": self.held_b, "peak_bytes": self.peak_b}
+
+
+upload_buffers = BufferGauge()
+
+
+def shorten_path(filename: str) -> str:
+    if filename.startswith(ROOT_PATH):
+        return filename[len(ROOT_PATH):]
+    return os.path.join(*filename.split(os.sep)[-2:])
+
+
+def describe_trace(traceback: tracemalloc.Traceback, group_by: str) -> str | list[str]:
+    if group_by == "filename":
+        return shorten_path(traceback[0].filename)
+    if group_by == "lineno":
+        return f"{shorten_path(traceback[0].filename)}:{traceback[0].lineno}"
+    return [f"{shorten_path(frame.filename)}:{frame.lineno}" for frame in traceback]
+
+
+class MemoryTracer:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.baseline: tracemalloc.Snapshot | None = None
+        self.baseline_taken: float | None = None
+
+    def get_frames(self) -> int:
+        return max(1, int(os.getenv("MEMORY_TRACE_FRAMES", 1)))
+
+    def configure(self) -> None:
+        if os.getenv("MEMORY_TRACE", "0") == "1" and not tracemalloc.is_tracing():
+            tracemalloc.start(self.get_frames())
+            Log.info(f"Tracing memory allocations ({self.get_frames()} frames).")
+
+    def take(self) -> tracemalloc.Snapshot:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.get_frames())
+            Log.info("Memory tracing started by snapshot.")
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def snapshot(self, limit: int = 20, group_by: str = "lineno") -> dict:
+        """ Take snapshot, keep it as baseline. Returns top allocations. """
+        with self._lock:
+            snapshot = self.take()
+            self.baseline = snapshot
+            self.baseline_taken = time.time()
+
+        statistics = snapshot.statistics(group_by)
+        return {
+            "traced_bytes": sum(stat.size for stat in statistics),
+            "top": [
+                {"where": describe_trace(stat.traceback, group_by), "bytes": stat.size, "blocks": stat.count}
+                for stat in statistics[:limit]
+            ],
+        }
+
+    def diff(self, limit: int = 20, group_by: str = "lineno") -> dict | None:
+        """ Biggest changes since the baseline snapshot. """
+        with self._lock:
+            if self.baseline is None or not tracemalloc.is_tracing():
+                return None
+            baseline, baseline_taken = self.baseline, self.baseline_taken
+            snapshot = self.take()
+
+        differences = snapshot.compare_to(baseline, group_by)
+        return {
+            "since_s": round(time.time() - baseline_taken, 1),
+            "traced_bytes_diff": sum(stat.size_diff for stat in differences),
+            "top": [
+                {
+                    "where": describe_trace(stat.traceback, group_by),
+                    "bytes": stat.size, "bytes_diff": stat.size_diff,
+                    "blocks": stat.count, "blocks_diff": stat.count_diff,
+                }
+                for stat in differences[:limit]
+            ],
+        }
+
+    def stop(self) -> None:
+        """ Stop tracing and forget the baseline. """
+        with self._lock:
+            self.baseline = None
+            self.baseline_taken = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+                Log.info("Memory tracing stopped.")
+
+    def stats(self) -> dict:
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": True,
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "baseline_age_s": round(time.time() - self.baseline_taken, 1) if self.baseline_taken else None,
+        }
+
+
+tracer = MemoryTracer()
+
+
+def report() -> dict:
+    """ Estimated sizes of tracked structures, buffers, process and tracing state. Walks the structures, run it in threadpool. """
+    structures = {}
+    tracked = list(_tracked.items())
+    for name, target in tracked:
+        try:
+            structures[name] = describe_target(target, {id(other) for _, other in tracked if other is not target})
+        except Exception as error:
+            Log.error(f"Memory report of {name} failed: {error}")
+            structures[name] = {"error": str(error)}
+
+    return {
+        "process": read_process_memory(),
+        "structures": structures,
+        "upload_buffers": upload_buffers.stats(),
+        "tracemalloc": tracer.stats(),
+    }
+
+
+def stats() -> dict:
+    return {
+        **read_process_memory(),
+        "entries": {name: count_entries(target) for name, target in list(_tracked.items())},
+        "upload_buffers": upload_buffers.stats(),
+        "tracemalloc": tracer.stats(),
+    }
@@ -0,0 +1,36 @@
+"""
+Module: metrics.py
+
+Description:
+    Registry of runtime metrics.
+
+    Subsystems register a named source (callable returning a JSON-serializable dict)
+    and collect() gathers all of them. Served by the admin metrics endpoint.
+
+    Functions:
+        - register(name: str, source: Callable[[], dict])
+        - collect() -> dict[str, dict]
+"""
+from modules.logs import Log
+
+from typing import Callable
+
+
+_sources: dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, source: Callable[[], dict]) -> None:
+    """ Add (or replace) metrics source. """
+    _sources[name] = source
+
+
+def collect() -> dict[str, dict]:
+    """ Call every source. Failing source is reported instead of breaking the whole response. """
+    collected = {}
+    for name, source in _sources.items():
+        try:
+            collected[name] = source()
+        except Exception as error:
+            Log.error(f"Metrics source: {name} failed: {error}")
+            collected[name] = {"error": str(error)}
+    return collected
@@ -0,0 +1,176 @@
+"""
+Module: owners.py
+
+Description:
+    Per-owner index of shares behind /api/owned-codes.
+
+    Entries (the JSON objects returned to the owner) are built once, when a share is
+    created or the index rebuilt, so polling doesn't scan the shares table nor format
+    expiry dates again. Every change of owner's shares (create, delete, expiry, download)
+    bumps owner's version, taken from one sequence shared by all owners. A version is
+    sent as "<epoch>:<number>"; the epoch is new for every rebuild (and process), so
+    versions from before are never mistaken for current ones.
+
+    Versions drive ETag / If-None-Match (304 when nothing changed), `since=<version>`
+    deltas (changed entries and removed codes) and are stable across cursor pages.
+    Removed codes are remembered as tombstones for TOMBSTONE_TTL_S; a `since` older
+    than the forgotten tombstones gets the full listing instead of a delta. Records
+    of owners left without shares are dropped, the highest version they reached is
+    kept as horizon of records created later.
+
+    OwnerIndex:
+        - rebuild(rows: Iterable[tuple[str, int, dict]])
+          (owner, code, entry) of every share.
+        - put(owner: str, code: int, entry: dict)
+        - remove(code: int)
+        - touch(code: int, **changes)
+          Update fields of code's entry (e.g. downloads).
+        - listing(owner: str, since: str | None) -> OwnedCodes
+        - prune() -> int
+"""
+from dataclasses import dataclass, field
+import threading
+import secrets
+import time
+
+
+TOMBSTONE_TTL_S = 24 * 3600
+
+
+@dataclass
+class OwnerRecord:
+    version: int = 0
+    entries: dict[int, dict] = field(default_factory=dict)  # code: entry
+    changed: dict[int, int] = field(default_factory=dict)  # code: version of it's last change
+    removed: dict[int, tuple[int, float]] = field(default_factory=dict)  # code: (version, monotonic time)
+    horizon: int = 0  # Deltas since older versions are not possible (tombstones forgotten)
+
+
+@dataclass
+class OwnedCodes:
+    version: str
+    entries: dict[int, dict]
+    removed: list[int] | None = None  # None for full listing, removed codes for delta
+
+
+class OwnerIndex:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._owners: dict[str, OwnerRecord] = {}
+        self._code_owners: dict[int, str] = {}
+        self._sequence = 0
+        self._pruned_horizon = 0  # Horizon of new records, versions up to it may predate pruned tombstones
+        self.epoch = secrets.token_hex(3)
+        self.rebuilds = 0
+        self.deltas = 0
+        self.full_listings = 0
+
+    def format_version(self, version: int) -> str:
+        return f"{self.epoch}:{version}"
+
+    def parse_version(self, version: str | None) -> int | None:
+        """ Number of version issued by this index, None for foreign or malformed ones. """
+        epoch, _, number = (version or "").partition(":")
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
+
+    def __bump(self, owner: str) -> OwnerRecord:
+        """ Advance owner's version. Caller holds the lock. """
+        self._sequence += 1
+        record = self._owners.get(owner)
+        if record is None:
+            record = self._owners[owner] = OwnerRecord(horizon=self._pruned_horizon)
+        record.version = self._sequence
+        return record
+
+    def rebuild(self, rows) -> None:
+        """ Replace content. Rows are read under the lock, so changes made meanwhile are applied after them. """
+        with self._lock:
+            owners: dict[str, OwnerRecord] = {}
+            code_owners: dict[int, str] = {}
+            for owner, code, entry in rows:
+                record = owners.setdefault(owner, OwnerRecord())
+                record.entries[code] = entry
+                code_owners[code] = owner
+
+            self.epoch = secrets.token_hex(3)
+            self._sequence = 1
+            for record in owners.values():
+                record.version = record.horizon = self._sequence
+                record.changed = dict.fromkeys(record.entries, self._sequence)
+            self._owners = owners
+            self._code_owners = code_owners
+            self._pruned_horizon = 0
+            self.rebuilds += 1
+
+    def put(self, owner: str, code: int, entry: dict) -> None:
+        with self._lock:
+            record = self.__bump(owner)
+            record.entries[code] = entry
+            record.changed[code] = record.version
+            record.removed.pop(code, None)
+            self._code_owners[code] = owner
+
+    def remove(self, code: int) -> None:
+        with self._lock:
+            owner = self._code_owners.pop(code, None)
+            if owner is None:
+                return
+            record = self.__bump(owner)
+            record.entries.pop(code, None)
+            record.changed.pop(code, None)
+            record.removed[code] = (record.version, time.monotonic())
+
+    def touch(self, code: int, **changes) -> None:
+        with self._lock:
+            owner = self._code_owners.get(code)
+            if owner is None:
+                return
+            record = self.__bump(owner)
+            record.entries[code] = {**record.entries[code], **changes}
+            record.changed[code] = record.version
+
+    def listing(self, owner: str, since: str | None = None) -> OwnedCodes:
+        """ Owner's entries, or only changes after `since` when it's a usable version. """
+        with self._lock:
+            record = self._owners.get(owner)
+            if record is None:
+                self.full_listings += 1
+                return OwnedCodes(self.format_version(0), {})
+
+            version = self.format_version(record.version)
+            since_version = self.parse_version(since)
+            if since_version is None or since_version < record.horizon or since_version > record.version:
+                self.full_listings += 1
+                return OwnedCodes(version, dict(record.entries))
+
+            self.deltas += 1
+            changed = {code: record.entries[code] for code, changed_at in record.changed.items() if changed_at > since_version}
+            removed = [code for code, (removed_at, _) in record.removed.items() if removed_at > since_version]
+            return OwnedCodes(version, changed, removed)
+
+    def prune(self) -> int:
+        """ Forget tombstones older than TOMBSTONE_TTL_S and owners without shares. Returns forgotten tombstones. """
+        deadline = time.monotonic() - TOMBSTONE_TTL_S
+        forgotten = 0
+        with self._lock:
+            for owner, record in list(self._owners.items()):
+                for code, (removed_at, removed_time) in list(record.removed.items()):
+                    if removed_time < deadline:
+                        del record.removed[code]
+                        record.horizon = max(record.horizon, removed_at)
+                        forgotten += 1
+                if not record.entries and not record.removed:
+                    self._pruned_horizon = max(self._pruned_horizon, record.version)
+                    del self._owners[owner]
+        return forgotten
+
+    def stats(self) -> dict:
+        return {
+            "owners": len(self._owners),
+            "codes": len(self._code_owners),
+            "rebuilds": self.rebuilds,
+            "deltas": self.deltas,
+            "full_listings": self.full_listings,
+        }
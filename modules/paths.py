@@ -14,6 +14,17 @@ Description:
 
     All path management methods returns NEW INSTANCE of Path object.
 
+    Lazy paths:
+        Path("./data/", lazy=True) does not touch the filesystem on construction.
+        Existing directories are NOT suffixed with / automatically, directory-ness
+        is resolved by the first is_dir() call and remembered by the instance.
+        Paths created with +, / and // inherit the mode of their base.
+
+    Stat cache:
+        enable_stat_cache(ttl_s) makes exists(), is_dir() and get_size() share
+        os.stat results for ttl_s seconds. Writes made through Path invalidate
+        the entry, external writes should be followed by Path.invalidate().
+
     Methods:
         - exists() -> bool:
           Check if object exists.
@@ -37,9 +48,12 @@ Description:
           Get file's size in bytes. Returns 0 if object is a directory.
         - read() -> str
           Returns file's content or blank str if object is a directory.
+        - invalidate()
+          Drop cached metadata of this path (stat cache and lazy directory flag).
 """
 import shutil
 import stat
+import time
 import os
 
 try:
@@ -56,6 +70,58 @@ def sizeof_fmt(num, suffix="B"):
     return f"{num:.1f}Yi{suffix}"
 
 
+class StatCache:
+    """
+    Short-lived os.stat results keyed by path.
+    Missing paths are cached as None, so repeated exists() on absent files are free too.
+    """
+
+    def __init__(self, ttl_s: float, max_entries: int = 4096) -> None:
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries: dict[str, tuple[float, os.stat_result | None]] = {}
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return path.rstrip("/") or "/"
+
+    def stat(self, path: str) -> os.stat_result | None:
+        """ Cached os.stat(path) or None if path does not exist. """
+        key = self._key(path)
+        now = time.monotonic()
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        try:
+            result = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            result = None
+
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+        self._entries[key] = (now + self.ttl_s, result)
+        return result
+
+    def invalidate(self, path: str | None = None) -> None:
+        """ Forget single path or everything if path is None. """
+        if path is None:
+            self._entries.clear()
+            return
+        self._entries.pop(self._key(path), None)
+
+
+def enable_stat_cache(ttl_s: float = 1.0) -> StatCache:
+    """ Share os.stat results between Path objects for ttl_s seconds. """
+    Path.stat_cache = StatCache(ttl_s)
+    return Path.stat_cache
+
+
+def disable_stat_cache() -> None:
+    Path.stat_cache = None
+
+
 class Path:
     """
     Abstract path representation.
@@ -66,12 +132,20 @@ class Path:
         >>> Path("C:/foo") / "bar" -> Path("C:/foo/bar")
     __floordiv__: Add string to path separated by / and add next / at the end.
         >>> Path("C:/foo") // "bar" -> Path("C:/foo/bar/")
+
+    lazy: Skip filesystem checks on construction (see module description).
     """
+    stat_cache: StatCache | None = None
 
-    def __init__(self, src: str) -> None:
+    def __init__(self, src: str, lazy: bool = False) -> None:
         src = src.replace("\\", "/")
         src = src.replace("//", "/")
         self.path = src
+        self.lazy = lazy
+        self._is_dir: bool | None = None
+
+        if lazy:
+            return
 
         if self.exists() and self.is_dir() and not self.path.endswith("/"):
             self.path += "/"
@@ -88,26 +162,50 @@ class Path:
         if not isinstance(sub_path, (str, Path)):
             raise TypeError("Path.__add__ requires str or Path object.")
 
-        return Path(self.path + str(sub_path))
+        return Path(self.path + str(sub_path), self.lazy)
 
     def __truediv__(self, sub_path: object) -> "Path":
         if not isinstance(sub_path, (str, Path)):
             raise TypeError("Path.__truediv__ requires str or Path object.")
-        return Path(self.path + "/" + str(sub_path))
+        return Path(self.path + "/" + str(sub_path), self.lazy)
 
     def __floordiv__(self, sub_path: object) -> "Path":
         if not isinstance(sub_path, (str, Path)):
             raise TypeError("Path.__floordiv__ requires str or Path object.")
 
-        return Path(self.path + "/" + str(sub_path) + "/")
+        return Path(self.path + "/" + str(sub_path) + "/", self.lazy)
+
+    def _stat(self) -> os.stat_result:
+        """ os.stat through the stat cache if enabled. Raises FileNotFoundError. """
+        if Path.stat_cache is None:
+            return os.stat(self.path)
+
+        result = Path.stat_cache.stat(self.path)
+        if result is None:
+            raise FileNotFoundError(self.path)
+        return result
+
+    def invalidate(self) -> None:
+        """ Drop cached metadata of this path. """
+        self._is_dir = None
+        if Path.stat_cache is not None:
+            Path.stat_cache.invalidate(self.path)
 
     def exists(self) -> bool:
         """ Check if this Path exists. """
+        if Path.stat_cache is not None:
+            return Path.stat_cache.stat(self.path) is not None
         return os.path.exists(self.path)
 
     def is_dir(self) -> bool:
         """ Check if path is a directory. """
-        return stat.S_ISDIR(os.stat(str(self.path)).st_mode)
+        if self._is_dir is not None:
+            return self._is_dir
+
+        is_dir = stat.S_ISDIR(self._stat().st_mode)
+        if self.lazy:
+            self._is_dir = is_dir
+        return is_dir
 
     def touch(self):
         """ Create directory using os.mkdir or file with open. """
@@ -119,6 +217,7 @@ class Path:
         else:
             open(self.path, "a+").close()
 
+        self.invalidate()
         return self
 
     def parent(self) -> "Path":
@@ -127,7 +226,7 @@ class Path:
         if len(parts) < 3:
             return self
 
-        return Path("/".join(parts[:-2]) + "/")
+        return Path("/".join(parts[:-2]) + "/", self.lazy)
 
     def all_parents(self) -> set["Path"]:
         """ Get all parents of this path. """
@@ -164,18 +263,23 @@ class Path:
         else:
             os.remove(self.path)
 
+        self.invalidate()
+
     def get_size(self) -> int:
         """ Returns object size in bytes. (0 if dir) """
         if self.is_dir():
             return 0
 
-        return os.path.getsize(str(self.path))
+        return self._stat().st_size
 
     def write(self, content: str, mode: str = "a") -> None:
         """ Write content to file. """
         with open(self.path, mode, encoding="utf8") as file:
             file.write(content)
 
+        if Path.stat_cache is not None:
+            Path.stat_cache.invalidate(self.path)
+
     def read(self) -> str:
         """ Returns file's content. ("" if dir) """
         if self.is_dir():
@@ -192,3 +296,6 @@ class Path:
         """ Save provided content with JSON encoding. """
         with open(self.path, "w", encoding="utf8") as file:
             json.dump(content, file, indent=2, separators=(',', ': '), ensure_ascii=False, escape_forward_slashes=False, reject_bytes=False)
+
+        if Path.stat_cache is not None:
+            Path.stat_cache.invalidate(self.path)
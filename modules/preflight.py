@@ -0,0 +1,192 @@
+"""
+Module: preflight.py
+
+Description:
+    Upload negotiation, so rejected uploads don't send their payload.
+
+    POST /api/transfer/preflight takes the transfer's description as JSON:
+        {"files": [{"name": "a.txt", "size": 123, "sha256": "..."}], "expire": 1, "max_downloads": 0}
+    (a single file may be given inline: {"name": ..., "size": ..., "expire": ...}).
+    Owner's limit, lifetime, downloads limit, size and free space are checked right
+    away. An accepted preflight returns an upload token valid for UPLOAD_TOKEN_TTL_S,
+    which holds the transfer's code and space reservation. The upload carries it in the
+    X-Upload-Token header and must not be bigger than declared; lifetime and downloads
+    limit are taken from the preflight. Tokens are single use and bound to the client.
+
+    If sha256 of every file matches files the same client already shares, the transfer
+    is created from the stored blobs (hard links on local disk) and no upload is needed.
+    Only client's own files are considered, knowing a hash doesn't give access to
+    someone else's content. Deduplication saves the upload and (with hard links) disk
+    space, but not quota: each share counts it's full stored size against
+    MAX_DATA_SIZE_MB, as linked blobs are not told apart from copies.
+
+    UploadGrants:
+        - issue(draft, size, lifetime, max_downloads) -> UploadGrant
+        - take(token: str, ip_address: str) -> UploadGrant | None
+        - pending_for(owner_ip: str) -> int
+          Granted, not yet uploaded transfers (count against owner's limit).
+    Functions:
+        - preflight(ip_address: str, body) -> SharedFile | UploadGrant | errors.T_Error
+"""
+from modules import transfers
+from modules.logs import Log
+from modules import errors
+
+from dataclasses import dataclass
+import threading
+import secrets
+import time
+import re
+import os
+
+
+TOKEN_HEADER = "x-upload-token"
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+@dataclass
+class UploadGrant:
+    token: str
+    draft: transfers.TransferDraft
+    size: int
+    lifetime: int
+    max_downloads: int
+    expires_at: float
+
+
+class UploadGrants:
+    def __init__(self) -> None:
+        self._grants: dict[str, UploadGrant] = {}
+        self._lock = threading.Lock()
+
+        self.issued = 0
+        self.used = 0
+        self.expired = 0
+        self.deduplicated = 0
+
+    def get_ttl_s(self) -> float:
+        return float(os.getenv("UPLOAD_TOKEN_TTL_S", 120))
+
+    def issue(self, draft: transfers.TransferDraft, size: int, lifetime: int, max_downloads: int) -> UploadGrant:
+        grant = UploadGrant(secrets.token_urlsafe(24), draft, size, lifetime, max_downloads, time.monotonic() + self.get_ttl_s())
+        with self._lock:
+            self.__prune()
+            self._grants[grant.token] = grant
+            self.issued += 1
+        return grant
+
+    def take(self, token: str, ip_address: str) -> UploadGrant | None:
+        """ Remove and return client's valid grant. """
+        owner_ip = transfers.hash_ip(ip_address)
+        with self._lock:
+            self.__prune()
+            grant = self._grants.get(token)
+            if grant is None or grant.draft.owner_ip != owner_ip:
+                return None
+            del self._grants[token]
+            self.used += 1
+            return grant
+
+    def pending_for(self, owner_ip: str) -> int:
+        with self._lock:
+            self.__prune()
+            return sum(1 for grant in self._grants.values() if grant.draft.owner_ip == owner_ip)
+
+    def __prune(self) -> None:
+        """ Drop expired grants, releasing their codes and reservations. Caller holds the lock. """
+        now = time.monotonic()
+        for token, grant in list(self._grants.items()):
+            if grant.expires_at <= now:
+                del self._grants[token]
+                grant.draft.abort()
+                self.expired += 1
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._grants),
+            "issued": self.issued,
+            "used": self.used,
+            "expired": self.expired,
+            "deduplicated": self.deduplicated,
+        }
+
+
+grants = UploadGrants()
+
+
+def is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_files(body: dict) -> list[dict] | errors.T_Error:
+    files = body.get("files")
+    if files is None and "size" in body:
+        files = [body]
+    if not isinstance(files, list) or not files or len(files) > transfers.MAX_FILES_PER_TRANSFER:
+        return errors.TOO_MANY_FILES
+
+    parsed = []
+    for file in files:
+        if not isinstance(file, dict) or not is_int(file.get("size")) or file["size"] < 0:
+            return errors.INVALID_FORM
+        name = file.get("name") or "file"
+        sha256 = file.get("sha256")
+        if not isinstance(name, str) or (sha256 is not None and (not isinstance(sha256, str) or not SHA256_PATTERN.match(sha256))):
+            return errors.INVALID_FORM
+        parsed.append({"name": name, "size": file["size"], "sha256": sha256})
+    return parsed
+
+
+def find_duplicates(owner_ip: str, files: list[dict]) -> list[tuple[str, dict]] | None:
+    """ Stored blob of owner for every file, None unless all of them are found. """
+    if not all(file["sha256"] for file in files):
+        return None
+
+    found = []
+    for file in files:
+        match = transfers.find_owned_blob(owner_ip, file["sha256"])
+        if match is None:
+            return None
+        found.append(match)
+    return found
+
+
+def preflight(ip_address: str, body) -> "transfers.SharedFile | UploadGrant | errors.T_Error":
+    """ Check described transfer. Returns created transfer (deduplicated), upload grant or rejection. """
+    if not isinstance(body, dict):
+        return errors.INVALID_FORM
+
+    files = parse_files(body)
+    if isinstance(files, errors.T_Error):
+        return files
+
+    lifetime = body.get("expire")
+    max_downloads = body.get("max_downloads", 0)
+    if not is_int(lifetime):
+        return errors.INVALID_LIFETIME
+    if not is_int(max_downloads):
+        return errors.INVALID_MAX_DOWNLOADS
+    error = transfers.validate_options(lifetime, max_downloads)
+    if error is not None:
+        return error
+
+    size = sum(file["size"] for file in files)
+    owner_ip = transfers.hash_ip(ip_address)
+    draft = transfers.TransferDraft.begin(ip_address, size, grants.pending_for(owner_ip))
+    if isinstance(draft, errors.T_Error):
+        return draft
+
+    duplicates = find_duplicates(owner_ip, files)
+    if duplicates is None:
+        return grants.issue(draft, size, lifetime, max_downloads)
+
+    try:
+        for file, (blob_name, member) in zip(files, duplicates):
+            draft.add_stored_member(file["name"], blob_name, member)
+    except Exception as error:
+        Log.error(f"Failed to reuse stored blobs: {error}")
+        draft.abort()
+        raise
+
+    grants.deduplicated += 1
+    return draft.finish(lifetime, max_downloads)
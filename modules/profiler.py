@@ -0,0 +1,278 @@
+"""
+Module: profiler.py
+
+Description:
+    On-demand sampling CPU profiler for production.
+
+    While a profile runs, a sampler thread reads the stacks of all threads
+    (sys._current_frames) every PROFILE_INTERVAL_MS, nothing is traced between samples.
+    Samples are grouped by thread role (event-loop, worker for the threadpool, or the
+    thread's name, e.g. cleaner) and by the route being served.
+
+    Routes: RouteMarkerMiddleware stores each request's scope in a context variable.
+    On the loop thread the middleware's own frame is on the stack of a running request.
+    Code in the threadpool runs inside the request's Context, held by anyio's
+    WorkerThread.run frame (asyncio's Handle._run for other callbacks); the sampler finds
+    these frames in the sampled stack and reads the variable from the Context.
+
+    Triggered by admin endpoint (GET /api/admin/profile) or, with PROFILE_ON_SIGNAL=1,
+    by SIGUSR2, which profiles for PROFILE_SECONDS and writes logs/profile-<time>.collapsed
+    and .speedscope.json. Output is collapsed stacks (flamegraph.pl, speedscope) or
+    speedscope's JSON format.
+
+    SamplingProfiler:
+        - configure()
+          Remember the loop thread. Called from app's lifespan.
+        - run(seconds: float, interval_s: float) -> Profile | None
+          Blocking, None when a profile is already running.
+    Profile:
+        - to_collapsed() -> str
+        - to_speedscope() -> dict
+    Functions:
+        - install_signal_handler()
+"""
+from modules.logs import Log, LOGS_PATH
+
+from collections import Counter
+from contextvars import ContextVar, Context
+import threading
+import asyncio
+import signal
+import time
+import json
+import sys
+import re
+import os
+
+
+MAX_STACK_DEPTH = 128
+MAX_PROFILE_S = 120
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+DIGITS_SEGMENT = re.compile(r"/\d+(?=/|$)")
+WORKER_THREAD_NAME = "AnyIO worker thread"
+
+request_scope: ContextVar[dict | None] = ContextVar("profiled_request_scope", default=None)
+
+
+class RouteMarkerMiddleware:
+    """ Mark request's context with it's scope, so samples can be attributed to routes. """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http":
+            request_scope.set(scope)
+        await self.app(scope, receive, send)
+
+
+MARKER_CODE = RouteMarkerMiddleware.__call__.__code__
+
+
+def describe_route(scope: dict | None) -> str:
+    if scope is None:
+        return "-"
+    route = scope.get("route")
+    path = getattr(route, "path", None) or DIGITS_SEGMENT.sub("/{n}", scope.get("path", ""))
+    return f"{scope.get('method', '')} {path}"
+
+
+def get_context_holders() -> set:
+    """ Code objects of frames which run callbacks inside a Context (local `context` or `self._context`). """
+    holders = {asyncio.events.Handle._run.__code__}
+    try:
+        from anyio._backends._asyncio import WorkerThread
+        holders.add(WorkerThread.run.__code__)
+    except (ImportError, AttributeError):
+        pass
+    return holders
+
+
+class Profile:
+    def __init__(self, interval_s: float) -> None:
+        self.interval_s = interval_s
+        self.started = time.time()
+        self.duration_s = 0.0
+        self.samples = 0
+        self.sampling_s = 0.0  # Time spent taking samples (overhead)
+        self.stacks: Counter[tuple] = Counter()  # (thread role, route, *frames root first): weight in seconds
+        self.frames: list[tuple[str, str, int]] = []  # (name, file, line)
+        self._frame_ids: dict = {}
+
+    def frame_id(self, code) -> int:
+        frame_id = self._frame_ids.get(code)
+        if frame_id is None:
+            filename = code.co_filename
+            if filename.startswith(ROOT_PATH):
+                filename = filename[len(ROOT_PATH):]
+            else:
+                filename = os.path.join(*filename.split(os.sep)[-2:])
+            frame_id = self._frame_ids[code] = len(self.frames)
+            self.frames.append((getattr(code, "co_qualname", code.co_name), filename, code.co_firstlineno))
+        return frame_id
+
+    def frame_label(self, frame_id: int) -> str:
+        name, filename, line = self.frames[frame_id]
+        return f"{name} ({filename}:{line})"
+
+    def to_collapsed(self) -> str:
+        """ One `role;route;frame;frame... weight_ms` line per distinct stack. """
+        lines = []
+        for (role, route, *frame_ids), weight in self.stacks.most_common():
+            labels = [role, f"[{route}]"] + [self.frame_label(frame_id).replace(";", ",") for frame_id in frame_ids]
+            lines.append(f"{';'.join(labels)} {max(1, round(weight * 1000))}")
+        return "\n".join(lines) + "\n"
+
+    def to_speedscope(self) -> dict:
+        """ speedscope file, one sampled profile per thread role, route as the root frame. """
+        frames = [{"name": name, "file": filename, "line": line} for name, filename, line in self.frames]
+        route_frames: dict[str, int] = {}
+        profiles: dict[str, dict] = {}
+        for (role, route, *frame_ids), weight in self.stacks.items():
+            if route not in route_frames:
+                route_frames[route] = len(frames)
+                frames.append({"name": f"[{route}]"})
+
+            profile = profiles.setdefault(role, {
+                "type": "sampled", "name": role, "unit": "seconds",
+                "startValue": 0, "endValue": self.duration_s, "samples": [], "weights": []
+            })
+            profile["samples"].append([route_frames[route]] + frame_ids)
+            profile["weights"].append(round(weight, 6))
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"quicksh {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started))}",
+            "exporter": "quicksh",
+            "shared": {"frames": frames},
+            "profiles": sorted(profiles.values(), key=lambda profile: profile["name"]),
+        }
+
+    def summary(self) -> dict:
+        return {
+            "duration_s": round(self.duration_s, 3),
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "overhead": round(self.sampling_s / self.duration_s, 4) if self.duration_s else 0.0,
+        }
+
+
+class SamplingProfiler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._running = False
+        self.loop_thread_id: int | None = None
+        self.context_holders = get_context_holders()
+        self.profiles = 0
+        self.last: dict | None = None
+
+    def configure(self) -> None:
+        self.loop_thread_id = threading.get_ident()
+
+    def get_interval_s(self) -> float:
+        return float(os.getenv("PROFILE_INTERVAL_MS", 10)) / 1000
+
+    def is_running(self) -> bool:
+        return self._running
+
+    def thread_role(self, ident: int, names: dict[int, str]) -> str:
+        if ident == self.loop_thread_id:
+            return "event-loop"
+        name = names.get(ident, "thread")
+        return "worker" if name == WORKER_THREAD_NAME else name
+
+    def find_route(self, frame) -> str:
+        """ Route of the innermost Context found on the stack. """
+        while frame is not None:
+            if frame.f_code is MARKER_CODE:
+                return describe_route(frame.f_locals.get("scope"))
+            if frame.f_code in self.context_holders:
+                local_vars = frame.f_locals
+                context = local_vars.get("context")
+                if not isinstance(context, Context):
+                    context = getattr(local_vars.get("self"), "_context", None)
+                if isinstance(context, Context):
+                    return describe_route(context.get(request_scope))
+            frame = frame.f_back
+        return "-"
+
+    def sample(self, profile: Profile, weight_s: float) -> None:
+        own_ident = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+
+            route = self.find_route(frame)
+            frame_ids = []
+            while frame is not None and len(frame_ids) < MAX_STACK_DEPTH:
+                frame_ids.append(profile.frame_id(frame.f_code))
+                frame = frame.f_back
+            frame_ids.reverse()
+            profile.stacks[(self.thread_role(ident, names), route, *frame_ids)] += weight_s
+        profile.samples += 1
+
+    def run(self, seconds: float, interval_s: float | None = None) -> Profile | None:
+        """ Sample all threads for `seconds`. Returns None when a profile is already running. """
+        with self._lock:
+            if self._running:
+                return None
+            self._running = True
+
+        interval_s = max(0.001, interval_s or self.get_interval_s())
+        profile = Profile(interval_s)
+        try:
+            started = last = time.perf_counter()
+            deadline = started + min(seconds, MAX_PROFILE_S)
+            while (now := time.perf_counter()) < deadline:
+                self.sample(profile, now - last if profile.samples else interval_s)
+                last = now
+                profile.sampling_s += time.perf_counter() - now
+                time.sleep(max(0.0, interval_s - (time.perf_counter() - now)))
+            profile.duration_s = time.perf_counter() - started
+        finally:
+            self._running = False
+
+        self.profiles += 1
+        self.last = profile.summary()
+        return profile
+
+    def stats(self) -> dict:
+        return {"running": self._running, "profiles": self.profiles, "last": self.last}
+
+
+profiler = SamplingProfiler()
+
+
+def write_profile(profile: Profile) -> list[str]:
+    """ Save profile into logs/ in both formats. Returns paths. """
+    if not LOGS_PATH.exists():
+        LOGS_PATH.touch()
+    prefix = os.path.join(LOGS_PATH.path, f"profile-{time.strftime('%Y%m%d-%H%M%S', time.localtime(profile.started))}")
+    with open(f"{prefix}.collapsed", "w", encoding="utf8") as file:
+        file.write(profile.to_collapsed())
+    with open(f"{prefix}.speedscope.json", "w", encoding="utf8") as file:
+        json.dump(profile.to_speedscope(), file)
+    return [f"{prefix}.collapsed", f"{prefix}.speedscope.json"]
+
+
+def profile_to_logs() -> None:
+    seconds = float(os.getenv("PROFILE_SECONDS", 10))
+    profile = profiler.run(seconds)
+    if profile is None:
+        Log.warn("Profiler is already running, SIGUSR2 ignored.")
+        return
+    paths = write_profile(profile)
+    Log.info(f"Profile written: {', '.join(paths)} ({profile.summary()})")
+
+
+def install_signal_handler() -> None:
+    """ With PROFILE_ON_SIGNAL=1, SIGUSR2 starts a profile written to logs/. Called from app's lifespan. """
+    if os.getenv("PROFILE_ON_SIGNAL", "0") != "1" or not hasattr(signal, "SIGUSR2"):
+        return
+    if threading.current_thread() is not threading.main_thread():
+        Log.warn("Profiler signal handler can only be installed from the main thread.")
+        return
+
+    signal.signal(signal.SIGUSR2, lambda signum, frame: threading.Thread(target=profile_to_logs, name="profiler", daemon=True).start())
+    Log.info(f"SIGUSR2 starts profiler (pid {os.getpid()}).")
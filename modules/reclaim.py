@@ -0,0 +1,128 @@
+"""
+Module: reclaim.py
+
+Description:
+    Deferred removal of blobs.
+
+    Deleting a share only renames it's blobs into data/reclaim/ (cheap, same
+    filesystem) and a background thread unlinks them at RECLAIM_RATE_MBPS, so
+    delete latency does not depend on file size. The directory itself is the
+    durable queue: blobs left there by a restart are picked up on start().
+
+    Bytes waiting in the queue still occupy the disk, transfers counts them
+    into the space usage (pending_b).
+
+    Reclaimer:
+        - start()
+        - enqueue(paths: list[str]) -> int
+          Move blobs into the queue. Returns number of queued bytes.
+        - stats() -> dict
+"""
+from modules.paths import Path
+from modules.logs import Log
+
+import threading
+import time
+import os
+
+
+RECLAIM_PATH = Path("./data/reclaim/", lazy=True)
+
+
+class Reclaimer:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._started = False
+
+        self.pending_files = 0
+        self.pending_b = 0
+        self.reclaimed_files = 0
+        self.reclaimed_b = 0
+
+    def get_rate_bps(self) -> float:
+        return float(os.getenv("RECLAIM_RATE_MBPS", 256)) * 1024 * 1024
+
+    def ensure_queue(self) -> None:
+        if not RECLAIM_PATH.exists():
+            RECLAIM_PATH.touch()
+
+    def start(self) -> None:
+        """ Count blobs left in queue and start the unlinking thread. """
+        self.ensure_queue()
+        with os.scandir(RECLAIM_PATH.path) as entries:
+            for entry in entries:
+                try:
+                    size = entry.stat(follow_symlinks=False).st_size
+                except FileNotFoundError:
+                    continue
+                with self._lock:
+                    self.pending_files += 1
+                    self.pending_b += size
+
+        self._started = True
+        threading.Thread(target=self.worker, name="reclaimer", daemon=True).start()
+        self._wake.set()
+        Log.info(f"Initialized reclaimer ({self.pending_files} blob(s) pending).")
+
+    def enqueue(self, paths: list[str]) -> int:
+        """ Rename blobs into queue. Missing blobs are skipped. """
+        self.ensure_queue()
+        queued_b = 0
+        for path in paths:
+            try:
+                size = os.stat(path).st_size
+                os.replace(path, os.path.join(RECLAIM_PATH.path, f"{os.path.basename(path)}.{time.time_ns()}"))
+            except FileNotFoundError:
+                Log.error(f"Blob was already missing: {path}")
+                continue
+
+            with self._lock:
+                self.pending_files += 1
+                self.pending_b += size
+            queued_b += size
+
+        if queued_b:
+            self._wake.set()
+        return queued_b
+
+    def worker(self) -> None:
+        while True:
+            self._wake.wait(60)
+            self._wake.clear()
+            self.drain()
+
+    def drain(self) -> None:
+        """ Unlink everything queued, pausing after each blob to keep to the rate. """
+        with os.scandir(RECLAIM_PATH.path) as entries:
+            for entry in entries:
+                try:
+                    size = entry.stat(follow_symlinks=False).st_size
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                except OSError as error:
+                    Log.error(f"Failed to reclaim {entry.name}: {error}")
+                    continue
+
+                with self._lock:
+                    self.pending_files = max(0, self.pending_files - 1)
+                    self.pending_b = max(0, self.pending_b - size)
+                    self.reclaimed_files += 1
+                    self.reclaimed_b += size
+
+                rate = self.get_rate_bps()
+                if rate:
+                    time.sleep(size / rate)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._started,
+            "pending_files": self.pending_files,
+            "pending_b": self.pending_b,
+            "reclaimed_files": self.reclaimed_files,
+            "reclaimed_b": self.reclaimed_b,
+        }
+
+
+reclaimer = Reclaimer()
@@ -0,0 +1,191 @@
+"""
+Module: reconcile.py
+
+Description:
+    Keeps shared blobs (data/shared/) and rows of the shares table consistent.
+
+    Blobs are written before their row is inserted and a row is deleted before it's
+    blobs are unlinked, so a crash can only leave orphan blobs. Rows whose blobs went
+    missing (disk trouble, manual cleanup, crash of older versions) are dropped too.
+
+    A pass streams the store's listing (os.scandir for the local store) in batches
+    of RECONCILE_BATCH entries and sleeps between batches, so it never holds the disk
+    or the database lock for long. Blobs younger than RECONCILE_GRACE_S are skipped,
+    they may belong to an upload which has not inserted its row yet.
+
+    Orphans are moved to data/quarantine/ (RECONCILE_ORPHANS=quarantine, default)
+    or deleted (RECONCILE_ORPHANS=delete). Remote stores always delete them. Quarantined files are deleted after
+    RECONCILE_QUARANTINE_H hours. Bytes held in quarantine are reported to
+    transfers, so they count towards the server's usage limit.
+
+    Reconciler:
+        - run() -> dict
+          Single reconciliation pass. Returns it's report.
+        - stats() -> dict
+"""
+from modules.paths import Path
+from modules import transfers
+from modules import blobstore
+from modules import timestamp
+from modules import database
+from modules.logs import Log
+
+import threading
+import time
+import os
+
+
+QUARANTINE_PATH = Path("./data/quarantine/", lazy=True)
+
+
+def parse_blob_name(name: str) -> tuple[int, int | None] | None:
+    """ `<code>` -> (code, None), `<code>.<index>` -> (code, index). None for foreign names. """
+    code, _, index = name.partition(".")
+    if not code.isdigit() or (index and not index.isdigit()):
+        return None
+    return int(code), int(index) if index else None
+
+
+def is_blob_referenced(code: int, index: int | None) -> bool:
+    """ Check if shares table has a row owning this blob. """
+    try:
+        shared_file = transfers.transfers_db.get(str(code))
+    except database.KeyNotFound:
+        return False
+
+    if index is None:
+        return not shared_file.is_bundle()
+    return index < len(shared_file.files)
+
+
+class Reconciler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.passes = 0
+        self.last_report: dict = {}
+
+    def get_settings(self) -> tuple[int, float, float, str, float]:
+        return (
+            int(os.getenv("RECONCILE_BATCH", 500)),
+            float(os.getenv("RECONCILE_PAUSE_S", 0.05)),
+            float(os.getenv("RECONCILE_GRACE_S", 600)),
+            os.getenv("RECONCILE_ORPHANS", "quarantine"),
+            float(os.getenv("RECONCILE_QUARANTINE_H", 72)) * 3600,
+        )
+
+    def run(self) -> dict:
+        """ Reconcile blobs with rows. Passes never overlap. """
+        if not self._lock.acquire(blocking=False):
+            return self.last_report
+
+        try:
+            started = time.perf_counter()
+            report = {
+                "blobs": 0,
+                "orphans": 0,
+                "orphan_bytes": 0,
+                "skipped_recent": 0,
+                "dangling_rows": 0,
+                "quarantine_bytes": 0,
+                "quarantine_purged": 0,
+            }
+            self.scan_blobs(report)
+            self.scan_rows(report)
+            self.scan_quarantine(report)
+
+            transfers.set_unaccounted_usage_b(report["quarantine_bytes"])
+            report["duration_s"] = round(time.perf_counter() - started, 3)
+            report["finished"] = timestamp.generate_timestamp()
+            self.passes += 1
+            self.last_report = report
+
+            if report["orphans"] or report["dangling_rows"]:
+                Log.warn(
+                    f"Reconciliation: {report['orphans']} orphan blob(s) ({report['orphan_bytes']} b), "
+                    f"{report['dangling_rows']} dangling row(s)"
+                )
+            return report
+        finally:
+            self._lock.release()
+
+    def scan_blobs(self, report: dict) -> None:
+        batch, pause, grace, mode, _ = self.get_settings()
+
+        for position, blob in enumerate(transfers.blob_store.iter_blobs(), 1):
+            if position % batch == 0:
+                time.sleep(pause)
+            report["blobs"] += 1
+
+            parsed = parse_blob_name(blob.name)
+            if parsed is not None and is_blob_referenced(*parsed):
+                continue
+
+            if blob.mtime > time.time() - grace:
+                report["skipped_recent"] += 1
+                continue
+
+            # Re-check right before acting, the code may have been reused meanwhile.
+            if parsed is not None and is_blob_referenced(*parsed):
+                continue
+            if self.handle_orphan(blob, mode):
+                report["orphans"] += 1
+                report["orphan_bytes"] += blob.size
+
+    def handle_orphan(self, blob: blobstore.BlobInfo, mode: str) -> bool:
+        quarantine = mode != "delete" and transfers.blob_store.is_local
+        try:
+            if not transfers.blob_store.discard_orphan(blob, QUARANTINE_PATH.path if quarantine else None):
+                return False
+        except OSError as error:
+            Log.error(f"Reconciliation: failed to handle orphan blob {blob.name}: {error}")
+            return False
+
+        Log.info(f"Reconciliation: {'quarantined' if quarantine else 'deleted'} orphan blob {blob.name}")
+        return True
+
+    def scan_rows(self, report: dict) -> None:
+        batch, pause, grace, _, _ = self.get_settings()
+        created_before = timestamp.generate_timestamp() - grace
+
+        for position, model in enumerate(transfers.transfers_db.get_all_models(), 1):
+            if position % batch == 0:
+                time.sleep(pause)
+
+            if model.date_created > created_before:
+                continue
+            if all(transfers.blob_store.exists(name) for name in transfers.get_blob_names(model)):
+                continue
+
+            try:
+                model.remove()
+            except database.KeyNotFound:
+                continue
+            report["dangling_rows"] += 1
+            Log.warn(f"Reconciliation: dropped row {model.code}, it's blob is missing")
+
+    def scan_quarantine(self, report: dict) -> None:
+        _, _, _, _, keep_s = self.get_settings()
+        if not QUARANTINE_PATH.exists():
+            return
+
+        with os.scandir(QUARANTINE_PATH.path) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime < time.time() - keep_s:
+                        os.remove(entry.path)
+                        report["quarantine_purged"] += 1
+                        continue
+                except OSError:
+                    continue
+                report["quarantine_bytes"] += stat.st_size
+
+    def stats(self) -> dict:
+        return {
+            "passes": self.passes,
+            "unaccounted_usage_b": transfers.get_unaccounted_usage_b(),
+            "last": self.last_report,
+        }
+
+
+reconciler = Reconciler()
@@ -0,0 +1,199 @@
+"""
+Module: recorder.py
+
+Description:
+    Recording of anonymized request metadata for replay (tools/replay.py).
+
+    With TRAFFIC_RECORD=1 every HTTP request (except admin endpoints) is written as one
+    line into logs/traffic-<time>.jsonl. The first line is a header, the rest are compact
+    JSON arrays:
+        [offset_ms, method, route, params, status, request_b, response_b, duration_ms, client, extra]
+    route is the matched route's template (/api/receive/{code}), params it's path
+    parameters. Codes and client addresses are replaced by keyed hashes, the key
+    (TRAFFIC_RECORD_SALT, random by default) is never written, so a recording links
+    requests of the same client or code without revealing them. Endpoints add details
+    needed for replay through annotate() (created code, files count, lifetime, ...),
+    `code` and `grant` (upload token) values are hashed the same way.
+
+    Lines are buffered and written by a background thread every FLUSH_INTERVAL_S.
+    Recording stops once the file reaches TRAFFIC_RECORD_MAX_MB.
+
+    TrafficRecorder:
+        - configure()
+          Start recording if TRAFFIC_RECORD=1. Called from app's lifespan.
+        - anonymize(value) -> str
+        - stop()
+          Write pending lines and close the file.
+    Functions:
+        - annotate(request, **fields)
+"""
+from modules.logs import Log, LOGS_PATH
+
+import threading
+import secrets
+import hashlib
+import hmac
+import time
+import json
+import re
+import os
+
+
+FORMAT_VERSION = 1
+FLUSH_INTERVAL_S = 1.0
+ANONYMIZED_FIELDS = ("code", "grant")
+SKIPPED_PREFIXES = ("/api/admin/",)
+DIGITS_SEGMENT = re.compile(r"/\d+(?=/|$)")
+SCOPE_KEY = "recorded"
+
+
+class TrafficRecorder:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: list[str] = []
+        self._file = None
+        self._salt = b""
+        self._started = 0.0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self.path: str | None = None
+        self.max_bytes = 0
+        self.written_b = 0
+        self.recorded = 0
+        self.dropped = 0
+
+    @property
+    def active(self) -> bool:
+        return self._file is not None
+
+    def configure(self) -> None:
+        if os.getenv("TRAFFIC_RECORD", "0") != "1" or self.active:
+            return
+
+        if not LOGS_PATH.exists():
+            LOGS_PATH.touch()
+        self.path = os.path.join(LOGS_PATH.path, f"traffic-{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+        self.max_bytes = int(float(os.getenv("TRAFFIC_RECORD_MAX_MB", 512)) * 1024 * 1024)
+        self._salt = (os.getenv("TRAFFIC_RECORD_SALT") or secrets.token_hex(16)).encode()
+        self._started = time.perf_counter()
+        self._stop.clear()
+
+        self._file = open(self.path, "a", encoding="utf8")
+        self.__write_lines([json.dumps({"version": FORMAT_VERSION, "started": int(time.time())})])
+        self._thread = threading.Thread(target=self.__run, name="traffic-recorder", daemon=True)
+        self._thread.start()
+        Log.info(f"Recording traffic into {self.path}")
+
+    def anonymize(self, value) -> str:
+        return hmac.new(self._salt, str(value).encode(), hashlib.sha256).hexdigest()[:12]
+
+    def anonymize_fields(self, fields: dict) -> dict:
+        return {name: self.anonymize(value) if name in ANONYMIZED_FIELDS else value for name, value in fields.items()}
+
+    def record(self, scope: dict, status: int, request_b: int, response_b: int, started: float, finished: float) -> None:
+        route = scope.get("route")
+        template = getattr(route, "path", None) or DIGITS_SEGMENT.sub("/{n}", scope.get("path", ""))
+        params = self.anonymize_fields(scope.get("path_params", {}))
+        client = scope.get("client")
+        entry = [
+            round((started - self._started) * 1000, 1),
+            scope.get("method", ""),
+            template,
+            params,
+            status,
+            request_b,
+            response_b,
+            round((finished - started) * 1000, 2),
+            self.anonymize(client[0]) if client else "",
+            self.anonymize_fields(scope.get(SCOPE_KEY) or {}),
+        ]
+        line = json.dumps(entry, separators=(",", ":"), default=str)
+        with self._lock:
+            self._pending.append(line)
+
+    def __write_lines(self, lines: list[str]) -> None:
+        data = "".join(line + "\n" for line in lines)
+        if self.written_b + len(data) > self.max_bytes:
+            self.dropped += len(lines)
+            return
+        self._file.write(data)
+        self._file.flush()
+        self.written_b += len(data)
+        self.recorded += len(lines)
+
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._pending = self._pending, []
+        if lines and self._file is not None:
+            try:
+                self.__write_lines(lines)
+            except OSError as error:
+                self.dropped += len(lines)
+                Log.error(f"Failed to write traffic recording: {error}")
+
+    def __run(self) -> None:
+        while not self._stop.wait(FLUSH_INTERVAL_S):
+            self.flush()
+
+    def stop(self) -> None:
+        if not self.active:
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        self._file.close()
+        self._file = None
+        Log.info(f"Traffic recording stopped: {self.recorded} requests in {self.path}")
+
+    def stats(self) -> dict:
+        return {
+            "recording": self.active,
+            "path": self.path,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written_bytes": self.written_b,
+        }
+
+
+recorder = TrafficRecorder()
+
+
+def annotate(request, **fields) -> None:
+    """ Add details of request to it's recorded line (no-op when not recording). """
+    extra = request.scope.get(SCOPE_KEY)
+    if extra is not None:
+        extra.update((name, value) for name, value in fields.items() if value is not None)
+
+
+class TrafficRecorderMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not recorder.active or scope["path"].startswith(SKIPPED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        scope[SCOPE_KEY] = {}
+        counted = {"status": 0, "request_b": 0, "response_b": 0}
+        started = time.perf_counter()
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                counted["request_b"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message) -> None:
+            if message["type"] == "http.response.start":
+                counted["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                counted["response_b"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            recorder.record(scope, counted["status"], counted["request_b"], counted["response_b"], started, time.perf_counter())
@@ -0,0 +1,206 @@
+"""
+Module: replication.py
+
+Description:
+    Warm standby of the shares table, fed by the primary's change log.
+
+    The primary publishes every write of transfers_db into it's ChangeLog
+    (REPLICATION_LOG_SIZE retained changes, see modules/database.py) and serves it
+    through admin endpoints:
+        GET /api/admin/replication/snapshot?db=shares
+        GET /api/admin/replication/changes?db=shares&epoch=E&after=N&wait=S
+
+    A node started with REPLICA_OF=<primary url> (and REPLICA_TOKEN, the primary's
+    ADMIN_TOKEN) follows it: it copies a snapshot, then long-polls changes after the
+    last applied sequence number and applies them to it's own copy of the table.
+    When the primary's epoch changes (restart, external reload) or changes are no
+    longer retained, the follower catches up from a new snapshot. Lag is reported in
+    metrics ("replication") as changes behind and delay of the last applied change.
+
+    While following, the node answers public API requests with 503 and doesn't run
+    the cleaner, so it never removes blobs of a shared store. Failover is
+    POST /api/admin/replication/promote: the follower stops and the node serves the
+    copied table as a primary. Blobs must be reachable by both nodes (BLOB_STORE=s3),
+    only metadata is replicated.
+
+    Follower:
+        - configure(db: Database)
+          Start following if REPLICA_OF is set. Called from app's lifespan.
+        - promote() -> bool
+          Stop following, returns False if node was not following.
+    ReadOnlyReplicaMiddleware:
+        Rejects public API requests while following.
+"""
+from modules.admin import ADMIN_TOKEN_HEADER
+from modules.logs import Log
+from modules import errors
+
+from fastapi.responses import JSONResponse
+from urllib.parse import urlencode
+import urllib.request
+import threading
+import time
+import json
+import os
+
+
+SNAPSHOT_PATH = "/api/admin/replication/snapshot"
+CHANGES_PATH = "/api/admin/replication/changes"
+DEFAULT_WAIT_S = 10.0
+MAX_WAIT_S = 30.0
+CHANGES_LIMIT = 1000
+REQUEST_TIMEOUT_S = 30.0
+RETRY_MIN_S = 0.5
+RETRY_MAX_S = 15.0
+ALLOWED_PREFIXES = ("/api/admin/",)
+
+
+class Follower:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.db = None
+        self.primary_url: str | None = None
+        self.token = ""
+        self.wait_s = DEFAULT_WAIT_S
+
+        self.state = "disabled"  # disabled | syncing | following | promoted
+        self.epoch: str | None = None
+        self.applied_seq = 0
+        self.primary_seq = 0
+        self.snapshots = 0
+        self.applied = 0
+        self.errors = 0
+        self.last_error: str | None = None
+        self.last_contact: float | None = None
+        self.delay_s: float | None = None
+        self.catch_up_s: float | None = None
+
+    @property
+    def following(self) -> bool:
+        return self.state in ("syncing", "following")
+
+    def configure(self, db) -> None:
+        primary_url = os.getenv("REPLICA_OF")
+        if not primary_url or self._thread is not None:
+            return
+
+        self.db = db
+        self.primary_url = primary_url.rstrip("/")
+        self.token = os.getenv("REPLICA_TOKEN") or os.getenv("ADMIN_TOKEN") or ""
+        self.wait_s = min(float(os.getenv("REPLICA_WAIT_S", DEFAULT_WAIT_S)), MAX_WAIT_S)
+        self.state = "syncing"
+        self._thread = threading.Thread(target=self.__run, name="replica-follower", daemon=True)
+        self._thread.start()
+        Log.info(f"Replication: following {self.primary_url} ({db.name})")
+
+    def __fetch(self, path: str, params: dict, timeout_s: float):
+        url = f"{self.primary_url}{path}?{urlencode(params)}"
+        request = urllib.request.Request(url, headers={ADMIN_TOKEN_HEADER: self.token})
+        with urllib.request.urlopen(request, timeout=timeout_s) as response:
+            body = json.loads(response.read())
+        self.last_contact = time.monotonic()
+        if not body.get("status"):
+            raise ValueError(body.get("error") or "primary refused request")
+        return body["response"]
+
+    def __catch_up(self) -> None:
+        started = time.perf_counter()
+        snapshot = self.__fetch(SNAPSHOT_PATH, {"db": self.db.name}, REQUEST_TIMEOUT_S)
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self.db.apply_snapshot(snapshot["content"])
+            self.epoch = snapshot["epoch"]
+            self.applied_seq = self.primary_seq = snapshot["seq"]
+            self.state = "following"
+        self.snapshots += 1
+        self.catch_up_s = round(time.perf_counter() - started, 3)
+        Log.info(f"Replication: copied snapshot of {len(snapshot['content'])} rows at {self.epoch}:{self.applied_seq} in {self.catch_up_s}s")
+
+    def __tail(self) -> None:
+        wait_s = self.wait_s if self.applied_seq >= self.primary_seq else 0
+        response = self.__fetch(CHANGES_PATH, {
+            "db": self.db.name,
+            "epoch": self.epoch,
+            "after": self.applied_seq,
+            "limit": CHANGES_LIMIT,
+            "wait": wait_s,
+        }, wait_s + REQUEST_TIMEOUT_S)
+
+        if response.get("snapshot_required"):
+            Log.warn(f"Replication: changes after {self.epoch}:{self.applied_seq} not available, catching up from snapshot")
+            self.epoch = None
+            return
+
+        changes = response["changes"]
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self.db.apply_changes(changes)
+            self.primary_seq = response["seq"]
+            if changes:
+                self.applied_seq = changes[-1]["seq"]
+                self.applied += len(changes)
+                self.delay_s = round(max(time.time() - changes[-1]["time"], 0), 3)
+
+    def __run(self) -> None:
+        retry_s = RETRY_MIN_S
+        while not self._stop.is_set():
+            try:
+                if self.epoch is None:
+                    self.__catch_up()
+                else:
+                    self.__tail()
+                retry_s = RETRY_MIN_S
+            except (OSError, ValueError, KeyError) as error:
+                self.errors += 1
+                self.last_error = str(error)
+                Log.warn(f"Replication: failed to read from {self.primary_url}: {error}")
+                self._stop.wait(retry_s)
+                retry_s = min(retry_s * 2, RETRY_MAX_S)
+
+    def promote(self) -> bool:
+        """ Stop following. Changes being fetched are discarded, applied ones stay. """
+        with self._lock:
+            if not self.following:
+                return False
+            self._stop.set()
+            self.state = "promoted"
+        Log.info(f"Replication: promoted to primary at {self.epoch}:{self.applied_seq} ({self.primary_seq - self.applied_seq} changes behind last contact)")
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "primary": self.primary_url,
+            "epoch": self.epoch,
+            "applied_seq": self.applied_seq,
+            "primary_seq": self.primary_seq,
+            "lag_changes": self.primary_seq - self.applied_seq,
+            "delay_s": self.delay_s,
+            "last_contact_s": round(time.monotonic() - self.last_contact, 3) if self.last_contact else None,
+            "catch_up_s": self.catch_up_s,
+            "snapshots": self.snapshots,
+            "applied_changes": self.applied,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+
+follower = Follower()
+
+
+class ReadOnlyReplicaMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not follower.following or not path.startswith("/api/") or path.startswith(ALLOWED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        response = JSONResponse({"status": False, "error": errors.READ_ONLY_REPLICA}, 503)
+        await response(scope, receive, send)
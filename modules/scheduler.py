@@ -0,0 +1,222 @@
+"""
+Module: scheduler.py
+
+Description:
+    Concurrency slots and bandwidth shaping for uploads and downloads.
+
+    TransferSchedulerMiddleware wraps `POST /api/transfer` and `GET /api/receive/...`.
+    A transfer needs a free global slot and a free slot of it's client IP. Requests
+    exceeding the limits wait in a bounded FIFO queue (waiters of IPs which are at
+    their own limit are skipped, so one client cannot block the queue) and get
+    503 with Retry-After when the queue is full or the wait times out. Clients
+    banned by the routes' rate limiter (middleware's `limiter`) are answered 429
+    before they take or wait for a slot.
+
+    Bodies are shaped with a token bucket per transfer. Buckets refill at a fair
+    share of TRANSFER_BANDWIDTH_MBPS (total rate divided by active transfers) and
+    start full with TRANSFER_BURST_KB, so small transfers pass without delay while
+    large ones split the bandwidth evenly.
+
+    Limits are read by configure(), called from app's lifespan.
+
+    TransferScheduler:
+        - configure()
+        - acquire(ip: str) -> bool
+        - release(ip: str)
+        - fair_rate() -> float
+        - stats() -> dict
+"""
+from modules.ratelimit import RATE_LIMITED_RESPONSE
+from modules import errors
+
+from fastapi.responses import JSONResponse
+from collections import deque
+import asyncio
+import time
+import os
+
+
+class TokenBucket:
+    """ Bucket refilled at rate returned by get_rate (bytes/s, 0 = unlimited). """
+
+    def __init__(self, get_rate, capacity: int) -> None:
+        self.get_rate = get_rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def consume(self, amount: int) -> None:
+        rate = self.get_rate()
+        if not rate:
+            return
+
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+        # Whole chunk is let through, debt is paid off by sleeping.
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / rate)
+
+
+class TransferScheduler:
+    def __init__(self) -> None:
+        self.max_active = 32
+        self.max_active_per_ip = 4
+        self.max_queued = 64
+        self.queue_timeout_s = 30.0
+        self.bandwidth_bps = 0
+        self.burst_bytes = 256 * 1024
+
+        self.active = 0
+        self.active_uploads = 0
+        self.active_per_ip: dict[str, int] = {}
+        self._waiters: deque[tuple[str, asyncio.Future]] = deque()
+
+        self.served = 0
+        self.queued_total = 0
+        self.rejected = 0
+
+    def configure(self) -> None:
+        self.max_active = int(os.getenv("TRANSFER_SLOTS", 32))
+        self.max_active_per_ip = int(os.getenv("TRANSFER_SLOTS_PER_IP", 4))
+        self.max_queued = int(os.getenv("TRANSFER_QUEUE", 64))
+        self.queue_timeout_s = float(os.getenv("TRANSFER_QUEUE_TIMEOUT_S", 30))
+        self.bandwidth_bps = float(os.getenv("TRANSFER_BANDWIDTH_MBPS", 0)) * 1024 * 1024
+        self.burst_bytes = int(os.getenv("TRANSFER_BURST_KB", 256)) * 1024
+
+    def _can_start(self, ip: str) -> bool:
+        return self.active < self.max_active and self.active_per_ip.get(ip, 0) < self.max_active_per_ip
+
+    def _take(self, ip: str) -> None:
+        self.active += 1
+        self.active_per_ip[ip] = self.active_per_ip.get(ip, 0) + 1
+
+    async def acquire(self, ip: str) -> bool:
+        """ Take a slot, waiting in queue if needed. False when rejected. """
+        # Waiters left in queue while global slots are free are all at their IP's limit.
+        if self._can_start(ip):
+            self._take(ip)
+            return True
+
+        if len(self._waiters) >= self.max_queued:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((ip, waiter))
+        self.queued_total += 1
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout_s)
+        except BaseException:
+            # Request cancelled while queued, give back slot if it was handed over meanwhile.
+            if waiter.done():
+                self.release(ip)
+            else:
+                self._drop_waiter(ip, waiter)
+            raise
+
+        if not waiter.done():
+            self._drop_waiter(ip, waiter)
+            self.rejected += 1
+            return False
+        return True
+
+    def _drop_waiter(self, ip: str, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        self._waiters.remove((ip, waiter))
+
+    def release(self, ip: str) -> None:
+        self.active -= 1
+        count = self.active_per_ip.get(ip, 1) - 1
+        if count:
+            self.active_per_ip[ip] = count
+        else:
+            self.active_per_ip.pop(ip, None)
+        self.served += 1
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        """ Hand freed slots to the oldest waiters whose IP is below it's limit. """
+        for ip, waiter in list(self._waiters):
+            if self.active >= self.max_active:
+                return
+            if waiter.done() or not self._can_start(ip):
+                continue
+            self._waiters.remove((ip, waiter))
+            self._take(ip)
+            waiter.set_result(True)
+
+    def fair_rate(self) -> float:
+        """ Bandwidth share of single transfer in bytes/s, 0 = unlimited. """
+        if not self.bandwidth_bps:
+            return 0
+        return self.bandwidth_bps / max(1, self.active)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "active_uploads": self.active_uploads,
+            "active_ips": len(self.active_per_ip),
+            "queued": len(self._waiters),
+            "queued_total": self.queued_total,
+            "rejected": self.rejected,
+            "served": self.served,
+            "fair_rate_bps": round(self.fair_rate()),
+        }
+
+
+scheduler = TransferScheduler()
+
+
+def is_scheduled_request(scope: dict) -> bool:
+    path = scope.get("path", "")
+    method = scope.get("method")
+    return (method == "POST" and path == "/api/transfer") or (method == "GET" and path.startswith("/api/receive/"))
+
+
+class TransferSchedulerMiddleware:
+    """ ASGI middleware applying scheduler's slots and shaping to transfer requests. """
+
+    def __init__(self, app, limiter=None) -> None:
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not is_scheduled_request(scope):
+            await self.app(scope, receive, send)
+            return
+
+        ip = scope["client"][0] if scope.get("client") else ""
+        # Calls are still registered by the route's gate, here only banned clients are turned away.
+        if self.limiter is not None and self.limiter.is_rate_limited(ip):
+            await RATE_LIMITED_RESPONSE(scope, receive, send)
+            return
+
+        if not await scheduler.acquire(ip):
+            retry_after = str(max(1, int(scheduler.queue_timeout_s)))
+            response = JSONResponse({"status": False, "error": errors.SERVER_BUSY}, 503, headers={"Retry-After": retry_after})
+            await response(scope, receive, send)
+            return
+
+        bucket = TokenBucket(scheduler.fair_rate, scheduler.burst_bytes)
+
+        async def shaped_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                await bucket.consume(len(message.get("body", b"")))
+            return message
+
+        async def shaped_send(message):
+            if message["type"] == "http.response.body":
+                await bucket.consume(len(message.get("body", b"")))
+            await send(message)
+
+        is_upload = scope["method"] == "POST"
+        scheduler.active_uploads += is_upload
+        try:
+            await self.app(scope, shaped_receive, shaped_send)
+        finally:
+            scheduler.active_uploads -= is_upload
+            scheduler.release(ip)
@@ -0,0 +1,67 @@
+"""
+Module: startup.py
+
+Description:
+    Startup timing report.
+
+    Import this module first so PROCESS_START is taken before heavy imports.
+    Stages are marked with time elapsed since previous mark; the report is
+    logged once all stages (including background ones) finished.
+
+    StartupReport:
+        - mark(stage: str, details: str = "") -> float
+          Record stage ending now. Returns stage duration in seconds.
+        - add(stage: str, started: float, details: str = "") -> float
+          Record stage running in background since `started` (perf_counter).
+        - log()
+          Print report with all stages.
+        - as_dict() -> dict
+          Stage durations in milliseconds.
+"""
+import time
+
+PROCESS_START = time.perf_counter()
+
+from modules.logs import Log
+
+
+class StartupReport:
+    def __init__(self) -> None:
+        self.stages: list[tuple[str, float, str]] = []
+        self._last_mark = PROCESS_START
+        self._finished = PROCESS_START
+
+    def mark(self, stage: str, details: str = "") -> float:
+        """ Record stage ending now. """
+        now = time.perf_counter()
+        duration = now - self._last_mark
+        self._last_mark = now
+        self._finished = max(self._finished, now)
+        self.stages.append((stage, duration, details))
+        return duration
+
+    def add(self, stage: str, started: float, details: str = "") -> float:
+        """ Record background stage which started at `started` and ends now. """
+        now = time.perf_counter()
+        duration = now - started
+        self._finished = max(self._finished, now)
+        self.stages.append((stage, duration, details))
+        return duration
+
+    def total(self) -> float:
+        return self._finished - PROCESS_START
+
+    def as_dict(self) -> dict[str, float]:
+        report = {stage: round(duration * 1000, 2) for stage, duration, _ in self.stages}
+        report["total"] = round(self.total() * 1000, 2)
+        return report
+
+    def log(self) -> None:
+        parts = []
+        for stage, duration, details in self.stages:
+            details = f" ({details})" if details else ""
+            parts.append(f"{stage}: {duration * 1000:.1f}ms{details}")
+        Log.info(f"Startup: {', '.join(parts)} | total: {self.total() * 1000:.1f}ms")
+
+
+report = StartupReport()
@@ -1,51 +1,173 @@
 from modules.paths import Path
 from modules import timestamp
+from modules import compression
+from modules import blobstore
+from modules import cluster
+from modules import reclaim
+from modules import archive
+from modules import hotcache
+from modules import codes
+from modules import owners
 from modules import database
 from modules.logs import Log
 from modules import errors
 
-from fastapi import UploadFile
+from typing import Iterator
+from dataclasses import dataclass, field
+from itertools import compress
 from enum import IntEnum
+import threading
+import operator
 import random
 import hashlib
 import os
 
 
-TRANSFERS_PATH = Path("./data/shared/")
+TRANSFERS_PATH = Path("./data/shared/", lazy=True)
 MAX_TRANSFER_SIZE = 500 * 1024 * 1024   # 500mb
+MAX_FILES_PER_TRANSFER = 20
+MAX_DOWNLOADS_LIMIT = 1000
+CODES_RANGE = range(10000, 100000)
+NEGATIVE_LOOKUP_TTL_S = 30
+RANDOM_CODE_ATTEMPTS = 32
+CHECKED_CODES = False
+COMPRESS_AT_REST = False
 
+hot_files = hotcache.HotFileCache(64 * 1024 * 1024, 1024 * 1024)
+live_codes = codes.CodeSet(CODES_RANGE)
+_live_codes_lock = threading.Lock()
+_live_codes_generation: int | None = None
+_pending_codes: set[int] = set()  # Reserved by drafts whose rows are not inserted yet
+owner_index = owners.OwnerIndex()
+_owner_index_lock = threading.Lock()
+_owner_index_generation: int | None = None
+_unaccounted_usage_b = 0
+blob_store: blobstore.BlobStore = blobstore.LocalBlobStore(TRANSFERS_PATH.path)
 
-if not TRANSFERS_PATH.exists():
-    TRANSFERS_PATH.touch()
+
+def init() -> None:
+    """ Prepare storage directory, blob store and caches. Called from app's lifespan instead of at import. """
+    global blob_store
+    if not TRANSFERS_PATH.exists():
+        TRANSFERS_PATH.touch()
+    blob_store = blobstore.create_blob_store(TRANSFERS_PATH.path)
+    # Before any request is served: moving a blob under a response which already resolved it's path would cut the download.
+    blob_store.migrate()
+
+    hot_files.configure(
+        int(os.getenv("HOT_CACHE_MB", 64)) * 1024 * 1024,
+        int(os.getenv("HOT_CACHE_FILE_KB", 1024)) * 1024
+    )
+
+    global CHECKED_CODES, COMPRESS_AT_REST
+    CHECKED_CODES = os.getenv("CODE_FORMAT", "plain") == "checked"
+    COMPRESS_AT_REST = os.getenv("COMPRESS_AT_REST", "0") == "1"
+
+    transfers_db.changes.enable(int(os.getenv("REPLICATION_LOG_SIZE", 10000)))
+    transfers_db.use_columnar(os.getenv("DB_COLUMNAR", "0") == "1")
 
 
 def get_max_data_size_b() -> int | float:
     return float(os.getenv("MAX_DATA_SIZE_MB")) * 1024 * 1024 or 1024 ** 3
 
 
+def set_unaccounted_usage_b(size: int) -> None:
+    """ Bytes on disk not owned by any share (quarantined orphans). Set by reconciliation. """
+    global _unaccounted_usage_b
+    _unaccounted_usage_b = size
+
+
+def get_unaccounted_usage_b() -> int:
+    return _unaccounted_usage_b
+
+
 def get_total_space_usage_b() -> int:
-    """ Returns amount of bytes currently stored. """
-    total_size = 0
-    
-    for model in transfers_db.get_all_models():
-        total_size += model.size
-        
+    """ Returns amount of bytes currently stored (on disk, after compression), including blobs waiting for removal. """
+    total_size = _unaccounted_usage_b + reclaim.reclaimer.pending_b
+
+    # Same as summing get_stored_size(): stored_size, or size where stored_size is 0.
+    _, sizes, stored_sizes = transfers_db.scan("size", "stored_size")
+    total_size += sum(stored_sizes) + sum(compress(sizes, map(operator.not_, stored_sizes)))
     return total_size
 
 
-def is_space_available(size: int) -> bool:
-    """ Check if there is enough space to fit file with this size. """
-    return get_total_space_usage_b() + size < get_max_data_size_b()
+def get_min_free_disk_b() -> int:
+    return int(os.getenv("MIN_FREE_DISK_MB", 64)) * 1024 * 1024
+
+
+def get_free_disk_b() -> int | None:
+    """ Bytes available to this process on the blob store's filesystem (None for remote stores). """
+    return blob_store.free_space_b()
+
+
+@dataclass
+class Reservation:
+    size: int
+    active: bool = True
+
+
+class SpaceLedger:
+    """
+    Admission ledger of bytes being uploaded.
+    Reservation is taken before blobs are written and committed (row now accounts
+    for the bytes) or released (upload failed) afterwards. Checking and reserving
+    happen under one lock, so concurrent uploads cannot all pass the same check.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reserved_b = 0
+        self.active = 0
+        self.rejected_quota = 0
+        self.rejected_disk = 0
+
+    def reserve(self, size: int) -> Reservation | None:
+        """ Reserve size bytes. None if quota or free disk space would be exceeded. """
+        with self._lock:
+            if get_total_space_usage_b() + self.reserved_b + size >= get_max_data_size_b():
+                self.rejected_quota += 1
+                return None
 
+            free_disk = get_free_disk_b()
+            if free_disk is not None and free_disk - self.reserved_b - size < get_min_free_disk_b():
+                self.rejected_disk += 1
+                return None
 
-def can_create_code(ip_address: str) -> bool:
+            self.reserved_b += size
+            self.active += 1
+            return Reservation(size)
+
+    def commit(self, reservation: Reservation) -> None:
+        """ Upload stored, it's bytes are now accounted by the shares table. """
+        self.release(reservation)
+
+    def release(self, reservation: Reservation) -> None:
+        with self._lock:
+            if not reservation.active:
+                return
+            reservation.active = False
+            self.reserved_b -= reservation.size
+            self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "reserved_b": self.reserved_b,
+            "active_reservations": self.active,
+            "rejected_quota": self.rejected_quota,
+            "rejected_disk": self.rejected_disk,
+            "usage_b": get_total_space_usage_b(),
+            "max_usage_b": get_max_data_size_b(),
+            "free_disk_b": get_free_disk_b(),
+        }
+
+
+space_ledger = SpaceLedger()
+
+
+def can_create_code(ip_address: str, pending: int = 0) -> bool:
+    """ Check owner's limit. `pending` counts transfers granted but not stored yet. """
     MAX_SHARES = int(os.getenv("MAX_SHARES_PER_IP")) or 5
     
-    current_count = 0
-    for model in transfers_db.get_all_models():
-        if model.owner_ip == ip_address:
-            current_count += 1
-        
+    current_count = pending + len(transfers_db.find_keys("owner_ip", ip_address))
     return current_count < MAX_SHARES
 
 
@@ -66,29 +188,119 @@ LIFETIMES_TIMEDELTA = {
 }
 
 
-def generate_transfer_code() -> int:
-    while True:
-        code = random.randrange(10000, 99999)
-        
-        if str(code) not in transfers_db.get_all_keys():
+def sync_live_codes() -> None:
+    """ Rebuild live codes filter if shares table was (re)loaded from file. """
+    global _live_codes_generation
+
+    reloads = transfers_db.refresh()
+    if reloads == _live_codes_generation:
+        return
+
+    with _live_codes_lock:
+        live_codes.rebuild(transfers_db.get_all_keys())
+        for code in _pending_codes:
+            live_codes.add(code)
+        if _live_codes_generation is not None:
+            shared_files_cache.clear()
+        _live_codes_generation = reloads
+
+
+def build_owned_entry(file: "SharedFile") -> dict:
+    """ Share as listed by /api/owned-codes. """
+    return {
+        "file": file.name,
+        "expire": timestamp.convert_to_readable(file.date_expire),
+        "downloads": get_downloads(file),
+        "max_downloads": file.max_downloads
+    }
+
+
+def sync_owner_index() -> None:
+    """ Rebuild owner index if shares table was (re)loaded from file. """
+    global _owner_index_generation
+
+    with _owner_index_lock:
+        reloads = transfers_db.refresh()
+        if reloads == _owner_index_generation:
+            return
+        owner_index.rebuild((model.owner_ip, model.code, build_owned_entry(model)) for model in transfers_db.get_all_models())
+        _owner_index_generation = reloads
+
+
+def get_owned_codes(ip_address: str, since: str | None = None) -> owners.OwnedCodes:
+    """ Shares of client, only changes after version `since` when possible. """
+    sync_owner_index()
+    return owner_index.listing(hash_ip(ip_address), since)
+
+
+def is_code_acceptable(code: int) -> bool:
+    """
+    Cheap check done before any lookup. False means code definitely does not exist.
+    Codes failing the check digit are still looked up in the filter, so codes created
+    before switching CODE_FORMAT keep working.
+    """
+    if code not in CODES_RANGE:
+        return False
+
+    if _live_codes_generation is None:
+        sync_live_codes()
+
+    if CHECKED_CODES and not codes.is_checked_code(code) and not live_codes.contains(code):
+        return False
+
+    sync_live_codes()
+    return live_codes.contains(code)
+
+
+def generate_transfer_code() -> int | None:
+    """
+    Pick free code (owned by this node in cluster mode) and reserve it in live codes filter.
+    Returns None when no code is free.
+    """
+    sync_live_codes()
+    candidates = codes.CHECKED_BASE_RANGE if CHECKED_CODES else range(10000, 99999)
+    to_code = codes.make_checked_code if CHECKED_CODES else int
+
+    for _ in range(RANDOM_CODE_ATTEMPTS):
+        code = reserve_code(to_code(random.choice(candidates)))
+        if code is not None:
             return code
-    
-    
-def ensure_file_size(file: UploadFile) -> int:
-    if file.size is not None:
-        return file.size
-    
-    size = len(file.file.read())
-    file.file.seek(0)
-    
-    return size
-    
-    
+
+    # Nearly full: walk the whole space from a random position, so any free code is found.
+    start = random.randrange(len(candidates))
+    for position in range(len(candidates)):
+        code = reserve_code(to_code(candidates[(start + position) % len(candidates)]))
+        if code is not None:
+            return code
+    return None
+
+
+def reserve_code(code: int) -> int | None:
+    """ Reserved codes survive rebuilds of live codes filter until release_code(). """
+    if live_codes.contains(code) or not cluster.is_local_code(code):
+        return None
+
+    with _live_codes_lock:
+        if live_codes.contains(code):
+            return None
+        live_codes.add(code)
+        _pending_codes.add(code)
+        return code
+
+
+def release_code(code: int, stored: bool = False) -> None:
+    """ End reservation of code. Code stays live if it's row was stored. """
+    with _live_codes_lock:
+        _pending_codes.discard(code)
+        if not stored:
+            live_codes.discard(code)
+
+
 def hash_ip(ip: str) -> str:
     return hashlib.sha256(ip.encode()).hexdigest()
 
     
-@database.DBModel.model("shares", "!code")
+@database.DBModel.model("shares", "!code", hex_columns={"owner_ip": 32, "sha256": 32})
 class SharedFile:
     code: int
     name: str
@@ -96,45 +308,62 @@ class SharedFile:
     date_created: int
     date_expire: int
     owner_ip: str
+    stored_size: int = 0
+    encoding: str = ""
+    files: list = field(default_factory=list)  # Bundle members: [{name, size, stored_size, encoding}, ...]
+    max_downloads: int = 0  # 0 = unlimited, share is removed after the last allowed download
+    downloads: int = 0  # Written in batches by download_counter, use it for current value
+    sha256: str = ""  # Of original content, known for streamed uploads only
+
+    def get_stored_size(self) -> int:
+        """ Bytes taken on disk. `size` is the original (quota-accounted) size. """
+        return self.stored_size or self.size
+
+    def is_bundle(self) -> bool:
+        return bool(self.files)
+
+    def get_lifetime(self) -> TransferLifetime:
+        """ Lifetime option the share was created with (the closest one, local time may shift by DST). """
+        duration = self.date_expire - self.date_created
+        return min(LIFETIMES_TIMEDELTA, key=lambda lifetime: abs(LIFETIMES_TIMEDELTA[lifetime].total_seconds() - duration))
+
+    def get_members(self) -> list[dict]:
+        """ Files of this transfer. Single file transfer has one member describing itself. """
+        if self.is_bundle():
+            return self.files
+        return [{"name": self.name, "size": self.size, "stored_size": self.stored_size, "encoding": self.encoding, "sha256": self.sha256}]
     
     @staticmethod
-    def create_shared_file(file: UploadFile, lifetime: TransferLifetime, ip_address: str) -> "SharedFile | errors.T_Error":
-        ip_address = hash_ip(ip_address)
-        if not can_create_code(ip_address):
-            return errors.MAX_SHARED_FILES
-        
-        size = ensure_file_size(file)
-        if size > MAX_TRANSFER_SIZE:
-            return errors.SIZE_ERROR
-        
-        if not is_space_available(size):
-            return errors.SERVER_SIZE_ERROR
-        
-        if lifetime not in range(0, 5):
-            return errors.INVALID_LIFETIME
-        
-        code = generate_transfer_code()
+    def build(code: int, members: list[dict], lifetime: TransferLifetime, owner_ip: str, max_downloads: int) -> "SharedFile":
+        """ Row of stored members. More than one member makes a bundle. """
         date_created = timestamp.generate_timestamp()
         date_expire = timestamp.add_timedelta_to_timestamp(LIFETIMES_TIMEDELTA[lifetime], date_created)
-        
-        shared_file = SharedFile(
-            code, file.filename, size, date_created, date_expire, ip_address
+        if len(members) > 1:
+            names = archive.unique_names([member["name"] for member in members])
+            members = [{**member, "name": name} for member, name in zip(members, names)]
+            return SharedFile(
+                code, f"quicksh-{code}.zip", sum(m["size"] for m in members), date_created, date_expire, owner_ip,
+                sum(m["stored_size"] for m in members), "", members, max_downloads
+            )
+
+        member = members[0]
+        return SharedFile(
+            code, member["name"], member["size"], date_created, date_expire, owner_ip, member["stored_size"], member["encoding"],
+            max_downloads=max_downloads, sha256=member["sha256"]
         )
-        
-        transfer_path = TRANSFERS_PATH / str(code)
-        transfer_path.touch()
-        
-        with open(transfer_path.path, "wb+") as sh_file:
-            sh_file.write(file.file.read())
-        
-        transfers_db.insert(shared_file)
-        Log.info(f"Transfered new file: {code}  ({file.filename}, {size} b)")
-        
-        return shared_file
     
     def remove(self) -> None:
-        os.remove(get_file_path(self))
+        """
+        Logical delete: row goes first (crash in between leaves only orphan blobs, cleaned
+        by reconciliation), blobs are handed to the blob store and removed in background.
+        """
         transfers_db.delete(str(self.code))
+        hot_files.invalidate(self.code)
+        shared_files_cache.forget(self.code)
+        blob_store.delete(get_blob_names(self))
+        live_codes.discard(self.code)
+        download_counter.forget(self.code)
+        owner_index.remove(self.code)
         Log.info(f"Removed share: {self.code} ({self.size}b)")
     
     def request_delete(self, ip_address: str) -> bool | errors.T_Error:
@@ -146,24 +375,301 @@ class SharedFile:
         return True
     
     
+def find_owned_blob(owner_ip: str, sha256: str) -> tuple[str, dict] | None:
+    """ Blob name and member of owner's stored file with this content hash. """
+    for key in transfers_db.find_keys("owner_ip", owner_ip):
+        try:
+            model = transfers_db.get(key)
+        except database.KeyNotFound:
+            continue  # Removed meanwhile
+        for index, member in enumerate(model.get_members()):
+            if member.get("sha256") == sha256:
+                return get_member_blob_name(model, index), member
+    return None
+
+
+def validate_options(lifetime: int, max_downloads: int) -> errors.T_Error | None:
+    if lifetime not in range(0, 5):
+        return errors.INVALID_LIFETIME
+    if max_downloads not in range(0, MAX_DOWNLOADS_LIMIT + 1):
+        return errors.INVALID_MAX_DOWNLOADS
+    return None
+
+
+class MemberWriter:
+    """ Blob of one transfer member. Content is pushed with write(). """
+
+    def __init__(self, draft: "TransferDraft", name: str, blob: blobstore.BlobWriter) -> None:
+        self.draft = draft
+        self.name = name
+        self.blob = blob
+        self.encoder = compression.BlobEncoder(blob, COMPRESS_AT_REST)
+        self.digest = hashlib.sha256()
+
+    def write(self, data: bytes) -> None:
+        self.digest.update(data)
+        self.encoder.write(data)
+
+    def close(self) -> None:
+        """ Commit blob and add it to the draft's members. """
+        file_size, stored_size, encoding = self.encoder.finish()
+        self.blob.commit()
+        self.draft.members.append({"name": self.name, "size": file_size, "stored_size": stored_size, "encoding": encoding, "sha256": self.digest.hexdigest()})
+
+    def abort(self) -> None:
+        self.blob.abort()
+
+    def __enter__(self) -> "MemberWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class TransferDraft:
+    """
+    Transfer being received: code, space reservation and blobs written so far.
+    First member is written as a single file blob, it is renamed when a second member
+    makes the transfer a bundle. finish() inserts the row, abort() undoes everything.
+    """
+
+    def __init__(self, code: int, owner_ip: str, reservation: Reservation) -> None:
+        self.code = code
+        self.owner_ip = owner_ip
+        self.reservation = reservation
+        self.members: list[dict] = []
+        self.blobs: list[str] = []
+
+    @staticmethod
+    def begin(ip_address: str, size: int, pending: int = 0) -> "TransferDraft | errors.T_Error":
+        """ Check owner's limit and transfer size, reserve space and pick a code. """
+        ip_address = hash_ip(ip_address)
+        if not can_create_code(ip_address, pending):
+            return errors.MAX_SHARED_FILES
+
+        if size > MAX_TRANSFER_SIZE:
+            return errors.SIZE_ERROR
+
+        reservation = space_ledger.reserve(size)
+        if reservation is None:
+            return errors.SERVER_SIZE_ERROR
+
+        code = generate_transfer_code()
+        if code is None:
+            space_ledger.release(reservation)
+            Log.error("No free transfer code left.")
+            return errors.NO_CODES_AVAILABLE
+
+        return TransferDraft(code, ip_address, reservation)
+
+    def is_full(self) -> bool:
+        return len(self.blobs) >= MAX_FILES_PER_TRANSFER
+
+    def next_blob_name(self) -> str:
+        """ Name for the next member, renames the first one if this makes a bundle. """
+        if len(self.blobs) == 1:
+            blob_store.rename(self.blobs[0], get_blob_name(self.code, 0))
+            self.blobs[0] = get_blob_name(self.code, 0)
+
+        blob_name = get_blob_name(self.code, len(self.blobs) if self.blobs else None)
+        self.blobs.append(blob_name)
+        return blob_name
+
+    def open_member(self, name: str, size_hint: int | None = None) -> MemberWriter:
+        blob_name = self.next_blob_name()
+        return MemberWriter(self, name, blob_store.writer(blob_name, size_hint))
+
+    def add_stored_member(self, name: str, blob_name: str, member: dict) -> None:
+        """ Add member with the same content as an already stored blob (copied by the blob store). """
+        blob_store.copy(blob_name, self.next_blob_name())
+        self.members.append({**member, "name": name})
+
+    def finish(self, lifetime: TransferLifetime, max_downloads: int = 0) -> "SharedFile | errors.T_Error":
+        """ Insert row of stored members. Invalid options or no members abort the draft. """
+        error = validate_options(lifetime, max_downloads)
+        if error is None and not self.members:
+            error = errors.NO_FILES
+        if error is not None:
+            self.abort()
+            return error
+
+        shared_file = SharedFile.build(self.code, self.members, lifetime, self.owner_ip, max_downloads)
+        try:
+            transfers_db.insert(shared_file)
+        except database.KeyAlreadyExists:
+            # Code was given out twice, blobs with these names belong to the stored share.
+            Log.error(f"Refused to overwrite stored share: {self.code}")
+            self.blobs.clear()
+            release_code(self.code, stored=True)
+            space_ledger.release(self.reservation)
+            raise
+        except Exception:
+            self.abort()
+            raise
+
+        release_code(self.code, stored=True)
+        space_ledger.commit(self.reservation)
+        shared_files_cache.forget(self.code)
+        owner_index.put(self.owner_ip, self.code, build_owned_entry(shared_file))
+        Log.info(f"Transfered new file: {self.code}  ({shared_file.name}, {len(self.members)} file(s), {shared_file.size} b, stored: {shared_file.get_stored_size()} b)")
+        return shared_file
+
+    def abort(self) -> None:
+        blob_store.delete(self.blobs[:len(self.members)])
+        self.blobs.clear()
+        release_code(self.code)
+        space_ledger.release(self.reservation)
+
+
+class SharedFilesCache:
+    """
+    Read-through cache of SharedFile rows used by get_shared_file().
+    Rows never change after creation, so a found row is valid until it's date_expire.
+    Missing and expired codes are cached as None for NEGATIVE_LOOKUP_TTL_S seconds.
+    Entries must be forgotten when a row is created or removed.
+    """
+    def __init__(self) -> None:
+        self._entries: dict[int, tuple[int, SharedFile | None]] = {}  # code: (valid_until, file | None)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, code: int) -> tuple[bool, SharedFile | None]:
+        """ Returns (found, file). File is None for cached negative lookups. """
+        entry = self._entries.get(code)
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        valid_until, shared_file = entry
+        if valid_until < timestamp.generate_timestamp():
+            self._entries.pop(code, None)
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        return True, shared_file
+
+    def put(self, code: int, shared_file: SharedFile | None) -> None:
+        if code not in CODES_RANGE:
+            return
+
+        if shared_file is None:
+            valid_until = timestamp.generate_timestamp() + NEGATIVE_LOOKUP_TTL_S
+        else:
+            valid_until = shared_file.date_expire
+        self._entries[code] = (valid_until, shared_file)
+
+    def forget(self, code: int) -> None:
+        self._entries.pop(int(code), None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def prune(self) -> int:
+        """ Drop entries which are no longer valid. Returns number of dropped entries. """
+        now = timestamp.generate_timestamp()
+        expired = [code for code, (valid_until, _) in list(self._entries.items()) if valid_until < now]
+        for code in expired:
+            self._entries.pop(code, None)
+        return len(expired)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "negative_entries": sum(1 for _, shared_file in list(self._entries.values()) if shared_file is None),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+shared_files_cache = SharedFilesCache()
+
+
 def get_shared_file(code: int) -> SharedFile | errors.T_Error:
+    # Before the cache: a reload of shares table (external write, replica) clears it.
+    sync_live_codes()
+    found, shared_file = shared_files_cache.get(code)
+    if found:
+        return shared_file if shared_file is not None else errors.INVALID_CODE
+
+    if not is_code_acceptable(code):
+        return errors.INVALID_CODE
+
     try:
         shared_file = transfers_db.get(str(code))
         
         if shared_file.date_expire < timestamp.generate_timestamp():
             Log.error(f"Failed to receive shared file: ({code}) - File expired.")
+            shared_files_cache.put(code, None)
             return errors.INVALID_CODE
 
+        shared_files_cache.put(code, shared_file)
         return shared_file
 
     except database.KeyNotFound:
         Log.error(f"Failed to receive shared file: ({code}) - Code not found.")
+        shared_files_cache.put(code, None)
         return errors.INVALID_CODE
     
 
-def get_file_path(file: SharedFile) -> str:
-    return (TRANSFERS_PATH / str(file.code)).path
+def get_blob_name(code: int, index: int | None = None) -> str:
+    """ Blob of single file transfer is named by code, bundle members by code.index """
+    if index is None:
+        return str(code)
+    return f"{code}.{index}"
+
+
+def get_member_blob_name(file: SharedFile, index: int | None = None) -> str:
+    """ Blob of single file transfer or of bundle's member with index. """
+    if index is not None and not file.is_bundle():
+        index = None
+    return get_blob_name(file.code, index)
+
+
+def get_blob_names(file: SharedFile) -> list[str]:
+    if file.is_bundle():
+        return [get_member_blob_name(file, index) for index in range(len(file.files))]
+    return [get_member_blob_name(file)]
+
+
+def iter_member_content(file: SharedFile, index: int | None = None) -> Iterator[bytes]:
+    """ Original (decompressed) content of transfer's file. """
+    member = file.get_members()[index or 0]
+    return compression.iter_content(blob_store.iter_chunks(get_member_blob_name(file, index)), member["encoding"])
     
     
-transfers_db = database.Database[SharedFile](SharedFile)
+def register_download(code: int, max_downloads: int = 0) -> int | None:
+    """ Count download of share. Returns number of downloads so far, None if limit is reached or share is gone. """
+    try:
+        downloads = download_counter.acquire(str(code), max_downloads)
+    except database.KeyNotFound:
+        return None
+    if downloads is not None:
+        owner_index.touch(code, downloads=downloads)
+    return downloads
+
+
+def get_downloads(file: SharedFile) -> int:
+    """ Current downloads count (stored column may lag behind the counter). """
+    try:
+        return download_counter.get(str(file.code))
+    except database.KeyNotFound:
+        return file.downloads
+
+
+def remove_exhausted(file: SharedFile) -> None:
+    """ Remove share after it's last allowed download was sent. """
+    try:
+        file.remove()
+    except database.KeyNotFound:
+        pass
+
+
+transfers_db = database.Database[SharedFile](SharedFile, lazy=True)
+download_counter = database.BatchedCounter(transfers_db, "downloads")
 
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from modules import transfers
+
+
+@pytest.fixture
+def shares_db(tmp_path, monkeypatch):
+    """ Empty shares table in a temporary working directory (data/ and logs/ are relative to it). """
+    (tmp_path / "data").mkdir()
+    (tmp_path / "logs").mkdir()
+    monkeypatch.chdir(tmp_path)
+
+    db = transfers.transfers_db
+    db._content = None
+    db._signature = None
+    monkeypatch.setattr(transfers, "_live_codes_generation", None)
+    monkeypatch.setattr(transfers, "live_codes", transfers.codes.CodeSet(transfers.CODES_RANGE))
+    monkeypatch.setattr(transfers, "_pending_codes", set())
+    transfers.shared_files_cache.clear()
+    yield db
+    db._content = None
+    db._signature = None
+    transfers.shared_files_cache.clear()
+
+
+@pytest.fixture
+def client(shares_db, monkeypatch):
+    """ TestClient of the app (without lifespan) over an empty shares table. """
+    from fastapi.testclient import TestClient
+    with monkeypatch.context() as context:
+        context.chdir(REPO_ROOT)  # web/static is mounted at import
+        import main
+
+    monkeypatch.setenv("MAX_SHARES_PER_IP", "5")
+    monkeypatch.setenv("MAX_DATA_SIZE_MB", "1024")
+    monkeypatch.setattr(transfers, "blob_store", transfers.blobstore.LocalBlobStore(transfers.TRANSFERS_PATH.path))
+    monkeypatch.setattr(main.ApiLimiter, "_calls_cache", {})
+    monkeypatch.setattr(main.ApiLimiter, "_rate_limited", {})
+    hot_files_config = (transfers.hot_files.max_bytes, transfers.hot_files.max_file_size)
+    transfers.hot_files.clear()
+    yield TestClient(main.api)
+    transfers.hot_files.clear()
+    transfers.hot_files.configure(*hot_files_config)
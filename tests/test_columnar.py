@@ -0,0 +1,131 @@
+import random
+import json
+
+from modules.columnar import ColumnarTable
+from modules import transfers
+
+
+HEX_COLUMNS = {"owner_ip": 32, "sha256": 32}
+OWNERS = [transfers.hash_ip(f"10.0.0.{index}") for index in range(4)]
+
+
+def make_row(rng: random.Random, code: int, exceptions: bool = True) -> dict:
+    row = {
+        "code": code,
+        "name": rng.choice(["a.txt", "b.bin", "zażółć.txt"]),
+        "size": rng.choice([0, 10, 2 ** 40]),
+        "date_created": 1_700_000_000,
+        "date_expire": 1_700_003_600,
+        "owner_ip": rng.choice(OWNERS),
+        "stored_size": 0,
+        "encoding": rng.choice(["", "gzip"]),
+        "files": rng.choice([[], [{"name": "a", "size": 1, "stored_size": 0, "encoding": ""}]]),
+        "max_downloads": rng.choice([0, 3]),
+        "downloads": 0,
+        "sha256": rng.choice(["", OWNERS[0]]),
+    }
+    # Values storages can't encode are kept as they are.
+    exception = rng.random() if exceptions else 1
+    if exception < 0.05:
+        row["size"] = 2 ** 70
+    elif exception < 0.1:
+        row["sha256"] = "NOT-HEX"
+    elif exception < 0.15:
+        row["owner_ip"] = OWNERS[1].upper()
+    elif exception < 0.2:
+        row["extra"] = {"added": "by newer version"}
+    return row
+
+
+def make_table(shares_db) -> ColumnarTable:
+    return ColumnarTable(shares_db.columns, HEX_COLUMNS)
+
+
+def test_matches_dict_under_random_writes(shares_db):
+    rng = random.Random(50)
+    table = make_table(shares_db)
+    expected = {}
+    for step in range(3000):
+        operation = rng.random()
+        if operation < 0.55 or not expected:
+            key = str(rng.randrange(10000, 10400))
+            row = make_row(rng, int(key))
+            table[key] = row
+            expected[key] = row
+        else:
+            key = rng.choice(list(expected))
+            del table[key]
+            del expected[key]
+
+        if step % 250 == 0:
+            assert dict(table.items()) == expected
+
+    assert len(table) == len(expected)
+    assert dict(table.items()) == expected
+    assert json.loads(table.to_json()) == expected
+
+    for value in [*OWNERS, OWNERS[1].upper(), "", "NOT-HEX"]:
+        for column in ("owner_ip", "sha256"):
+            found = [key for key, row in expected.items() if row[column] == value]
+            assert sorted(table.find_keys(column, value)) == sorted(found)
+    assert sorted(table.find_keys("size", 2 ** 70)) == sorted(key for key, row in expected.items() if row["size"] == 2 ** 70)
+
+    keys, sizes, owners = table.scan(["size", "owner_ip"])
+    assert list(zip(keys, sizes, owners)) == [(key, expected[key]["size"], expected[key]["owner_ip"]) for key in keys]
+
+
+def test_delete_moves_last_row(shares_db):
+    rng = random.Random(1)
+    table = make_table(shares_db)
+    rows = {str(code): make_row(rng, code, exceptions=False) for code in range(10000, 10005)}
+    rows["10004"]["sha256"] = "NOT-HEX"
+    rows["10004"]["extra"] = 1
+    table.update(rows)
+
+    del table["10001"]  # Last row (10004) takes it's slot, with it's exceptions and extras
+    assert list(table) == ["10000", "10004", "10002", "10003"]
+    assert table["10004"] == rows["10004"]
+    assert table.find_keys("sha256", "NOT-HEX") == ["10004"]
+
+    del table["10003"]  # Last row, nothing moves
+    del table["10004"]
+    assert dict(table.items()) == {key: rows[key] for key in ("10000", "10002")}
+    assert table.stats() == {"rows": 2, "exceptions": {}, "extras": 0}
+
+
+def test_rows_are_copies(shares_db):
+    table = make_table(shares_db)
+    table["10000"] = make_row(random.Random(2), 10000)
+    row = table["10000"]
+    row["downloads"] = 7
+    row["files"].append({"name": "b"})
+    assert table["10000"]["downloads"] == 0
+
+
+def test_database_switches_representation(shares_db):
+    now = 1_700_000_000
+    for code in range(10000, 10010):
+        shares_db.insert(transfers.SharedFile(code, f"{code}.bin", code, now, now + 3600, OWNERS[code % 2]))
+    before = {key: shares_db.get(key) for key in shares_db.get_all_keys()}
+    with open(shares_db.filepath.path, "r") as file:
+        stored = json.load(file)
+
+    try:
+        shares_db.use_columnar(True)
+        assert isinstance(shares_db._content, ColumnarTable)
+        assert {key: shares_db.get(key) for key in shares_db.get_all_keys()} == before
+        assert sorted(shares_db.find_keys("owner_ip", OWNERS[1])) == [str(code) for code in range(10001, 10010, 2)]
+        assert sum(shares_db.scan("size")[1]) == sum(range(10000, 10010))
+
+        shares_db.update("10003", {"name": "renamed.bin"})
+        shares_db.delete("10000")
+        with open(shares_db.filepath.path, "r") as file:
+            stored_columnar = json.load(file)
+    finally:
+        shares_db.use_columnar(False)
+
+    del stored["10000"]
+    stored["10003"]["name"] = "renamed.bin"
+    assert stored_columnar == stored
+    assert shares_db.get("10003").name == "renamed.bin"
+    assert "10000" not in shares_db.get_all_keys()
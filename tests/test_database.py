@@ -0,0 +1,78 @@
+import threading
+import json
+import time
+
+import pytest
+
+from modules import transfers
+from modules import database
+
+
+def make_share(code: int, max_downloads: int = 0) -> transfers.SharedFile:
+    now = int(time.time())
+    return transfers.SharedFile(code, "file.bin", 10, now, now + 3600, transfers.hash_ip("10.0.0.1"), max_downloads=max_downloads)
+
+
+def make_counter(db) -> database.BatchedCounter:
+    # Flushed only by the test.
+    return database.BatchedCounter(db, "downloads", flush_interval_s=3600, flush_after=10 ** 6)
+
+
+def acquire_concurrently(counter, key: str, limit: int, calls: int) -> list[int | None]:
+    results = []
+    barrier = threading.Barrier(calls)
+
+    def acquire():
+        barrier.wait()
+        results.append(counter.acquire(key, limit))
+
+    threads = [threading.Thread(target=acquire) for _ in range(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_counter_limit_survives_failed_flush(shares_db, monkeypatch):
+    shares_db.insert(make_share(12345, max_downloads=5))
+    counter = make_counter(shares_db)
+
+    results = acquire_concurrently(counter, "12345", 5, 16)
+    assert sorted(result for result in results if result is not None) == [1, 2, 3, 4, 5]
+
+    def fail(column_name, deltas):
+        raise OSError("No space left on device")
+
+    with monkeypatch.context() as context:
+        context.setattr(shares_db, "add_to_column", fail)
+        with pytest.raises(OSError):
+            counter.flush()
+    assert counter.stats()["pending"] == 5
+    assert counter.acquire("12345", 5) is None
+
+    assert counter.flush() == 1
+    assert shares_db.get("12345").downloads == 5
+
+    # Restarted process reads the stored count.
+    assert make_counter(shares_db).acquire("12345", 5) is None
+
+
+def test_counter_sees_counts_of_other_process(shares_db):
+    shares_db.insert(make_share(12345, max_downloads=5))
+    counter = make_counter(shares_db)
+    assert counter.acquire("12345", 5) == 1
+
+    # Another process flushed 3 downloads of it's own.
+    path = shares_db.filepath.path
+    with open(path, "r") as file:
+        content = json.load(file)
+    content["12345"]["downloads"] = 3
+    with open(path, "w") as file:
+        json.dump(content, file)
+
+    assert counter.get("12345") == 4
+    assert counter.acquire("12345", 5) == 5
+    assert counter.acquire("12345", 5) is None
+    counter.flush()
+    assert shares_db.get("12345").downloads == 5
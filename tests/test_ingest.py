@@ -0,0 +1,113 @@
+import asyncio
+import os
+
+import pytest
+from starlette.requests import ClientDisconnect, Request
+
+from modules import transfers
+from modules import ingest
+from modules import errors
+
+
+BOUNDARY = "quickshboundary"
+
+
+def stored_blobs() -> list[str]:
+    return [name for _, _, names in os.walk(transfers.TRANSFERS_PATH.path) for name in names]
+
+
+def assert_draft_undone(reserved_b: int) -> None:
+    assert transfers.space_ledger.reserved_b == reserved_b
+    assert not transfers._pending_codes
+    assert transfers.live_codes.count == len(transfers.transfers_db.get_all_keys())
+    assert stored_blobs() == []
+
+
+def post_form(client, files: list[tuple[str, tuple[str, bytes]]], data: dict | None = None) -> dict:
+    response = client.post("/api/transfer", files=files, data={"expire": "1", **(data or {})})
+    return response.json()
+
+
+def test_multiple_files_make_bundle(client):
+    contents = [b"first file", b"second file" * 1000, b""]
+    result = post_form(client, [("file", (f"part-{index}.txt", content)) for index, content in enumerate(contents)])
+    assert result["status"] and result["files"] == 3
+
+    for index, content in enumerate(contents):
+        response = client.get(f"/api/receive/{result['code']}/{index}")
+        assert response.status_code == 200
+        assert response.content == content
+
+
+def test_unknown_fields_are_skipped(client):
+    result = post_form(
+        client,
+        [("attachment", ("skipped.txt", b"not stored")), ("file", ("kept.txt", b"stored"))],
+        {"comment": "ignored", "max_downloads": "3"},
+    )
+    assert result["status"] and result["files"] == 1 and result["max_downloads"] == 3
+
+    response = client.get(f"/api/receive/{result['code']}")
+    assert response.content == b"stored"
+    assert len(stored_blobs()) == 1
+
+
+def test_too_many_files_abort_draft(client):
+    reserved_b = transfers.space_ledger.reserved_b
+    files = [("file", (f"{index}.txt", b"x")) for index in range(transfers.MAX_FILES_PER_TRANSFER + 1)]
+    result = post_form(client, files)
+    assert result == {"status": False, "error": errors.TOO_MANY_FILES}
+    assert_draft_undone(reserved_b)
+
+
+def test_size_overflow_while_streaming(client, monkeypatch):
+    # Declared size passes (limit + multipart overhead), the file part overflows the limit.
+    monkeypatch.setattr(transfers, "MAX_TRANSFER_SIZE", 1000)
+    reserved_b = transfers.space_ledger.reserved_b
+    result = post_form(client, [("file", ("big.bin", os.urandom(4000)))])
+    assert result == {"status": False, "error": errors.SIZE_ERROR}
+    assert_draft_undone(reserved_b)
+
+
+def test_empty_form(client):
+    reserved_b = transfers.space_ledger.reserved_b
+    body = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="expire"\r\n\r\n'
+        f"1\r\n--{BOUNDARY}--\r\n"
+    ).encode()
+    response = client.post("/api/transfer", content=body, headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}"})
+    result = response.json()
+    assert result == {"status": False, "error": errors.NO_FILES}
+    assert_draft_undone(reserved_b)
+
+
+def test_client_disconnect_aborts_draft(client):
+    reserved_b = transfers.space_ledger.reserved_b
+    head = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="cut.bin"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    # Over one batch, so a member is opened and written before the client goes away.
+    messages = [
+        {"type": "http.request", "body": head + os.urandom(ingest.BATCH_SIZE + 1024), "more_body": True},
+        {"type": "http.disconnect"},
+    ]
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/api/transfer",
+        "client": ("10.0.0.5", 1234),
+        "headers": [
+            (b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode()),
+            (b"content-length", str(4 * ingest.BATCH_SIZE).encode()),
+        ],
+    }
+
+    async def receive():
+        return messages.pop(0)
+
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(ingest.receive_transfer(Request(scope, receive)))
+    assert_draft_undone(reserved_b)
@@ -0,0 +1,27 @@
+from modules import owners
+
+
+def test_delta_after_pruned_owner_returns_full_listing(monkeypatch):
+    index = owners.OwnerIndex()
+    index.rebuild([("a", 11111, {"file": "a.bin"})])
+    old_version = index.listing("a").version
+
+    index.remove(11111)
+    monkeypatch.setattr(owners, "TOMBSTONE_TTL_S", -1)
+    assert index.prune() == 1
+    index.put("a", 22222, {"file": "b.bin"})
+
+    listing = index.listing("a", old_version)
+    assert listing.removed is None  # Tombstone of 11111 is gone, delta would miss it
+    assert listing.entries == {22222: {"file": "b.bin"}}
+
+
+def test_delta_lists_removed_codes():
+    index = owners.OwnerIndex()
+    index.rebuild([("a", 11111, {"file": "a.bin"}), ("a", 22222, {"file": "b.bin"})])
+    version = index.listing("a").version
+
+    index.remove(11111)
+    listing = index.listing("a", version)
+    assert listing.removed == [11111]
+    assert listing.entries == {}
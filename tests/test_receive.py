@@ -0,0 +1,39 @@
+from modules import transfers
+
+
+def upload(client, *files: tuple[str, bytes], **fields) -> dict:
+    response = client.post(
+        "/api/transfer",
+        files=[("file", file) for file in files],
+        data={"expire": "1", **fields},
+    )
+    return response.json()
+
+
+def test_compressible_file_from_hot_cache_without_gzip(client, monkeypatch):
+    monkeypatch.setattr(transfers, "COMPRESS_AT_REST", True)
+    transfers.hot_files.configure(8 * 1024 * 1024, 64 * 1024)
+    content = b"quick share " * 100_000  # ~1.2 MB, compressed to a few KB
+    code = upload(client, ("notes.txt", content))["code"]
+
+    stored = transfers.get_shared_file(code)
+    assert stored.encoding == "gzip" and stored.get_stored_size() < 64 * 1024
+
+    # Admission goes by the original size: the decompressed body would not fit.
+    for _ in range(3):
+        response = client.get(f"/api/receive/{code}", headers={"accept-encoding": "identity"})
+        assert response.status_code == 200
+        assert response.content == content
+    assert transfers.hot_files.get(code) is None
+
+    small = b"small note " * 2000
+    code = upload(client, ("small.txt", small))["code"]
+    for _ in range(3):
+        client.get(f"/api/receive/{code}", headers={"accept-encoding": "identity"})
+    assert transfers.hot_files.get(code) is not None
+
+    response = client.get(f"/api/receive/{code}", headers={"accept-encoding": "identity"})
+    assert response.status_code == 200
+    assert response.content == small
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-length"] == str(len(small))
@@ -0,0 +1,40 @@
+import asyncio
+
+from modules import ratelimit
+from modules import scheduler
+
+
+def run_request(middleware, ip: str) -> list[dict]:
+    scope = {"type": "http", "method": "GET", "path": "/api/receive/12345", "client": (ip, 1234), "headers": []}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+def test_banned_client_does_not_take_transfer_slot():
+    limiter = ratelimit.ClientRateLimiter("test/", 1, 5, 60)
+    limiter.register_call("10.0.0.9")
+    limiter.register_call("10.0.0.9")  # Over the limit, banned
+    called = []
+
+    async def app(scope, receive, send):
+        called.append(scheduler.scheduler.active)
+
+    middleware = scheduler.TransferSchedulerMiddleware(app, limiter=limiter)
+    served = scheduler.scheduler.served
+    sent = run_request(middleware, "10.0.0.9")
+
+    assert sent[0]["status"] == 429
+    assert not called
+    assert scheduler.scheduler.served == served
+
+    run_request(middleware, "10.0.0.10")
+    assert called == [1]
+    assert scheduler.scheduler.served == served + 1
@@ -0,0 +1,100 @@
+import json
+import time
+
+import pytest
+
+from modules import transfers
+from modules import database
+from modules import errors
+
+
+def make_share(code: int) -> transfers.SharedFile:
+    now = int(time.time())
+    return transfers.SharedFile(code, "file.bin", 10, now, now + 3600, transfers.hash_ip("10.0.0.1"))
+
+
+def test_get_shared_file_sees_rows_removed_behind_cache(shares_db):
+    shares_db.insert(make_share(12345))
+    shares_db.insert(make_share(23456))
+    assert isinstance(transfers.get_shared_file(12345), transfers.SharedFile)
+    assert transfers.shared_files_cache.get(12345)[0]
+
+    # Another process rewrites shares.json without the cached row.
+    path = shares_db.filepath.path
+    with open(path, "r") as file:
+        content = json.load(file)
+    del content["12345"]
+    with open(path, "w") as file:
+        json.dump(content, file)
+
+    assert transfers.get_shared_file(12345) == errors.INVALID_CODE
+    assert isinstance(transfers.get_shared_file(23456), transfers.SharedFile)
+
+
+def fill_checked_codes(monkeypatch, free: int | None = None) -> None:
+    monkeypatch.setattr(transfers, "CHECKED_CODES", True)
+    transfers.sync_live_codes()
+    for base in transfers.codes.CHECKED_BASE_RANGE:
+        code = transfers.codes.make_checked_code(base)
+        if code != free:
+            transfers.live_codes.add(code)
+
+
+def test_generate_transfer_code_at_full_occupancy(shares_db, monkeypatch):
+    fill_checked_codes(monkeypatch)
+    assert transfers.generate_transfer_code() is None
+
+
+def test_generate_transfer_code_finds_last_free_code(shares_db, monkeypatch):
+    free = transfers.codes.make_checked_code(4321)
+    fill_checked_codes(monkeypatch, free)
+    assert transfers.generate_transfer_code() == free
+    assert transfers.generate_transfer_code() is None
+
+
+def test_begin_without_free_code_releases_reservation(shares_db, monkeypatch):
+    monkeypatch.setenv("MAX_SHARES_PER_IP", "5")
+    monkeypatch.setenv("MAX_DATA_SIZE_MB", "1024")
+    fill_checked_codes(monkeypatch)
+    reserved_b = transfers.space_ledger.reserved_b
+
+    assert transfers.TransferDraft.begin("10.0.0.1", 100) == errors.NO_CODES_AVAILABLE
+    assert transfers.space_ledger.reserved_b == reserved_b
+
+
+def rewrite_shares_file(shares_db) -> None:
+    """ Write shares.json as another process would, so the table is reloaded. """
+    path = shares_db.filepath.path
+    with open(path, "r") as file:
+        content = json.load(file)
+    with open(path, "w") as file:
+        json.dump(content, file)
+        file.write(" ")
+
+
+def test_reserved_code_survives_reload(shares_db, monkeypatch):
+    monkeypatch.setenv("MAX_SHARES_PER_IP", "5")
+    monkeypatch.setenv("MAX_DATA_SIZE_MB", "1024")
+    shares_db.insert(make_share(12345))
+    draft = transfers.TransferDraft.begin("10.0.0.1", 100)
+
+    rewrite_shares_file(shares_db)
+    transfers.sync_live_codes()
+    assert transfers.live_codes.contains(draft.code)
+    assert transfers.reserve_code(draft.code) is None
+
+    draft.abort()
+    assert not transfers.live_codes.contains(draft.code)
+    rewrite_shares_file(shares_db)
+    transfers.sync_live_codes()
+    assert not transfers.live_codes.contains(draft.code)
+
+
+def test_insert_refuses_existing_key(shares_db):
+    shares_db.insert(make_share(12345))
+    duplicate = make_share(12345)
+    duplicate.name = "other.bin"
+
+    with pytest.raises(database.KeyAlreadyExists):
+        shares_db.insert(duplicate)
+    assert shares_db.get("12345").name == "file.bin"
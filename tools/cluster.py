@@ -0,0 +1,146 @@
+"""
+Module: cluster.py
+
+Description:
+    Local multi-node cluster for development and testing.
+
+    Starts `--nodes` sandboxes (see tools/sandbox.py), each with it's own data/
+    directory and uvicorn process on consecutive ports, all sharing one
+    CLUSTER_NODES member list. With --check a smoke test uploads through every
+    node, downloads every code through every node and deletes through a node
+    which does not own the code, then prints a JSON summary.
+
+Usage:
+    python -m tools.cluster --nodes 3 --base-port 18500 --check
+    python -m tools.cluster --nodes 3 --routing redirect        # keep running until Ctrl+C
+"""
+from tools.sandbox import create_sandbox, REPO_ROOT
+
+import http.client
+import argparse
+import time
+import json
+import os
+
+
+def build_nodes(count: int, base_port: int) -> dict[str, int]:
+    return {f"node{index + 1}": base_port + index for index in range(count)}
+
+
+def format_members(nodes: dict[str, int]) -> str:
+    return ",".join(f"{node_id}=http://127.0.0.1:{port}" for node_id, port in nodes.items())
+
+
+def request(port: int, method: str, path: str, client_ip: str, body: bytes = None, headers: dict = None) -> tuple[int, dict, bytes]:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        connection.request(method, path, body=body, headers={"X-Forwarded-For": client_ip, **(headers or {})})
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def upload(port: int, client_ip: str, content: bytes) -> int:
+    boundary = "quickshclustercheck"
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="check.bin"\r\n\r\n'.encode()
+        + content
+        + f'\r\n--{boundary}\r\nContent-Disposition: form-data; name="expire"\r\n\r\n0\r\n--{boundary}--\r\n'.encode()
+    )
+    status, _, response = request(port, "POST", "/api/transfer", client_ip, body, {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    if status != 200:
+        raise RuntimeError(f"upload to port {port} failed: {status} {response[:200]!r}")
+    return json.loads(response)["code"]
+
+
+def follow(port: int, method: str, path: str, client_ip: str) -> tuple[int, bytes]:
+    """ Request path, following a single cluster redirect. """
+    status, headers, body = request(port, method, path, client_ip)
+    location = headers.get("location")
+    if status == 307 and location:
+        status, _, body = request(int(location.split(":")[2].split("/")[0]), method, path, client_ip)
+    return status, body
+
+
+def run_check(nodes: dict[str, int]) -> dict:
+    client_ip = "10.200.0.1"
+    contents = {}
+    uploads = {}
+    for node_id, port in nodes.items():
+        content = os.urandom(64 * 1024)
+        code = upload(port, client_ip, content)
+        contents[code] = content
+        uploads[node_id] = code
+
+    receive_failures = []
+    for code, content in contents.items():
+        for node_id, port in nodes.items():
+            status, body = follow(port, "GET", f"/api/receive/{code}", client_ip)
+            if status != 200 or body != content:
+                receive_failures.append({"code": code, "via": node_id, "status": status})
+
+    _, _, owned = request(next(iter(nodes.values())), "GET", "/api/owned-codes", client_ip)
+    owned_codes = sorted(int(code) for code in json.loads(owned)["response"])
+
+    delete_statuses = {}
+    ports = list(nodes.values())
+    for index, (node_id, code) in enumerate(uploads.items()):
+        via = ports[(index + 1) % len(ports)]
+        status, _ = follow(via, "DELETE", f"/api/delete/{code}", client_ip)
+        gone_status, _ = follow(via, "GET", f"/api/receive/{code}", client_ip)
+        delete_statuses[code] = {"delete": status, "receive_after": gone_status}
+
+    return {
+        "uploads": uploads,
+        "receive_failures": receive_failures,
+        "owned_codes_complete": owned_codes == sorted(contents),
+        "deletes": delete_statuses,
+        "ok": not receive_failures
+            and owned_codes == sorted(contents)
+            and all(result == {"delete": 200, "receive_after": 400} for result in delete_statuses.values()),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="run a local quicksh cluster")
+    parser.add_argument("--source", default=REPO_ROOT, help="source tree to run (default: this repo)")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=18500)
+    parser.add_argument("--routing", choices=("proxy", "redirect"), default="proxy")
+    parser.add_argument("--check", action="store_true", help="run smoke test and exit")
+    parser.add_argument("--keep", action="store_true", help="keep sandboxes for inspection")
+    args = parser.parse_args()
+
+    nodes = build_nodes(args.nodes, args.base_port)
+    members = format_members(nodes)
+    sandboxes = []
+    try:
+        for node_id, port in nodes.items():
+            sandbox = create_sandbox(args.source, shares=0, hot_shares=0)
+            sandbox.launch(port, {
+                "CLUSTER_NODES": members,
+                "CLUSTER_NODE_ID": node_id,
+                "CLUSTER_ROUTING": args.routing,
+            })
+            sandboxes.append(sandbox)
+            print(f"{node_id}: http://127.0.0.1:{port} ({sandbox.root})")
+
+        if args.check:
+            print(json.dumps(run_check(nodes), indent=2))
+            return
+
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for sandbox in sandboxes:
+            if args.keep:
+                sandbox.stop()
+            else:
+                sandbox.remove()
+
+
+if __name__ == "__main__":
+    main()
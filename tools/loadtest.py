@@ -0,0 +1,363 @@
+"""
+Module: loadtest.py
+
+Description:
+    End-to-end HTTP load harness for the quicksh API.
+
+    For every requested table size a fresh sandbox (see tools/sandbox.py) is created,
+    pre-populated with synthetic shares and served by uvicorn on localhost.
+    A pool of client threads then drives a weighted mix of:
+        landing   GET    /
+        receive   GET    /api/receive/{code}
+        owned     GET    /api/owned-codes
+        transfer  POST   /api/transfer
+        delete    DELETE /api/delete/{code}
+
+    Requests carry X-Forwarded-For addresses from a large synthetic pool so the
+    per-IP rate limiters and share quotas behave as with real traffic.
+
+    Output (JSON) contains per endpoint: count, errors, status codes, throughput,
+    p50/p95/p99/max latency and server peak RSS observed while the endpoint was in flight.
+
+Usage:
+    python -m tools.loadtest --shares 1000 10000 80000 --concurrency 16 --duration 30 --output bench.json
+    python -m tools.loadtest --source ../quicksh-release --baseline bench.json
+"""
+from tools.sandbox import create_sandbox, read_rss, REPO_ROOT
+
+from dataclasses import dataclass, field
+import http.client
+import subprocess
+import threading
+import argparse
+import platform
+import random
+import time
+import json
+import uuid
+import sys
+import os
+
+
+ENDPOINTS = ("landing", "receive", "owned", "transfer", "delete")
+DEFAULT_MIX = "landing=15,receive=50,owned=20,transfer=10,delete=5"
+DEFAULT_UPLOAD_SIZES = "1k,64k,1m,8m"
+SIZE_UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+RSS_SAMPLE_INTERVAL_S = 0.05
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    if text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def parse_mix(text: str) -> dict[str, int]:
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"unknown endpoint in mix: {name}")
+        mix[name] = int(weight)
+    return mix
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """ Nearest-rank percentile of already sorted values. """
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(fraction * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def git_revision(source: str) -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=source, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@dataclass
+class EndpointStats:
+    latencies: list[float] = field(default_factory=list)
+    statuses: dict[int, int] = field(default_factory=dict)
+    errors: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    in_flight: int = 0
+    peak_rss_b: int = 0
+
+    def summary(self, wall_s: float) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "count": len(latencies),
+            "errors": self.errors,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "throughput_rps": round(len(latencies) / wall_s, 2) if wall_s else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "peak_rss_b": self.peak_rss_b,
+        }
+
+
+class Workload:
+    """ Shared state of one run: owned codes, stats and RSS sampler. """
+
+    def __init__(self, sandbox, mix: dict[str, int], upload_sizes: list[int], seed: int) -> None:
+        self.sandbox = sandbox
+        self.mix_names = list(mix.keys())
+        self.mix_weights = list(mix.values())
+        self.upload_sizes = upload_sizes
+        self.seed = seed
+
+        self.lock = threading.Lock()
+        self.stats = {name: EndpointStats() for name in ENDPOINTS}
+        self.peak_rss_b = 0
+
+        hot = set(sandbox.hot_codes)
+        self.owners = sorted({share.owner for share in sandbox.shares})
+        self.deletable = [(share.code, share.owner) for share in sandbox.shares if share.code not in hot]
+        random.Random(seed).shuffle(self.deletable)
+        self.client_counter = 0
+
+        self.upload_bodies = {size: os.urandom(size) for size in upload_sizes}
+
+    def next_client_ip(self) -> str:
+        """ Fresh address for anonymous calls (keeps rate limiter and quotas out of the way). """
+        with self.lock:
+            self.client_counter += 1
+            index = self.client_counter
+        return f"172.{16 + (index >> 16) % 16}.{(index >> 8) & 255}.{index & 255}"
+
+    def sample_rss(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            rss = read_rss(self.sandbox.process.pid)
+            with self.lock:
+                self.peak_rss_b = max(self.peak_rss_b, rss)
+                for stats in self.stats.values():
+                    if stats.in_flight:
+                        stats.peak_rss_b = max(stats.peak_rss_b, rss)
+            stop.wait(RSS_SAMPLE_INTERVAL_S)
+
+    def build_request(self, name: str, rng: random.Random) -> tuple[str, str, bytes | None, dict[str, str]]:
+        """ Returns (method, url, body, headers) for endpoint `name`. """
+        headers = {"X-Forwarded-For": self.next_client_ip()}
+
+        if name == "landing":
+            return "GET", "/", None, headers
+
+        if name == "receive":
+            code = rng.choice(self.sandbox.hot_codes)
+            return "GET", f"/api/receive/{code}", None, headers
+
+        if name == "owned":
+            headers["X-Forwarded-For"] = rng.choice(self.owners)
+            return "GET", "/api/owned-codes", None, headers
+
+        if name == "delete":
+            with self.lock:
+                target = self.deletable.pop() if self.deletable else None
+            if target is not None:
+                code, owner = target
+                headers["X-Forwarded-For"] = owner
+                return "DELETE", f"/api/delete/{code}", None, headers
+            name = "transfer"
+
+        size = rng.choice(self.upload_sizes)
+        boundary = uuid.uuid4().hex
+        body = b"".join((
+            f"--{boundary}\r\n".encode(),
+            f'Content-Disposition: form-data; name="file"; filename="load-{size}.bin"\r\n'.encode(),
+            b"Content-Type: application/octet-stream\r\n\r\n",
+            self.upload_bodies[size],
+            f"\r\n--{boundary}\r\n".encode(),
+            b'Content-Disposition: form-data; name="expire"\r\n\r\n',
+            b"0",
+            f"\r\n--{boundary}--\r\n".encode(),
+        ))
+        headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+        return "POST", "/api/transfer", body, headers
+
+    def on_transfer_response(self, payload: bytes, client_ip: str) -> None:
+        """ Successfully uploaded codes become delete candidates. """
+        try:
+            result = json.loads(payload)
+        except ValueError:
+            return
+        if result.get("status"):
+            with self.lock:
+                self.deletable.append((result["code"], client_ip))
+
+    def worker(self, worker_id: int, deadline: float) -> None:
+        rng = random.Random(self.seed * 1000 + worker_id)
+        connection = http.client.HTTPConnection("127.0.0.1", self.sandbox.port, timeout=60)
+
+        while time.monotonic() < deadline:
+            name = rng.choices(self.mix_names, self.mix_weights)[0]
+            method, url, body, headers = self.build_request(name, rng)
+            if method == "POST":
+                name = "transfer"
+            stats = self.stats[name]
+
+            with self.lock:
+                stats.in_flight += 1
+            started = time.perf_counter()
+            try:
+                connection.request(method, url, body=body, headers=headers)
+                response = connection.getresponse()
+                payload = response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", self.sandbox.port, timeout=60)
+                with self.lock:
+                    stats.in_flight -= 1
+                    stats.errors += 1
+                continue
+            elapsed = time.perf_counter() - started
+
+            with self.lock:
+                stats.in_flight -= 1
+                stats.latencies.append(elapsed)
+                stats.statuses[status] = stats.statuses.get(status, 0) + 1
+                stats.bytes_sent += len(body or b"")
+                stats.bytes_received += len(payload)
+                if status >= 500:
+                    stats.errors += 1
+
+            if name == "transfer" and status == 200:
+                self.on_transfer_response(payload, headers["X-Forwarded-For"])
+
+        connection.close()
+
+
+def run_once(args: argparse.Namespace, shares: int) -> dict:
+    sandbox = create_sandbox(args.source, shares, args.hot_shares, parse_size(args.hot_size), seed=args.seed)
+    try:
+        started = time.perf_counter()
+        sandbox.launch(args.port)
+        startup_s = time.perf_counter() - started
+        idle_rss_b = read_rss(sandbox.process.pid)
+
+        workload = Workload(
+            sandbox,
+            parse_mix(args.mix),
+            [parse_size(size) for size in args.upload_sizes.split(",")],
+            args.seed
+        )
+
+        stop_sampling = threading.Event()
+        sampler = threading.Thread(target=workload.sample_rss, args=(stop_sampling,), daemon=True)
+        sampler.start()
+
+        deadline = time.monotonic() + args.duration
+        wall_started = time.perf_counter()
+        workers = [
+            threading.Thread(target=workload.worker, args=(worker_id, deadline), daemon=True)
+            for worker_id in range(args.concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        wall_s = time.perf_counter() - wall_started
+
+        stop_sampling.set()
+        sampler.join()
+
+        endpoints = {name: stats.summary(wall_s) for name, stats in workload.stats.items() if stats.latencies or stats.errors}
+        total = sum(len(stats.latencies) for stats in workload.stats.values())
+        return {
+            "shares": shares,
+            "startup_s": round(startup_s, 3),
+            "wall_s": round(wall_s, 3),
+            "total_requests": total,
+            "throughput_rps": round(total / wall_s, 2) if wall_s else 0.0,
+            "idle_rss_b": idle_rss_b,
+            "peak_rss_b": workload.peak_rss_b,
+            "endpoints": endpoints,
+        }
+
+    finally:
+        if args.keep:
+            sandbox.stop()
+            print(f"sandbox kept at: {sandbox.root}", file=sys.stderr)
+        else:
+            sandbox.remove()
+
+
+def attach_baseline(report: dict, baseline: dict) -> None:
+    """ Add per-endpoint deltas (current - baseline) for runs with matching table size. """
+    baseline_runs = {run["shares"]: run for run in baseline.get("runs", [])}
+    for run in report["runs"]:
+        previous = baseline_runs.get(run["shares"])
+        if previous is None:
+            continue
+
+        deltas = {}
+        for name, current in run["endpoints"].items():
+            before = previous["endpoints"].get(name)
+            if before is None:
+                continue
+            deltas[name] = {
+                metric: round(current[metric] - before[metric], 3)
+                for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "peak_rss_b")
+            }
+        run["baseline_delta"] = deltas
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="quicksh end-to-end load test")
+    parser.add_argument("--source", default=REPO_ROOT, help="source tree to benchmark (default: this repo)")
+    parser.add_argument("--shares", type=int, nargs="+", default=[1000, 10000, 80000], help="pre-populated table sizes")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load per table size")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--upload-sizes", default=DEFAULT_UPLOAD_SIZES, help="comma separated upload sizes")
+    parser.add_argument("--hot-shares", type=int, default=100, help="shares with real content used by receive")
+    parser.add_argument("--hot-size", default="64k", help="size of hot shares")
+    parser.add_argument("--port", type=int, default=18420)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="previous JSON report to diff against")
+    parser.add_argument("--keep", action="store_true", help="keep sandboxes for inspection")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "source": os.path.abspath(args.source),
+            "revision": git_revision(args.source),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "mix": parse_mix(args.mix),
+            "upload_sizes": args.upload_sizes.split(","),
+            "started": int(time.time()),
+        },
+        "runs": [],
+    }
+
+    for shares in args.shares:
+        print(f"running: {shares} shares, {args.concurrency} clients, {args.duration}s", file=sys.stderr)
+        report["runs"].append(run_once(args, shares))
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf8") as baseline_file:
+            attach_baseline(report, json.load(baseline_file))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
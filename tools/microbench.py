@@ -0,0 +1,340 @@
+"""
+Module: microbench.py
+
+Description:
+    Microbenchmarks for the primitives the request hot paths rest on:
+        - database.Database insert/get/update/delete/get_all_models
+        - database.parse_key_provider, database.Column.prepare_value
+        - paths.Path construction, "/" joins, save_json_content/get_json_content
+        - transfers.generate_transfer_code at growing code space occupancy
+        - ratelimit.ClientRateLimiter.register_call with many known clients
+
+    Every size-dependent benchmark is measured at several sizes. For each curve the
+    per-operation cost exponent is fitted on a log-log scale:
+        ~0 -> O(1) per op, ~1 -> O(n) per op (quadratic for n ops), ~2 -> O(n^2) per op.
+    Curves growing faster than their expected complexity (O(1) for point operations,
+    O(n) for full scans) are flagged as superlinear.
+
+    Benchmarks run inside a sandbox working directory, so ./data/ and ./logs/
+    of the repository are never touched.
+
+Usage:
+    python -m tools.microbench --sizes 100 1000 10000 --output micro.json
+    python -m tools.microbench --only database paths
+"""
+from tools.sandbox import create_sandbox, REPO_ROOT
+
+import contextlib
+import inspect
+import argparse
+import platform
+import random
+import math
+import time
+import json
+import sys
+import os
+
+
+DEFAULT_SIZES = [100, 1000, 5000, 20000]
+OCCUPANCY_LEVELS = [0.1, 0.5, 0.75, 0.9]
+RATELIMIT_CLIENTS = [100, 1000, 10000, 100000]
+BENCH_GROUPS = ("database", "keys", "columns", "paths", "json", "codes", "ratelimit")
+SUPERLINEAR_EXPONENT = 0.5
+
+
+def measure(operation, budget_s: float, max_reps: int = 100_000) -> dict:
+    """
+    Call operation(i) repeatedly within roughly budget_s seconds.
+    Returns per-op time in microseconds (mean and best of batches).
+    """
+    started = time.perf_counter()
+    operation(0)
+    first = time.perf_counter() - started
+
+    reps = int(max(3, min(max_reps, budget_s / max(first, 1e-7))))
+    batches = min(5, reps)
+    per_batch = max(1, reps // batches)
+    timings = []
+    index = 1
+    for _ in range(batches):
+        started = time.perf_counter()
+        for _ in range(per_batch):
+            operation(index)
+            index += 1
+        timings.append((time.perf_counter() - started) / per_batch)
+
+    return {
+        "reps": per_batch * batches,
+        "mean_us": round(sum(timings) / len(timings) * 1e6, 3),
+        "best_us": round(min(timings) * 1e6, 3),
+    }
+
+
+def fit_exponent(points: list[dict]) -> float | None:
+    """ Least squares slope of log(best_us) over log(n). """
+    xs = [math.log(p["n"]) for p in points if p["best_us"] > 0]
+    ys = [math.log(p["best_us"]) for p in points if p["best_us"] > 0]
+    if len(xs) < 2:
+        return None
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if not variance:
+        return None
+    return round(sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance, 3)
+
+
+def complexity_label(exponent: float | None) -> str:
+    if exponent is None:
+        return "n/a"
+    return ("O(1)", "O(n)", "O(n^2)", "O(n^3)")[min(3, max(0, round(exponent)))] + " per op"
+
+
+class Bench:
+    """ Collects curves: name -> [{n, reps, mean_us, best_us}, ...] """
+
+    def __init__(self, budget_s: float) -> None:
+        self.budget_s = budget_s
+        self.curves: dict[str, list[dict]] = {}
+        self.expected: dict[str, int] = {}
+
+    def point(self, name: str, n: int, operation, max_reps: int = 100_000, expected: int = 0) -> None:
+        """ Measure one point of curve `name`. `expected` is the per-op exponent considered healthy. """
+        result = measure(operation, self.budget_s, max_reps)
+        result["n"] = n
+        self.curves.setdefault(name, []).append(result)
+        self.expected[name] = expected
+        print(f"  {name:<38} n={n:<7} {result['best_us']:>12.2f} us/op", file=sys.stderr)
+
+    def report(self) -> dict:
+        report = {}
+        for name, points in self.curves.items():
+            exponent = fit_exponent(points) if len(points) > 1 else None
+            expected = self.expected[name]
+            report[name] = {
+                "points": points,
+                "exponent": exponent,
+                "complexity": complexity_label(exponent),
+                "expected": complexity_label(expected),
+                "superlinear": exponent is not None and exponent > expected + SUPERLINEAR_EXPONENT,
+            }
+        return report
+
+
+def synthetic_row(code: int, now: int) -> dict:
+    return {
+        "code": code,
+        "name": f"file-{code}.bin",
+        "size": code * 7,
+        "date_created": now,
+        "date_expire": now + 3600,
+        "owner_ip": f"{code:064x}",
+    }
+
+
+def make_database(size: int):
+    """ Fresh Database with SharedFile's columns and `size` rows. """
+    from modules import database
+    from modules.paths import Path
+
+    name = f"bench_{size}_{random.getrandbits(32):08x}"
+    file_path = Path("./data/") / name + ".json"
+    now = int(time.time())
+    file_path.touch()
+    file_path.save_json_content({str(code): synthetic_row(code, now) for code in range(10000, 10000 + size)})
+
+    @database.DBModel.model(name, "!code", file_path=file_path)
+    class BenchRow:
+        code: int
+        name: str
+        size: int
+        date_created: int
+        date_expire: int
+        owner_ip: str
+
+    return BenchRow, database.Database[BenchRow](BenchRow)
+
+
+def bench_database(bench: Bench, sizes: list[int]) -> None:
+    now = int(time.time())
+    for size in sizes:
+        model, db = make_database(size)
+        keys = [str(code) for code in range(10000, 10000 + size)]
+        rng = random.Random(size)
+        fresh_code = 10000 + size
+
+        def insert(i):
+            db.insert(model(**synthetic_row(fresh_code + i, now)))
+
+        bench.point("database.insert", size, insert)
+        for i in range(len(db.get_all_keys()) - size):
+            db.delete(str(fresh_code + i))
+
+        bench.point("database.get", size, lambda i: db.get(rng.choice(keys)))
+        bench.point("database.update", size, lambda i: db.update(rng.choice(keys), {"name": f"renamed-{i}"}))
+
+        def delete_and_restore(i):
+            key = keys[i % size]
+            row = db.get(key)
+            db.delete(key)
+            db.insert(row)
+
+        bench.point("database.delete+insert", size, delete_and_restore)
+        bench.point("database.get_all_models", size, lambda i: db.get_all_models(), expected=1)
+        bench.point("database.get_all_keys", size, lambda i: db.get_all_keys(), expected=1)
+
+
+def bench_keys(bench: Bench) -> None:
+    from modules import database
+
+    _, db = make_database(1)
+    row = db.get("10000")
+    providers = {
+        "!code": "!code",
+        "code+name": "!code+name",
+        "sha1(owner_ip)": "owner_ip",
+        "uuid4": database.KEY_AS_UUID4,
+        "exact": database.EXACT_KEY("key"),
+    }
+    for label, provider in providers.items():
+        bench.point(f"parse_key_provider[{label}]", 1, lambda i: database.parse_key_provider(provider, row))
+
+
+def bench_columns(bench: Bench) -> None:
+    from modules import database
+
+    int_column = database.Column("size", int)
+    str_column = database.Column("name", str, "default")
+    bench.point("Column.prepare_value[int]", 1, lambda i: int_column.prepare_value(i))
+    bench.point("Column.prepare_value[str->int]", 1, lambda i: int_column.prepare_value("12345"))
+    bench.point("Column.prepare_value[None]", 1, lambda i: str_column.prepare_value(None))
+
+
+def bench_paths(bench: Bench) -> None:
+    from modules.paths import Path
+    from modules import paths
+
+    os.makedirs("./data/shared", exist_ok=True)
+    open("./data/shared/12345", "wb").close()
+    modes = [("eager", {})]
+    if "lazy" in inspect.signature(Path).parameters:
+        modes.append(("lazy", {"lazy": True}))
+
+    for mode, kwargs in modes:
+        base = Path("./data/shared/", **kwargs)
+
+        bench.point(f"Path()[{mode}, existing dir]", 1, lambda i: Path("./data/shared/", **kwargs))
+        bench.point(f"Path()[{mode}, existing file]", 1, lambda i: Path("./data/shared/12345", **kwargs))
+        bench.point(f"Path()[{mode}, missing]", 1, lambda i: Path("./data/shared/missing", **kwargs))
+        bench.point(f"Path / str[{mode}]", 1, lambda i: base / "12345")
+        bench.point(f"Path + str[{mode}]", 1, lambda i: base + "12345")
+        bench.point(f"Path.exists[{mode}]", 1, lambda i: (base / "12345").exists())
+        bench.point(f"Path.get_size[{mode}]", 1, lambda i: (base / "12345").get_size())
+
+    if hasattr(paths, "enable_stat_cache"):
+        paths.enable_stat_cache(1.0)
+        cached = Path("./data/shared/12345", lazy=True)
+        bench.point("Path.exists[stat cache]", 1, lambda i: cached.exists())
+        bench.point("Path.get_size[stat cache]", 1, lambda i: cached.get_size())
+        paths.disable_stat_cache()
+
+
+def bench_json(bench: Bench, sizes: list[int]) -> None:
+    from modules.paths import Path
+
+    now = int(time.time())
+    for size in sizes:
+        path = Path("./data/") / f"json_{size}.json"
+        path.touch()
+        content = {str(code): synthetic_row(code, now) for code in range(10000, 10000 + size)}
+        bench.point("Path.save_json_content", size, lambda i: path.save_json_content(content), expected=1)
+        bench.point("Path.get_json_content", size, lambda i: path.get_json_content(), expected=1)
+
+
+def bench_codes(bench: Bench) -> None:
+    from modules import transfers
+
+    code_space = list(range(10000, 99999))
+    now = int(time.time())
+    for occupancy in OCCUPANCY_LEVELS:
+        occupied = random.Random(0).sample(code_space, int(len(code_space) * occupancy))
+        transfers.transfers_db.filepath.save_json_content({str(code): synthetic_row(code, now) for code in occupied})
+        bench.point("generate_transfer_code", len(occupied), lambda i: transfers.generate_transfer_code(), max_reps=200)
+
+    transfers.transfers_db.filepath.save_json_content({})
+
+
+def bench_ratelimit(bench: Bench) -> None:
+    from modules import ratelimit
+
+    for clients in RATELIMIT_CLIENTS:
+        limiter = ratelimit.ClientRateLimiter("bench/", 10 ** 9, 5, 1)
+        for client in range(clients):
+            limiter.register_call(f"client-{client}")
+        rng = random.Random(clients)
+        bench.point("ClientRateLimiter.register_call", clients, lambda i: limiter.register_call(f"client-{rng.randrange(clients)}"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="quicksh storage-layer microbenchmarks")
+    parser.add_argument("--source", default=REPO_ROOT, help="source tree to benchmark (default: this repo)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="table sizes for database/json curves")
+    parser.add_argument("--budget", type=float, default=0.3, help="seconds spent per measured point")
+    parser.add_argument("--only", nargs="+", choices=BENCH_GROUPS, help="run selected groups only")
+    parser.add_argument("--output", help="write JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    groups = args.only or BENCH_GROUPS
+    sandbox = create_sandbox(args.source, shares=0)
+    os.environ.setdefault("MAX_DATA_SIZE_MB", str(1024 * 1024))
+    os.environ.setdefault("MAX_SHARES_PER_IP", "5")
+    sys.path.insert(0, os.path.abspath(args.source))
+    os.chdir(sandbox.root)
+
+    bench = Bench(args.budget)
+    try:
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+            if "database" in groups:
+                bench_database(bench, args.sizes)
+            if "keys" in groups:
+                bench_keys(bench)
+            if "columns" in groups:
+                bench_columns(bench)
+            if "paths" in groups:
+                bench_paths(bench)
+            if "json" in groups:
+                bench_json(bench, args.sizes)
+            if "codes" in groups:
+                bench_codes(bench)
+            if "ratelimit" in groups:
+                bench_ratelimit(bench)
+    finally:
+        os.chdir(REPO_ROOT)
+        sandbox.remove()
+
+    curves = bench.report()
+    for name, curve in curves.items():
+        if curve["superlinear"]:
+            print(f"  ! {name}: per-op cost grows as n^{curve['exponent']} ({curve['complexity']})", file=sys.stderr)
+
+    output = json.dumps({
+        "meta": {
+            "source": os.path.abspath(args.source),
+            "python": platform.python_version(),
+            "sizes": args.sizes,
+            "budget_s": args.budget,
+            "started": int(time.time()),
+        },
+        "curves": curves,
+    }, indent=2)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+"""
+Module: replay.py
+
+Description:
+    Replay of recorded production traffic (see modules/recorder.py) against local builds.
+
+    The recording is turned into a synthetic data/ directory: every code which was
+    successfully accessed before it was created in the recording becomes a share with
+    the recorded size (shares deleted by a client are owned by that client), codes
+    which never resolved stay unknown (scanners), codes created by recorded uploads
+    are resolved from the replayed uploads' responses. --shares adds background rows.
+    Clients get stable synthetic addresses, so rate limits and quotas apply per client
+    as they did when recording. Uploads send random content of the recorded size.
+
+    Requests are issued at their recorded offsets divided by --speed (0 = as fast as
+    --concurrency allows). Report contains per route: count, throughput, p50/p95/p99,
+    statuses, share of statuses matching the recording and dispatch lag (how late
+    requests were sent, grows once the client side is saturated). With --compare the
+    same recording is replayed against a second source tree on an identical sandbox
+    and per-route deltas (compare - source) are added, --baseline diffs against a
+    previous report instead.
+
+Usage:
+    python -m tools.replay logs/traffic-20260101-120000.jsonl --speed 4 --output replay.json
+    python -m tools.replay traffic.jsonl --source ../quicksh-release --compare . --speed 0
+"""
+from tools.sandbox import create_sandbox, owner_ip, REPO_ROOT, CODES_RANGE, SHARES_PER_OWNER
+from tools.loadtest import EndpointStats, percentile, git_revision
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import http.client
+import threading
+import argparse
+import platform
+import random
+import time
+import json
+import uuid
+import sys
+import os
+
+
+FORMAT_VERSION = 1
+CODE_ROUTES = ("/{code}", "/api/receive/{code}", "/api/receive/{code}/{index}", "/api/delete/{code}")
+RECEIVE_ROUTE = "/api/receive/{code}"
+DELETE_ROUTE = "/api/delete/{code}"
+TRANSFER_ROUTE = "/api/transfer"
+PREFLIGHT_ROUTE = "/api/transfer/preflight"
+CREATING_ROUTES = (TRANSFER_ROUTE, PREFLIGHT_ROUTE)
+RESOLVE_TIMEOUT_S = 60.0
+DELTA_METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "status_match")
+
+
+@dataclass
+class Entry:
+    offset_s: float
+    method: str
+    route: str
+    params: dict
+    status: int
+    request_b: int
+    response_b: int
+    duration_s: float
+    client: str
+    extra: dict
+
+
+def load_recording(path: str) -> tuple[dict, list[Entry]]:
+    """ Header and entries of recording, sorted by offset. Malformed lines are skipped. """
+    header = {}
+    entries = []
+    with open(path, "r", encoding="utf8") as recording:
+        for line in recording:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(item, dict):
+                header = item
+                continue
+            if not isinstance(item, list) or len(item) != 10:
+                continue
+            offset_ms, method, route, params, status, request_b, response_b, duration_ms, client, extra = item
+            entries.append(Entry(offset_ms / 1000, method, route, params, status, request_b, response_b, duration_ms / 1000, client, extra))
+
+    if header.get("version", FORMAT_VERSION) != FORMAT_VERSION:
+        raise ValueError(f"unsupported recording version: {header.get('version')}")
+    entries.sort(key=lambda entry: entry.offset_s)
+    return header, entries
+
+
+@dataclass
+class Plan:
+    """ Synthetic data layout derived from a recording. """
+    sizes: list[int] = field(default_factory=list)  # Blob size of the first sandbox rows
+    existing: dict[str, int] = field(default_factory=dict)  # code token: sandbox row index
+    owners: dict[str, int] = field(default_factory=dict)  # client token: sandbox row index of owned group
+    created: set[str] = field(default_factory=set)  # code tokens created by recorded uploads
+
+
+def build_plan(entries: list[Entry]) -> Plan:
+    plan = Plan()
+    created: set[str] = set()
+    referenced: dict[str, dict] = {}  # code token: {"live", "size", "owner"}, in order of first use
+
+    for entry in entries:
+        if entry.route in CREATING_ROUTES and entry.status == 200 and "code" in entry.extra:
+            created.add(entry.extra["code"])
+        token = entry.params.get("code")
+        if entry.route not in CODE_ROUTES or token is None or token in created:
+            continue
+
+        info = referenced.setdefault(token, {"live": False, "size": 0, "owner": None})
+        if entry.status == 200:
+            info["live"] = True
+            if entry.route == RECEIVE_ROUTE:
+                info["size"] = max(info["size"], entry.response_b)
+            if entry.route == DELETE_ROUTE:
+                info["owner"] = entry.client
+
+    # Shares deleted by the same client go into the same owner group of the sandbox.
+    by_owner: dict[str | None, list[str]] = {}
+    for token, info in referenced.items():
+        if info["live"]:
+            by_owner.setdefault(info["owner"], []).append(token)
+
+    for owner, tokens in sorted(by_owner.items(), key=lambda item: item[0] is None):
+        if owner is not None:
+            while len(plan.sizes) % SHARES_PER_OWNER:
+                plan.sizes.append(0)
+            plan.owners[owner] = len(plan.sizes)
+        for token in tokens:
+            plan.existing[token] = len(plan.sizes)
+            plan.sizes.append(referenced[token]["size"])
+
+    plan.created = created
+    return plan
+
+
+def build_form(sizes: list[int], expire: int, max_downloads: int, content: bytes) -> tuple[bytes, str]:
+    """ Multipart upload form with files of given sizes. Returns (body, content type). """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for index, size in enumerate(sizes):
+        parts += [
+            f"--{boundary}\r\n".encode(),
+            f'Content-Disposition: form-data; name="file"; filename="replay-{index}.bin"\r\n'.encode(),
+            b"Content-Type: application/octet-stream\r\n\r\n",
+            content[:size],
+            b"\r\n",
+        ]
+    for name, value in (("expire", expire), ("max_downloads", max_downloads)):
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Resolver:
+    """ Values (codes, upload tokens) known only once a replayed request is answered. """
+
+    def __init__(self) -> None:
+        self._values: dict[str, object] = {}
+        self._events: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def __event(self, key: str) -> threading.Event:
+        with self._lock:
+            return self._events.setdefault(key, threading.Event())
+
+    def resolve(self, key: str, value) -> None:
+        self._values[key] = value
+        self.__event(key).set()
+
+    def wait(self, key: str, timeout: float = RESOLVE_TIMEOUT_S):
+        self.__event(key).wait(timeout)
+        return self._values.get(key)
+
+
+class Replayer:
+    """ State of one replay run against a launched sandbox. """
+
+    def __init__(self, sandbox, plan: Plan, entries: list[Entry], speed: float, seed: int) -> None:
+        self.sandbox = sandbox
+        self.plan = plan
+        self.entries = entries
+        self.speed = speed
+
+        self.lock = threading.Lock()
+        self.stats: dict[str, EndpointStats] = {}
+        self.matched: dict[str, int] = {}
+        self.lags: list[float] = []
+        self.skipped = 0
+
+        self.codes = {token: sandbox.shares[index].code for token, index in plan.existing.items()}
+        self.clients = {client: owner_ip(index // SHARES_PER_OWNER) for client, index in plan.owners.items()}
+        used = {share.code for share in sandbox.shares}
+        self.free_codes = [code for code in random.Random(seed).sample(range(*CODES_RANGE), 4096) if code not in used]
+        self.created = Resolver()
+        self.grants = Resolver()
+        self.local = threading.local()
+
+        largest = max([entry.request_b for entry in entries if entry.route in CREATING_ROUTES] + [entry.extra.get("size", 0) for entry in entries] + [0])
+        self.content = os.urandom(largest)
+
+    def client_ip(self, client: str) -> str:
+        with self.lock:
+            address = self.clients.get(client)
+            if address is None:
+                index = len(self.clients) + 1
+                address = self.clients[client] = f"172.{16 + (index >> 16) % 16}.{(index >> 8) & 255}.{index & 255}"
+            return address
+
+    def resolve_code(self, token: str) -> int:
+        if token in self.plan.created:
+            code = self.created.wait(token)
+            if code is not None:
+                return code
+
+        with self.lock:
+            code = self.codes.get(token)
+            if code is None:
+                code = self.codes[token] = self.free_codes.pop() if self.free_codes else CODES_RANGE[1]
+            return code
+
+    def build_request(self, entry: Entry) -> tuple[str, bytes | None, dict[str, str]] | None:
+        """ Returns (url, body, headers) for recorded entry, None if it can't be replayed. """
+        headers = {"X-Forwarded-For": self.client_ip(entry.client)}
+        extra = entry.extra
+
+        if entry.route == TRANSFER_ROUTE:
+            if "grant" in extra:
+                token = self.grants.wait(extra["grant"])
+                if token:
+                    headers["X-Upload-Token"] = token
+            files = max(1, extra.get("files", 1))
+            overhead = len(build_form([0] * files, extra.get("expire", 0), extra.get("max_downloads", 0), b"")[0])
+            size = max(0, entry.request_b - overhead)
+            sizes = [size // files + (1 if index < size % files else 0) for index in range(files)]
+            body, headers["Content-Type"] = build_form(sizes, extra.get("expire", 0), extra.get("max_downloads", 0), self.content)
+            return TRANSFER_ROUTE, body, headers
+
+        if entry.route == PREFLIGHT_ROUTE:
+            files = max(1, extra.get("files", 1))
+            size = extra.get("size", 0)
+            body = json.dumps({
+                "files": [{"name": f"replay-{index}.bin", "size": size // files + (1 if index < size % files else 0)} for index in range(files)],
+                "expire": extra.get("expire", 0),
+                "max_downloads": extra.get("max_downloads", 0),
+            }).encode()
+            headers["Content-Type"] = "application/json"
+            return PREFLIGHT_ROUTE, body, headers
+
+        if entry.route.startswith("/web/static") and "path" in entry.params:
+            return f"/web/static/{entry.params['path'].lstrip('/')}", None, headers
+        if "{" not in entry.route:
+            return entry.route, None, headers
+        if entry.route in CODE_ROUTES and "code" in entry.params:
+            url = entry.route.replace("{code}", str(self.resolve_code(entry.params["code"])))
+            return url.replace("{index}", str(entry.params.get("index", 0))), None, headers
+        return None
+
+    def on_response(self, entry: Entry, status: int, payload: bytes) -> None:
+        """ Resolve codes and upload tokens created by this request. """
+        if entry.route not in CREATING_ROUTES:
+            return
+        try:
+            result = json.loads(payload) if status == 200 else {}
+        except ValueError:
+            result = {}
+        if "code" in entry.extra:
+            self.created.resolve(entry.extra["code"], result.get("code"))
+        if "grant" in entry.extra and entry.route == PREFLIGHT_ROUTE:
+            self.grants.resolve(entry.extra["grant"], result.get("token"))
+
+    def connection(self) -> http.client.HTTPConnection:
+        if getattr(self.local, "connection", None) is None:
+            self.local.connection = http.client.HTTPConnection("127.0.0.1", self.sandbox.port, timeout=60)
+        return self.local.connection
+
+    def send(self, entry: Entry, due: float) -> None:
+        lag = max(0.0, time.perf_counter() - due)
+        built = self.build_request(entry)
+        if built is None:
+            with self.lock:
+                self.skipped += 1
+            self.on_response(entry, 0, b"")
+            return
+        url, body, headers = built
+
+        with self.lock:
+            stats = self.stats.setdefault(entry.route, EndpointStats())
+            self.lags.append(lag)
+
+        started = time.perf_counter()
+        try:
+            connection = self.connection()
+            connection.request(entry.method, url, body=body, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.local.connection.close()
+            self.local.connection = None
+            with self.lock:
+                stats.errors += 1
+            self.on_response(entry, 0, b"")
+            return
+        elapsed = time.perf_counter() - started
+
+        self.on_response(entry, status, payload)
+        with self.lock:
+            stats.latencies.append(elapsed)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.bytes_sent += len(body or b"")
+            stats.bytes_received += len(payload)
+            if status >= 500:
+                stats.errors += 1
+            if status == entry.status:
+                self.matched[entry.route] = self.matched.get(entry.route, 0) + 1
+
+    def run(self, concurrency: int) -> float:
+        """ Issue all entries on schedule. Returns wall time. """
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for entry in self.entries:
+                due = started + entry.offset_s / self.speed if self.speed else time.perf_counter()
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, entry, due)
+        return time.perf_counter() - started
+
+    def summary(self, wall_s: float) -> dict:
+        routes = {}
+        for route, stats in sorted(self.stats.items()):
+            routes[route] = stats.summary(wall_s)
+            routes[route]["status_match"] = round(self.matched.get(route, 0) / len(stats.latencies), 4) if stats.latencies else 0.0
+            del routes[route]["peak_rss_b"]
+
+        lags = sorted(self.lags)
+        total = sum(len(stats.latencies) for stats in self.stats.values())
+        return {
+            "wall_s": round(wall_s, 3),
+            "total_requests": total,
+            "skipped": self.skipped,
+            "throughput_rps": round(total / wall_s, 2) if wall_s else 0.0,
+            "lag_p95_ms": round(percentile(lags, 0.95) * 1000, 3),
+            "lag_max_ms": round(lags[-1] * 1000, 3) if lags else 0.0,
+            "routes": routes,
+        }
+
+
+def summarize_recording(entries: list[Entry]) -> dict:
+    """ Recorded latencies per route, for reference. """
+    durations: dict[str, list[float]] = {}
+    for entry in entries:
+        durations.setdefault(entry.route, []).append(entry.duration_s)
+    span_s = entries[-1].offset_s - entries[0].offset_s if entries else 0.0
+    return {
+        "requests": len(entries),
+        "span_s": round(span_s, 3),
+        "clients": len({entry.client for entry in entries}),
+        "routes": {
+            route: {
+                "count": len(values),
+                "p50_ms": round(percentile(sorted(values), 0.50) * 1000, 3),
+                "p95_ms": round(percentile(sorted(values), 0.95) * 1000, 3),
+            }
+            for route, values in sorted(durations.items())
+        },
+    }
+
+
+def diff_runs(current: dict, previous: dict) -> dict:
+    """ Per-route deltas (current - previous). """
+    deltas = {}
+    for route, after in current["routes"].items():
+        before = previous["routes"].get(route)
+        if before is None:
+            continue
+        deltas[route] = {metric: round(after[metric] - before[metric], 4) for metric in DELTA_METRICS}
+    deltas["total"] = {"throughput_rps": round(current["throughput_rps"] - previous["throughput_rps"], 2)}
+    return deltas
+
+
+def replay_once(args: argparse.Namespace, source: str, plan: Plan, entries: list[Entry]) -> dict:
+    sandbox = create_sandbox(source, len(plan.sizes) + args.shares, hot_shares=0, seed=args.seed, sizes=plan.sizes)
+    try:
+        sandbox.launch(args.port, dict(item.split("=", 1) for item in args.env))
+        replayer = Replayer(sandbox, plan, entries, args.speed, args.seed)
+        wall_s = replayer.run(args.concurrency)
+        run = replayer.summary(wall_s)
+        run["source"] = os.path.abspath(source)
+        run["revision"] = git_revision(source)
+        return run
+
+    finally:
+        if args.keep:
+            sandbox.stop()
+            print(f"sandbox kept at: {sandbox.root}", file=sys.stderr)
+        else:
+            sandbox.remove()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="replay recorded quicksh traffic")
+    parser.add_argument("recording", help="traffic-*.jsonl written with TRAFFIC_RECORD=1")
+    parser.add_argument("--source", default=REPO_ROOT, help="source tree to replay against (default: this repo)")
+    parser.add_argument("--compare", help="second source tree, replayed on an identical sandbox")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier, 0 = as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=32, help="max requests in flight")
+    parser.add_argument("--shares", type=int, default=1000, help="background rows added to the synthetic table")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE passed to the server, repeatable")
+    parser.add_argument("--port", type=int, default=18440)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="previous JSON report to diff against")
+    parser.add_argument("--keep", action="store_true", help="keep sandboxes for inspection")
+    args = parser.parse_args()
+
+    header, entries = load_recording(args.recording)
+    plan = build_plan(entries)
+    report = {
+        "meta": {
+            "recording": os.path.abspath(args.recording),
+            "recorded_at": header.get("started"),
+            "speed": args.speed,
+            "concurrency": args.concurrency,
+            "existing_shares": len(plan.existing),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started": int(time.time()),
+        },
+        "recorded": summarize_recording(entries),
+        "runs": {},
+    }
+
+    print(f"replaying {len(entries)} requests against {args.source} at {args.speed or 'max'}x", file=sys.stderr)
+    report["runs"]["source"] = replay_once(args, args.source, plan, entries)
+    if args.compare:
+        print(f"replaying {len(entries)} requests against {args.compare}", file=sys.stderr)
+        report["runs"]["compare"] = replay_once(args, args.compare, plan, entries)
+        report["diff"] = diff_runs(report["runs"]["compare"], report["runs"]["source"])
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf8") as baseline_file:
+            baseline = json.load(baseline_file)
+        report["baseline_delta"] = diff_runs(report["runs"]["source"], baseline["runs"]["source"])
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+Module: s3server.py
+
+Description:
+    Minimal S3-compatible stand-in server for testing modules/blobstore.S3BlobStore.
+
+    Objects are files under --root (`<root>/<bucket>/<key>`), buckets are created
+    on first write. Requests must carry a valid AWS Signature V4 for the configured
+    credentials (checked with the same canonicalization as the client) and uploaded
+    bodies must match x-amz-content-sha256.
+
+    Supported operations (path-style):
+        PUT    /bucket/key                          put object
+        GET    /bucket/key, HEAD /bucket/key        get object (streamed) / metadata
+        DELETE /bucket/key                          delete object
+        POST   /bucket/key?uploads                  initiate multipart upload
+        PUT    /bucket/key?partNumber=N&uploadId=I  upload part
+        POST   /bucket/key?uploadId=I               complete multipart upload
+        DELETE /bucket/key?uploadId=I               abort multipart upload
+        GET    /bucket?list-type=2&prefix=P         ListObjectsV2 (continuation-token, max-keys)
+
+Usage:
+    python -m tools.s3server --port 9000 --root /tmp/s3 --access-key test --secret-key test
+    BLOB_STORE=s3 S3_ENDPOINT=http://127.0.0.1:9000 S3_ACCESS_KEY=test S3_SECRET_KEY=test python main.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.blobstore import sign_request
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, urlsplit, parse_qsl
+from xml.sax.saxutils import escape
+import xml.etree.ElementTree as ElementTree
+import email.utils
+import threading
+import argparse
+import hashlib
+import shutil
+import hmac
+import uuid
+import re
+
+
+CHUNK_SIZE = 1024 * 1024
+XML_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+AUTHORIZATION = re.compile(r"AWS4-HMAC-SHA256 Credential=([^/]+)/([^,]+), SignedHeaders=([^,]+), Signature=([0-9a-f]+)")
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    server: "S3Server"
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_xml(self, status: int, body: str) -> None:
+        content = ('<?xml version="1.0" encoding="UTF-8"?>' + body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    def send_error_xml(self, status: int, code: str) -> None:
+        self.send_xml(status, f"<Error><Code>{code}</Code></Error>")
+
+    def send_empty(self, status: int, headers: dict[str, str] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def parse_target(self) -> tuple[str, str, dict[str, str]]:
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+        return bucket, key, dict(parse_qsl(url.query, keep_blank_values=True))
+
+    def is_authorized(self, query: dict[str, str]) -> bool:
+        match = AUTHORIZATION.fullmatch(self.headers.get("Authorization", ""))
+        if match is None or match.group(1) != self.server.access_key:
+            return False
+
+        scope = match.group(2).split("/")
+        expected = sign_request(
+            self.command,
+            self.headers.get("Host", ""),
+            unquote(urlsplit(self.path).path),
+            query,
+            self.headers.get("x-amz-content-sha256", ""),
+            self.server.access_key,
+            self.server.secret_key,
+            scope[1] if len(scope) > 1 else "",
+            self.headers.get("x-amz-date", ""),
+        )
+        return hmac.compare_digest(expected["authorization"], self.headers["Authorization"])
+
+    def read_body(self, destination=None) -> bytes:
+        """ Read request body (into destination file if given), verifying it's sha256. """
+        remaining = int(self.headers.get("Content-Length", 0))
+        digest = hashlib.sha256()
+        collected = bytearray()
+        while remaining:
+            chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            digest.update(chunk)
+            if destination is not None:
+                destination.write(chunk)
+            else:
+                collected += chunk
+
+        if digest.hexdigest() != self.headers.get("x-amz-content-sha256"):
+            raise ValueError("payload hash mismatch")
+        return bytes(collected)
+
+    def handle_request(self) -> None:
+        bucket, key, query = self.parse_target()
+        if not self.is_authorized(query):
+            self.send_error_xml(403, "SignatureDoesNotMatch")
+            return
+
+        try:
+            if not key:
+                if self.command == "GET" and query.get("list-type") == "2":
+                    self.list_objects(bucket, query)
+                    return
+                self.send_error_xml(400, "InvalidRequest")
+                return
+
+            if self.command == "PUT":
+                self.put(bucket, key, query)
+            elif self.command == "POST":
+                self.post(bucket, key, query)
+            elif self.command in ("GET", "HEAD"):
+                self.get(bucket, key)
+            elif self.command == "DELETE":
+                self.delete(bucket, key, query)
+        except ValueError:
+            self.send_error_xml(400, "BadDigest")
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = handle_request
+
+    def put(self, bucket: str, key: str, query: dict[str, str]) -> None:
+        if "uploadId" in query:
+            upload_dir = self.server.upload_path(query["uploadId"])
+            if not os.path.isdir(upload_dir):
+                self.send_error_xml(404, "NoSuchUpload")
+                return
+            part_path = os.path.join(upload_dir, str(int(query["partNumber"])))
+            with open(part_path, "wb") as part:
+                self.read_body(part)
+            self.send_empty(200, {"ETag": f'"{self.server.file_md5(part_path)}"'})
+            return
+
+        path = self.server.object_path(bucket, key)
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temporary, "wb") as blob:
+                self.read_body(blob)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        self.send_empty(200, {"ETag": f'"{self.server.file_md5(path)}"'})
+
+    def post(self, bucket: str, key: str, query: dict[str, str]) -> None:
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            os.makedirs(self.server.upload_path(upload_id))
+            self.send_xml(200, (
+                f'<InitiateMultipartUploadResult xmlns="{XML_NAMESPACE}"><Bucket>{escape(bucket)}</Bucket>'
+                f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            ))
+            return
+
+        upload_dir = self.server.upload_path(query.get("uploadId", ""))
+        if not os.path.isdir(upload_dir):
+            self.send_error_xml(404, "NoSuchUpload")
+            return
+
+        root = ElementTree.fromstring(self.read_body())
+        numbers = [int(part.findtext("PartNumber")) for part in root.iter("Part")]
+        path = self.server.object_path(bucket, key)
+        with open(path, "wb") as blob:
+            for number in numbers:
+                with open(os.path.join(upload_dir, str(number)), "rb") as part:
+                    shutil.copyfileobj(part, blob, CHUNK_SIZE)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        self.send_xml(200, f'<CompleteMultipartUploadResult xmlns="{XML_NAMESPACE}"><Key>{escape(key)}</Key></CompleteMultipartUploadResult>')
+
+    def get(self, bucket: str, key: str) -> None:
+        path = self.server.object_path(bucket, key, create=False)
+        if not os.path.isfile(path):
+            self.send_error_xml(404, "NoSuchKey")
+            return
+
+        stat = os.stat(path)
+        self.send_response(200)
+        self.send_header("Content-Length", str(stat.st_size))
+        self.send_header("Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+
+        with open(path, "rb") as blob:
+            while chunk := blob.read(CHUNK_SIZE):
+                self.wfile.write(chunk)
+
+    def delete(self, bucket: str, key: str, query: dict[str, str]) -> None:
+        if "uploadId" in query:
+            shutil.rmtree(self.server.upload_path(query["uploadId"]), ignore_errors=True)
+        else:
+            try:
+                os.remove(self.server.object_path(bucket, key, create=False))
+            except FileNotFoundError:
+                pass
+        self.send_empty(204)
+
+    def list_objects(self, bucket: str, query: dict[str, str]) -> None:
+        prefix = query.get("prefix", "")
+        after = query.get("continuation-token", "")
+        max_keys = int(query.get("max-keys", 1000))
+
+        bucket_root = os.path.join(self.server.root, bucket)
+        keys = []
+        for directory, _, files in os.walk(bucket_root):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), bucket_root).replace(os.sep, "/")
+                if key.startswith(prefix) and key > after:
+                    keys.append(key)
+        keys.sort()
+
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        contents = ""
+        for key in page:
+            stat = os.stat(os.path.join(bucket_root, key))
+            modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+            iso_modified = email.utils.parsedate_to_datetime(modified).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            contents += f"<Contents><Key>{escape(key)}</Key><Size>{stat.st_size}</Size><LastModified>{iso_modified}</LastModified></Contents>"
+
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+        self.send_xml(200, (
+            f'<ListBucketResult xmlns="{XML_NAMESPACE}"><Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>'
+            f"<KeyCount>{len(page)}</KeyCount><IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+            f"{token}{contents}</ListBucketResult>"
+        ))
+
+
+class S3Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], root: str, access_key: str, secret_key: str, verbose: bool = False) -> None:
+        super().__init__(address, S3Handler)
+        self.root = root
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.verbose = verbose
+        os.makedirs(os.path.join(root, ".uploads"), exist_ok=True)
+
+    def object_path(self, bucket: str, key: str, create: bool = True) -> str:
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError("key escapes root")
+        if create:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def upload_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, ".uploads", re.sub(r"[^0-9a-f]", "", upload_id))
+
+    @staticmethod
+    def file_md5(path: str) -> str:
+        digest = hashlib.md5()
+        with open(path, "rb") as blob:
+            while chunk := blob.read(CHUNK_SIZE):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+def start_server(root: str, port: int = 0, access_key: str = "test", secret_key: str = "test") -> S3Server:
+    """ Serve in background thread. server.server_port holds the bound port. """
+    server = S3Server(("127.0.0.1", port), root, access_key, secret_key)
+    threading.Thread(target=server.serve_forever, name="s3-standin", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="S3-compatible stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--root", required=True, help="directory holding buckets")
+    parser.add_argument("--access-key", default="test")
+    parser.add_argument("--secret-key", default="test")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = S3Server((args.host, args.port), args.root, args.access_key, args.secret_key, args.verbose)
+    print(f"S3 stand-in on http://{args.host}:{server.server_port} (root: {args.root})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
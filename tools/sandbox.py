@@ -0,0 +1,198 @@
+"""
+Module: sandbox.py
+
+Description:
+    Disposable quicksh instances for benchmarks and local experiments.
+
+    The application resolves ./data/, ./logs/ and ./web/ relative to the
+    working directory, so a sandbox is a temporary directory that links
+    main.py, modules/ and web/ of a source tree and owns a private data/
+    directory. Nothing from the source tree's data/ is touched.
+
+    Functions:
+        - create_sandbox(source: str, shares: int, hot_shares: int, hot_size: int) -> Sandbox
+          Build sandbox and pre-populate data/shares.json with synthetic rows.
+        - Sandbox.launch(port: int, env: dict = None) -> subprocess.Popen
+          Start uvicorn inside sandbox and wait until "/" answers.
+        - read_rss(pid: int) -> int
+          Current resident set size of a process in bytes (0 if unknown).
+"""
+from dataclasses import dataclass, field
+import http.client
+import subprocess
+import tempfile
+import hashlib
+import random
+import shutil
+import time
+import json
+import sys
+import os
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINKED_ITEMS = ("main.py", "modules", "web")
+CODES_RANGE = (10000, 99999)
+SHARES_PER_OWNER = 4
+
+DEFAULT_ENV = {
+    "MAX_DATA_SIZE_MB": str(1024 * 1024),
+    "MAX_SHARES_PER_IP": "5",
+}
+
+
+def hash_ip(ip: str) -> str:
+    """ Same owner hashing as modules.transfers.hash_ip (kept import-free). """
+    return hashlib.sha256(ip.encode()).hexdigest()
+
+
+def owner_ip(index: int) -> str:
+    """ Deterministic synthetic owner address. """
+    return f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+
+
+def read_rss(pid: int) -> int:
+    """ Current resident set size of a process in bytes (0 if unknown). """
+    try:
+        with open(f"/proc/{pid}/status", "r") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+@dataclass
+class Share:
+    code: int
+    owner: str
+    size: int
+
+
+@dataclass
+class Sandbox:
+    root: str
+    shares: list[Share] = field(default_factory=list)
+    hot_codes: list[int] = field(default_factory=list)
+    process: subprocess.Popen | None = None
+    port: int | None = None
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.root, "data")
+
+    def launch(self, port: int, env: dict[str, str] = None, timeout: float = 120.0) -> subprocess.Popen:
+        """ Start uvicorn inside sandbox and wait until "/" answers. """
+        process_env = dict(os.environ)
+        process_env.update(DEFAULT_ENV)
+        process_env.update(env or {})
+
+        log_file = open(os.path.join(self.root, "server.log"), "ab")
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "main:api",
+                "--host", "127.0.0.1",
+                "--port", str(port),
+                "--proxy-headers",
+                "--forwarded-allow-ips", "*",
+                "--no-access-log",
+            ],
+            cwd=self.root,
+            env=process_env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+        self.port = port
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited with code {self.process.returncode} (see {self.root}/server.log)")
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                connection.request("GET", "/", headers={"X-Forwarded-For": "127.0.0.2"})
+                connection.getresponse().read()
+                connection.close()
+                return self.process
+            except OSError:
+                time.sleep(0.05)
+
+        self.stop()
+        raise TimeoutError(f"server did not start within {timeout}s")
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def remove(self) -> None:
+        self.stop()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def create_sandbox(
+    source: str = REPO_ROOT,
+    shares: int = 1000,
+    hot_shares: int = 100,
+    hot_size: int = 64 * 1024,
+    lifetime_s: int = 3 * 24 * 3600,
+    seed: int = 0,
+    sizes: list[int] | None = None
+) -> Sandbox:
+    """
+    Build sandbox linked to `source` tree with `shares` synthetic rows.
+    First `hot_shares` rows get a real blob of `hot_size` bytes, the rest an empty blob,
+    so every row is downloadable and deletable. `sizes` overrides blob sizes of the first rows.
+    """
+    if shares > CODES_RANGE[1] - CODES_RANGE[0]:
+        raise ValueError(f"at most {CODES_RANGE[1] - CODES_RANGE[0]} shares fit into the code space")
+
+    root = tempfile.mkdtemp(prefix="quicksh-sandbox-")
+    for item in LINKED_ITEMS:
+        os.symlink(os.path.join(os.path.abspath(source), item), os.path.join(root, item))
+    os.makedirs(os.path.join(root, "data", "shared"))
+    os.makedirs(os.path.join(root, "logs"))
+
+    rng = random.Random(seed)
+    codes = rng.sample(range(*CODES_RANGE), shares)
+    now = int(time.time())
+    hot_body = os.urandom(hot_size)
+
+    sandbox = Sandbox(root)
+    rows = {}
+    for index, code in enumerate(codes):
+        owner = owner_ip(index // SHARES_PER_OWNER)
+        is_hot = index < hot_shares
+        size = hot_size if is_hot else 0
+        if sizes is not None and index < len(sizes):
+            size = sizes[index]
+
+        rows[str(code)] = {
+            "code": code,
+            "name": f"file-{code}.bin",
+            "size": size,
+            "date_created": now,
+            "date_expire": now + lifetime_s,
+            "owner_ip": hash_ip(owner),
+        }
+        with open(os.path.join(root, "data", "shared", str(code)), "wb") as blob:
+            if size == hot_size and is_hot:
+                blob.write(hot_body)
+            elif size:
+                blob.write(os.urandom(size))
+
+        sandbox.shares.append(Share(code, owner, size))
+        if is_hot:
+            sandbox.hot_codes.append(code)
+
+    with open(os.path.join(root, "data", "shares.json"), "w", encoding="utf8") as db_file:
+        json.dump(rows, db_file)
+
+    return sandbox
@@ -0,0 +1,213 @@
+"""
+Module: standby.py
+
+Description:
+    Primary + warm standby pair for testing metadata replication (modules/replication.py).
+
+    Starts an S3 stand-in (tools/s3server.py) shared by both nodes for blobs, a primary
+    sandbox and a standby sandbox following it (REPLICA_OF). With --check it writes
+    through the primary (uploads, downloads, deletes) while sampling the standby's lag,
+    waits until the standby's shares table equals the primary's, verifies the standby
+    rejects public requests, then stops the primary, promotes the standby and downloads
+    codes created on the primary from it. Prints a JSON summary.
+
+Usage:
+    python -m tools.standby --check --writes 200
+    python -m tools.standby --base-port 18600        # keep running until Ctrl+C
+"""
+from tools.sandbox import create_sandbox, REPO_ROOT
+from tools.cluster import request, upload
+from tools.s3server import start_server
+
+import threading
+import argparse
+import tempfile
+import shutil
+import time
+import json
+import os
+
+
+ADMIN_TOKEN = "standby-check"
+ADMIN_HEADERS = {"X-Admin-Token": ADMIN_TOKEN}
+CONVERGE_TIMEOUT_S = 30.0
+
+
+def admin_request(port: int, method: str, path: str) -> dict:
+    status, _, body = request(port, method, path, "127.0.0.1", headers=ADMIN_HEADERS)
+    if status != 200:
+        raise RuntimeError(f"{method} {path} on port {port} failed: {status} {body[:200]!r}")
+    return json.loads(body)["response"]
+
+
+def replication_stats(port: int) -> dict:
+    return admin_request(port, "GET", "/api/admin/metrics")["replication"]
+
+
+def read_table(sandbox) -> dict:
+    with open(os.path.join(sandbox.data_path, "shares.json"), "r") as file:
+        return json.load(file)
+
+
+class LagSampler:
+    """ Poll standby's follower stats in background, keeping the worst lag seen. """
+    def __init__(self, port: int, interval_s: float = 0.1) -> None:
+        self.port = port
+        self.interval_s = interval_s
+        self.max_lag_changes = 0
+        self.max_delay_s = 0.0
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+
+    def __run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                follower = replication_stats(self.port)["follower"]
+            except (OSError, RuntimeError):
+                continue
+            self.samples += 1
+            self.max_lag_changes = max(self.max_lag_changes, follower["lag_changes"])
+            self.max_delay_s = max(self.max_delay_s, follower["delay_s"] or 0)
+
+    def __enter__(self) -> "LagSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def wait_converged(primary, standby) -> float | None:
+    """ Seconds until standby's table equals primary's, None on timeout. """
+    started = time.perf_counter()
+    while time.perf_counter() - started < CONVERGE_TIMEOUT_S:
+        if read_table(primary) == read_table(standby):
+            return round(time.perf_counter() - started, 3)
+        time.sleep(0.1)
+    return None
+
+
+def run_check(primary, standby, writes: int) -> dict:
+    contents = {}
+    deleted = []
+    with LagSampler(standby.port) as sampler:
+        started = time.perf_counter()
+        for index in range(writes):
+            client_ip = f"10.210.{index // 250}.{index % 250 + 1}"
+            content = os.urandom(512 + index)
+            code = upload(primary.port, client_ip, content)
+            contents[code] = (client_ip, content)
+
+            status, _, _ = request(primary.port, "GET", f"/api/receive/{code}", client_ip.replace("10.210.", "10.220.", 1))
+            if status != 200:
+                raise RuntimeError(f"download of {code} from primary failed: {status}")
+            if index % 4 == 3:
+                status, _, _ = request(primary.port, "DELETE", f"/api/delete/{code}", client_ip)
+                if status == 200:
+                    deleted.append(code)
+                    del contents[code]
+        write_s = time.perf_counter() - started
+
+        # Download counts are written in batches, the table settles after the counter's flush.
+        time.sleep(6)
+        converge_s = wait_converged(primary, standby)
+
+    primary_log = replication_stats(primary.port)["change_log"]
+    follower = replication_stats(standby.port)["follower"]
+    read_only_status, _, _ = request(standby.port, "GET", f"/api/receive/{next(iter(contents))}", "10.220.0.2")
+
+    primary.stop()
+    promoted = admin_request(standby.port, "POST", "/api/admin/replication/promote")
+    receive_failures = []
+    for code, (client_ip, content) in contents.items():
+        status, _, body = request(standby.port, "GET", f"/api/receive/{code}", client_ip)
+        if status != 200 or body != content:
+            receive_failures.append({"code": code, "status": status})
+    gone_statuses = sorted({request(standby.port, "GET", f"/api/receive/{code}", "10.240.0.1")[0] for code in deleted[:50]})
+    new_code = upload(standby.port, "10.230.0.1", b"after failover")
+
+    return {
+        "writes": writes,
+        "write_rate_per_s": round(writes / write_s, 1),
+        "primary_change_log": primary_log,
+        "standby": {
+            "catch_up_s": follower["catch_up_s"],
+            "snapshots": follower["snapshots"],
+            "applied_changes": follower["applied_changes"],
+            "max_lag_changes": sampler.max_lag_changes,
+            "max_delay_s": sampler.max_delay_s,
+            "lag_samples": sampler.samples,
+            "converged_after_s": converge_s,
+            "read_only_status": read_only_status,
+        },
+        "failover": {
+            "promoted_at_seq": promoted["applied_seq"],
+            "receive_failures": receive_failures,
+            "deleted_statuses": gone_statuses,
+            "upload_after_promotion": new_code,
+        },
+        "ok": converge_s is not None
+            and read_only_status == 503
+            and not receive_failures
+            and gone_statuses in ([], [400])
+            and follower["snapshots"] == 1,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="run a local primary + warm standby pair")
+    parser.add_argument("--source", default=REPO_ROOT, help="source tree to run (default: this repo)")
+    parser.add_argument("--base-port", type=int, default=18600)
+    parser.add_argument("--shares", type=int, default=1000, help="synthetic rows in primary's table before start")
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--check", action="store_true", help="run failover test and exit")
+    parser.add_argument("--keep", action="store_true", help="keep sandboxes for inspection")
+    args = parser.parse_args()
+
+    s3_root = tempfile.mkdtemp(prefix="quicksh-s3-")
+    s3 = start_server(s3_root)
+    common_env = {
+        "ADMIN_TOKEN": ADMIN_TOKEN,
+        "BLOB_STORE": "s3",
+        "S3_ENDPOINT": f"http://127.0.0.1:{s3.server_port}",
+        "S3_BUCKET": "quicksh",
+        "S3_ACCESS_KEY": "test",
+        "S3_SECRET_KEY": "test",
+    }
+    primary_port, standby_port = args.base_port, args.base_port + 1
+    sandboxes = []
+    try:
+        # Synthetic rows have no blobs, they only give the snapshot realistic size.
+        primary = create_sandbox(args.source, shares=args.shares, hot_shares=0)
+        sandboxes.append(primary)
+        primary.launch(primary_port, common_env)
+        print(f"primary: http://127.0.0.1:{primary_port} ({primary.root})")
+
+        standby = create_sandbox(args.source, shares=0, hot_shares=0)
+        sandboxes.append(standby)
+        standby.launch(standby_port, {**common_env, "REPLICA_OF": f"http://127.0.0.1:{primary_port}", "REPLICA_TOKEN": ADMIN_TOKEN})
+        print(f"standby: http://127.0.0.1:{standby_port} ({standby.root})")
+
+        if args.check:
+            print(json.dumps(run_check(primary, standby, args.writes), indent=2))
+            return
+
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for sandbox in sandboxes:
+            if args.keep:
+                sandbox.stop()
+            else:
+                sandbox.remove()
+        s3.shutdown()
+        if not args.keep:
+            shutil.rmtree(s3_root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
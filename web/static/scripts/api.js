@@ -1,15 +1,42 @@
 const API = "https://quicksh.cc/api/";
+const OWNED_CODES_POLL_MS = 30000;
 
 
 function sendTransferFile() {
     if (selectedFile === null) { return; }
-    
+
+    const preflightOptions = {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            name: selectedFile.name,
+            size: selectedFile.size,
+            expire: parseInt(selectedDuration)
+        })
+    };
+
+    // Limits are checked before the file is sent, rejected uploads don't waste bandwidth.
+    fetch(API + "transfer/preflight", preflightOptions)
+        .then(response => response.json())
+        .then(result => {
+            if (!result.status) { return showTransStatus(result.error); }
+            uploadTransferFile(result.token);
+        })
+        .catch(error => {
+            console.error('Error while sending TRANSFER/PREFLIGHT request', error);
+            showTransStatus("Failed to transfer file.");
+        });
+}
+
+
+function uploadTransferFile(token) {
     const formData = new FormData();
     formData.append('file', selectedFile);
     formData.append('expire', selectedDuration);
 
     const options = {
         method: 'POST',
+        headers: { 'X-Upload-Token': token },
         body: formData
     };
 
@@ -120,24 +147,48 @@ function removeTransfer(code) {
 }
 
 
+let ownedCodesVersion = null;
+let ownedCodesFetchedAt = 0;
+
 function fetchOwnedCodes() {
+    ownedCodesFetchedAt = Date.now();
     const options = {
         method: 'GET'
     };
 
-    fetch(API + "owned-codes", options)
+    // After the first listing only changes since the last seen version are sent.
+    const query = ownedCodesVersion ? "?since=" + encodeURIComponent(ownedCodesVersion) : "";
+    fetch(API + "owned-codes" + query, options)
         .then(response => response.json())
         .then(result => {
             if (!result.status) { return showTransStatus(result.error); }
-            
+
+            if (!result.delta) {
+                clearHistoryRows();
+            }
+            for (const code of result.removed || []) {
+                removeHistoryRow(code);
+            }
             for (const [code, data] of Object.entries(result.response)) {
-                const name = data.file;
-                const expire = data.expire;
-                addHistoryRow(code, name, expire);
+                if (!hasHistoryRow(code)) {
+                    addHistoryRow(code, data.file, data.expire);
+                }
             }
-            
+            ownedCodesVersion = result.version;
         })
         .catch(error => {
             console.error('Error while sending OWNED-CODES/ request', error);
         });
 }
+
+
+// Polls count against the API rate limit shared with uploads, so only an open history window is refreshed.
+function refreshOwnedCodes() {
+    if (Date.now() - ownedCodesFetchedAt >= OWNED_CODES_POLL_MS) { fetchOwnedCodes(); }
+}
+
+function pollOwnedCodes() {
+    setInterval(() => {
+        if (!document.hidden && isHistoryWindowOpen()) { refreshOwnedCodes(); }
+    }, OWNED_CODES_POLL_MS);
+}
@@ -44,6 +44,11 @@ const HISTORY_WINDOW = document.getElementsByClassName("uploads-history-containe
 
 function openHistoryWindow() {
     HISTORY_WINDOW.setAttribute("fold", "0");
+    refreshOwnedCodes();
+}
+
+function isHistoryWindowOpen() {
+    return HISTORY_WINDOW.getAttribute("fold") == "0";
 }
 
 function hideHistoryWindow() {
@@ -104,6 +109,14 @@ function removeHistoryRow(code) {
     document.getElementById(`${code}`)?.remove();
 }
 
+function hasHistoryRow(code) {
+    return HIST_ROWS_CONTAINER.querySelector(`[id="${code}"]`) !== null;
+}
+
+function clearHistoryRows() {
+    HIST_ROWS_CONTAINER.replaceChildren();
+}
+
 
 // -- AUTO FILL CODE
 function checkPathForCode() {